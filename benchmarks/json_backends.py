@@ -0,0 +1,62 @@
+"""
+Compares the JSON backends jsonrpclib can use (see
+Config.json_backend) on a few typical messages. Only the backends
+that are installed are measured. Run it from the repository root:
+
+    python benchmarks/json_backends.py [--number 20000]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import jsonrpclib  # noqa: E402
+from jsonrpclib.config import JSON_BACKENDS  # noqa: E402
+
+
+def payloads():
+    small = jsonrpclib.dumps([1, 2], 'add', rpcid='abc123')
+    records = [{'id': i, 'name': 'user %d' % i, 'score': i * 1.5,
+                'tags': ['a', 'b', 'c'], 'active': i % 2 == 0}
+               for i in range(100)]
+    large = jsonrpclib.dumps([records], 'store', rpcid='abc123')
+    batch = '[%s]' % ','.join(
+        jsonrpclib.dumps([i, i], 'add', rpcid=str(i)) for i in range(100))
+    return [('single call', small), ('100 records', large),
+            ('batch of 100', batch)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--number', type=int, default=20000,
+                        help='messages encoded and decoded per measurement')
+    args = parser.parse_args()
+
+    config = jsonrpclib.config
+    # jsonclass handling costs the same for every backend, leave it out.
+    config.use_jsonclass = False
+    print('%-14s %-10s %14s %14s %9s' % (
+        'payload', 'backend', 'dumps ops/s', 'loads ops/s', 'speedup'))
+    for label, message in payloads():
+        data = jsonrpclib.loads(message)
+        baseline = None
+        for name in sorted(JSON_BACKENDS, key=lambda n: n != 'json'):
+            config.json_backend = name
+            number = max(1, args.number // max(1, len(message) // 100))
+            dumps_time = timeit.timeit(
+                lambda: jsonrpclib.jsonrpc.jdumps(data), number=number)
+            loads_time = timeit.timeit(
+                lambda: jsonrpclib.loads(message), number=number)
+            total = dumps_time + loads_time
+            if baseline is None:
+                baseline = total
+            print('%-14s %-10s %14.0f %14.0f %8.2fx' % (
+                label, name, number / dumps_time, number / loads_time,
+                baseline / total))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Compares jsonclass.dump / jsonclass.load against the recursive
+traversal they replaced, on payloads of a given encoded size. The
+recursive versions below translate each object exactly like jsonclass
+does, so only the traversal differs. Run it from the repository root:
+
+    python benchmarks/jsonclass_traversal.py [--sizes 1 50] [--repeat 3]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from jsonrpclib import config  # noqa: E402
+from jsonrpclib import jsonclass  # noqa: E402
+
+
+def recursive_dump(obj, serialize_method=None, ignore_attribute=None,
+                   ignore=[]):
+    if not serialize_method:
+        serialize_method = config.serialize_method
+    if not ignore_attribute:
+        ignore_attribute = config.ignore_attribute
+    if isinstance(obj, (list, tuple)):
+        new_obj = []
+        for item in obj:
+            new_obj.append(
+                recursive_dump(item, serialize_method, ignore_attribute,
+                               ignore))
+        if isinstance(obj, tuple):
+            new_obj = tuple(new_obj)
+        return new_obj
+    if isinstance(obj, dict):
+        new_obj = {}
+        for key, value in obj.items():
+            new_obj[key] = recursive_dump(
+                value, serialize_method, ignore_attribute, ignore)
+        return new_obj
+    new_obj, descend = jsonclass._dump_object(
+        obj, serialize_method, ignore_attribute, ignore)
+    if descend:
+        for key, value in new_obj.items():
+            new_obj[key] = recursive_dump(
+                value, serialize_method, ignore_attribute, ignore)
+    return new_obj
+
+
+def recursive_load(obj):
+    if isinstance(obj, list):
+        return [recursive_load(entry) for entry in obj]
+    if isinstance(obj, dict) and '__jsonclass__' not in obj:
+        return dict((key, recursive_load(value))
+                    for key, value in obj.items())
+    return jsonclass._load_object(obj)[0]
+
+
+class Record(object):
+    def __init__(self, index=0):
+        self.index = index
+        self.name = 'record %d' % index
+        self.tags = ['a', 'b']
+
+
+config.classes.add(Record)
+
+
+def payload(megabytes, custom_every=None):
+    """ A list of records, about megabytes large once encoded. """
+    record = {'id': 0, 'name': 'user 0', 'score': 1.5,
+              'tags': ['a', 'b', 'c'], 'address': {'city': 'x', 'zip': 1}}
+    count = megabytes * 1024 * 1024 // len(json.dumps(record))
+    records = []
+    for i in range(count):
+        if custom_every and i % custom_every == 0:
+            records.append(Record(i))
+        else:
+            records.append({'id': i, 'name': 'user %d' % i,
+                            'score': i * 1.5, 'tags': ['a', 'b', 'c'],
+                            'address': {'city': 'x', 'zip': i}})
+    return records
+
+
+def best_of(repeat, func, arg):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 50],
+                        help='payload sizes in MB')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('%-6s %-22s %-5s %12s %12s %9s' % (
+        'size', 'payload', 'op', 'recursive', 'iterative', 'speedup'))
+    for size in args.sizes:
+        for label, custom_every in (('primitives only', None),
+                                    ('1% custom objects', 100)):
+            data = payload(size, custom_every)
+            encoded = json.loads(json.dumps(jsonclass.dump(data)))
+            for op, old, new, arg in (
+                    ('dump', recursive_dump, jsonclass.dump, data),
+                    ('load', recursive_load, jsonclass.load, encoded)):
+                old_time = best_of(args.repeat, old, arg)
+                new_time = best_of(args.repeat, new, arg)
+                print('%-6s %-22s %-5s %11.1fms %11.1fms %8.1fx' % (
+                    '%dMB' % size, label, op, old_time * 1000,
+                    new_time * 1000, old_time / new_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Measures the client side cost of a call -- building the request and
+decoding the response -- with the per-method request templates
+ServerProxy uses, and with a full dumps() of every request as before.
+The transport is a stub, so no network time is included. Run it from
+the repository root:
+
+    python benchmarks/request_encoding.py [--number 100000]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import jsonrpclib  # noqa: E402
+from jsonrpclib import jsonrpc  # noqa: E402
+
+
+class StubTransport(object):
+    """ Answers every request with the same canned response. """
+
+    response = b'{"jsonrpc": "2.0", "result": 3, "id": "x"}'
+
+    def request(self, host, handler, request_body, verbose=False):
+        return self.response
+
+
+class DumpsServerProxy(jsonrpc.ServerProxy):
+    """ Encodes every request with dumps(), like ServerProxy used to. """
+
+    def _request(self, methodname, params, rpcid=None):
+        request = jsonrpc.dumps(params, methodname, rpcid=rpcid)
+        response = self._run_request(request)
+        jsonrpc.check_for_errors(response)
+        return response['result']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    jsonrpclib.history.size = 0
+    uri = 'http://localhost:8080'
+    proxies = (
+        ('dumps', DumpsServerProxy(uri, transport=StubTransport())),
+        ('templates', jsonrpc.ServerProxy(uri, transport=StubTransport())))
+    params = (1, 2)
+    # The encode column uses a fixed id, so id generation is left out.
+    print('%-10s %16s %16s' % ('', 'encode us/call', 'call us/call'))
+    for label, proxy in proxies:
+        if label == 'dumps':
+            def encode():
+                jsonrpc.dumps(params, 'add', rpcid='abc12345')
+        else:
+            templates = jsonrpc.RequestTemplates()
+
+            def encode():
+                templates.encode('add', params, 'abc12345')
+        encode_time = timeit.timeit(encode, number=args.number)
+        call_time = timeit.timeit(lambda: proxy.add(1, 2), number=args.number)
+        print('%-10s %16.2f %16.2f' % (
+            label, encode_time / args.number * 1e6,
+            call_time / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
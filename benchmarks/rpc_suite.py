@@ -0,0 +1,223 @@
+"""
+Runs calls against a local SimpleJSONRPCServer and reports requests
+per second and p50 / p99 latency for each scenario, as JSON. Every
+scenario runs over TCP and, where available, over a unix socket. Run
+it from the repository root:
+
+    python benchmarks/rpc_suite.py [--duration 2] [--output results.json]
+    python benchmarks/rpc_suite.py --compare results.json [--tolerance 10]
+
+With --compare, the results are checked against a saved run: the
+change of every number is added to the report, and the exit status is
+1 if any scenario got slower than the tolerance (in percent) allows.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import jsonrpclib  # noqa: E402
+from jsonrpclib import MultiCall  # noqa: E402
+from jsonrpclib.jsonrpc import USE_UNIX_SOCKETS  # noqa: E402
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer  # noqa: E402
+
+
+class Record(object):
+    def __init__(self, index=0, name='', tags=None):
+        self.index = index
+        self.name = name
+        self.tags = tags or []
+
+
+jsonrpclib.config.classes.add(Record)
+
+
+def batch(size):
+    def run(client):
+        multicall = MultiCall(client)
+        for i in range(size):
+            multicall.add(i, i)
+        results = multicall()
+        assert len(results) == size
+    return run, size
+
+
+def run_single(client):
+    client.add(1, 2)
+
+
+def run_notification(client):
+    client._notify.add(1, 2)
+
+
+RECORDS = [Record(i, 'record %d' % i, ['a', 'b']) for i in range(100)]
+LARGE_STRING = 'x' * (1024 * 1024)
+
+
+def run_jsonclass(client):
+    assert len(client.echo(RECORDS)) == len(RECORDS)
+
+
+def run_large_string(client):
+    assert len(client.echo(LARGE_STRING)) == len(LARGE_STRING)
+
+
+# Name -> (function making one request, calls per request).
+SCENARIOS = {
+    'single': (run_single, 1),
+    'notification': (run_notification, 1),
+    'batch_10': batch(10),
+    'batch_100': batch(100),
+    'batch_10k': batch(10000),
+    'jsonclass_100_objects': (run_jsonclass, 1),
+    'large_string_1mb': (run_large_string, 1),
+}
+
+
+def start_server(transport, directory):
+    if transport == 'unix':
+        address = os.path.join(directory, 'rpc.sock')
+        server = SimpleJSONRPCServer(
+            address, logRequests=False, address_family=socket.AF_UNIX)
+        uri = 'unix:%s' % address
+    else:
+        server = SimpleJSONRPCServer(('localhost', 0), logRequests=False)
+        uri = 'http://localhost:%d' % server.server_address[1]
+    # One client at a time, so keep-alive cannot block anyone.
+    server.keepalive_timeout = 5
+    server.max_keepalive_requests = 0
+    server.register_function(lambda x, y: x + y, 'add')
+    server.register_function(lambda value: value, 'echo')
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, thread, uri
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1,
+                       int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(client, func, calls, duration, min_requests):
+    # A few warm-up requests, so connections and caches are set up.
+    for _ in range(min(3, min_requests)):
+        func(client)
+    latencies = []
+    started = time.perf_counter()
+    deadline = started + duration
+    while len(latencies) < min_requests or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        func(client)
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'ops_per_sec': len(latencies) / elapsed,
+        'calls_per_sec': len(latencies) * calls / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def run_suite(scenarios, transports, duration, min_requests):
+    results = {}
+    directory = tempfile.mkdtemp()
+    try:
+        for transport in transports:
+            server, thread, uri = start_server(transport, directory)
+            try:
+                client = jsonrpclib.Server(uri, history=False)
+                for name in scenarios:
+                    func, calls = SCENARIOS[name]
+                    results['%s/%s' % (transport, name)] = measure(
+                        client, func, calls, duration, min_requests)
+                    print('%-32s done' % ('%s/%s' % (transport, name)),
+                          file=sys.stderr)
+                client('close')()
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Adds the change against baseline to every result (in percent,
+    positive is better) and returns the names of the regressions.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        old = baseline.get('results', {}).get(name)
+        if old is None:
+            continue
+        change = {
+            'ops_per_sec': (result['ops_per_sec'] / old['ops_per_sec']
+                            - 1) * 100,
+            'p50_ms': (old['p50_ms'] / result['p50_ms'] - 1) * 100,
+            'p99_ms': (old['p99_ms'] / result['p99_ms'] - 1) * 100,
+        }
+        result['change_percent'] = change
+        if change['ops_per_sec'] < -tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS),
+                        default=sorted(SCENARIOS))
+    parser.add_argument('--transports', nargs='+', choices=['tcp', 'unix'],
+                        default=['tcp', 'unix'])
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='seconds per scenario')
+    parser.add_argument('--min-requests', type=int, default=5)
+    parser.add_argument('--output', help='write the report to this file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='a report saved by an earlier run')
+    parser.add_argument('--tolerance', type=float, default=10.0,
+                        help='allowed drop of ops/s in percent')
+    args = parser.parse_args()
+
+    transports = args.transports
+    if not USE_UNIX_SOCKETS and 'unix' in transports:
+        transports = [t for t in transports if t != 'unix']
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'json_backend': jsonrpclib.config.get_json_backend().name,
+            'duration': args.duration,
+        },
+        'results': run_suite(
+            args.scenarios, transports, args.duration, args.min_requests),
+    }
+    regressions = []
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(report['results'], baseline, args.tolerance)
+        report['regressions'] = regressions
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    print(output)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,407 @@
+import asyncio
+import inspect
+import logging
+import os
+import socket
+import sys
+import time
+
+from jsonrpclib import Fault
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCDispatcher
+from jsonrpclib.jsonrpc import USE_UNIX_SOCKETS, CONTENT_ENCODINGS
+from jsonrpclib.jsonrpc import decode_content, encode_content
+from jsonrpclib.jsonrpc import preferred_encoding
+from jsonrpclib.profiling import Trace, run_traced
+
+
+HTTP_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    411: 'Length Required',
+    500: 'Internal Server Error',
+    501: 'Not Implemented',
+}
+
+
+async def _await_result(awaitable):
+    # run_coroutine_threadsafe only accepts coroutines, so wrap
+    # any other awaitable (futures, custom objects) in one.
+    return await awaitable
+
+
+class AsyncJSONRPCDispatcher(SimpleJSONRPCDispatcher):
+    """
+    A dispatcher that awaits coroutine functions on the event loop,
+    so a call that is waiting holds no thread. Requests are parsed,
+    validated and looked up on the loop; everything else (regular
+    functions, serializing results) runs in the executor.
+    """
+    # Request bodies larger than this many bytes are parsed in the
+    # executor instead, so they do not stall the event loop.
+    loop_parse_limit = 64 * 1024
+
+    def __init__(self, encoding=None, executor=None):
+        SimpleJSONRPCDispatcher.__init__(self, encoding)
+        self.executor = executor
+        self.loop = None
+
+    def _dispatch(self, method, params):
+        response = SimpleJSONRPCDispatcher._dispatch(self, method, params)
+        if not inspect.isawaitable(response):
+            return response
+        # A regular function returned an awaitable. We are on an
+        # executor thread here -- hand it back to the event loop and
+        # block this worker until it finishes.
+        future = asyncio.run_coroutine_threadsafe(
+            _await_result(response), self.loop)
+        try:
+            return future.result()
+        except Exception as exc:
+            return self.fault_policy.fault(exc)
+
+    async def _async_marshaled_dispatch(self, data, trace=None):
+        if len(data) > self.loop_parse_limit:
+            request = await self._run_in_executor(
+                trace, self._load_request, data)
+        else:
+            request = run_traced(trace, self._load_request, data)
+        if type(request) is Fault:
+            return request.response()
+        if not isinstance(request, list):
+            func = run_traced(trace, self._coroutine_function, request)
+            if func is None:
+                return await self._run_in_executor(
+                    trace, self._marshaled_batch_entry, request)
+            return await self._async_single_dispatch(request, func, trace)
+        # Coroutine functions of a batch all run concurrently on the
+        # loop, the other entries together in the executor.
+        funcs = [run_traced(trace, self._coroutine_function, req_entry)
+                 for req_entry in request]
+        calls = [self._async_single_dispatch(req_entry, func, trace)
+                 for req_entry, func in zip(request, funcs)
+                 if func is not None]
+        others = [req_entry for req_entry, func in zip(request, funcs)
+                  if func is None]
+        if others:
+            calls.append(self._run_in_executor(
+                trace, self._batch_entry_responses, others))
+        results = await asyncio.gather(*calls)
+        other_results = iter(results.pop() if others else ())
+        results = iter(results)
+        responses = []
+        for func in funcs:
+            if func is None:
+                resp_entry = next(other_results)
+            else:
+                resp_entry = next(results)
+            if resp_entry is not None:
+                responses.append(resp_entry)
+        if not responses:
+            return ''
+        return '[%s]' % ','.join(responses)
+
+    def _batch_entry_responses(self, request):
+        return list(self._iter_batch_responses(request, False))
+
+    def _coroutine_function(self, request):
+        """
+        The coroutine function a valid request calls (with valid
+        params), or None if the request is to be handled like any
+        other.
+        """
+        if type(request) is not dict:
+            return None
+        method = request.get('method')
+        entry = self._dispatch_table.get(method)
+        if entry is None:
+            if method not in self.funcs and self.instance is not None and \
+                    hasattr(self.instance, '_dispatch'):
+                return None
+            entry = self._resolve_method(method)
+            if entry is None:
+                return None
+        func, checker = entry
+        if not inspect.iscoroutinefunction(func):
+            return None
+        params = request.get('params')
+        if not isinstance(params, (list, dict)):
+            return None
+        if type(self._validate_request(request)) is Fault:
+            return None
+        if checker is not None and checker.check(params) is not None:
+            return None
+        return func
+
+    async def _async_single_dispatch(self, request, func, trace):
+        method = request['method']
+        params = request['params']
+        metrics = self.metrics
+        start = None
+        if metrics is not None or trace is not None:
+            start = time.perf_counter()
+            if trace is not None:
+                trace.methods.append(method)
+        cache, key, version, cached = self._cached_response(
+            request, method, params)
+        if cached is not None:
+            self._record_call(method, start, metrics, trace)
+            return cached
+        try:
+            if isinstance(params, list):
+                response = await func(*params)
+            else:
+                response = await func(**params)
+        except Exception as exc:
+            response = self.fault_policy.fault(exc)
+        self._record_call(
+            method, start, metrics, trace,
+            response.faultCode if type(response) is Fault else None)
+        return await self.loop.run_in_executor(
+            self.executor, self._marshal_response, request, response,
+            trace, cache, key, version)
+
+    async def _run_in_executor(self, trace, func, *args):
+        return await self.loop.run_in_executor(
+            self.executor, run_traced, trace, func, *args)
+
+
+class AsyncJSONRPCServer(AsyncJSONRPCDispatcher):
+    """
+    An asyncio based equivalent of SimpleJSONRPCServer. Every
+    connection is a lightweight task on the event loop, so slow
+    methods and idle keep-alive clients do not block each other.
+
+    The socket is bound when the server is created (just like the
+    socketserver based servers), and either serve_forever() can be
+    called from a thread, or start() can be awaited from inside an
+    already running event loop.
+    """
+
+    rpc_paths = ('/', '/RPC2')
+    request_queue_size = 100
+    # Seconds an idle keep-alive connection is held open.
+    keepalive_timeout = 15
+    # Responses larger than this are compressed for clients that accept
+    # gzip or deflate (None, the default, turns it off), at
+    # compress_level.
+    encode_threshold = None
+    compress_level = 6
+
+    def __init__(self, addr, logRequests=True, encoding=None,
+                 address_family=socket.AF_INET, executor=None):
+        AsyncJSONRPCDispatcher.__init__(self, encoding, executor)
+        self.logRequests = logRequests
+        self.address_family = address_family
+        self._server = None
+        self._stopped = None
+        self._connections = {}
+
+        if USE_UNIX_SOCKETS and address_family == socket.AF_UNIX:
+            # Same convention as SimpleJSONRPCServer -- unlink stale
+            # socket files before binding.
+            if os.path.exists(addr):
+                try:
+                    os.unlink(addr)
+                except OSError:
+                    logging.warning("Could not unlink socket %s", addr)
+
+        self.socket = socket.socket(address_family, socket.SOCK_STREAM)
+        try:
+            if address_family != getattr(socket, 'AF_UNIX', None):
+                self.socket.setsockopt(
+                    socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind(addr)
+            self.socket.listen(self.request_queue_size)
+        except Exception:
+            self.socket.close()
+            raise
+        self.server_address = self.socket.getsockname()
+
+    async def start(self):
+        self.loop = asyncio.get_event_loop()
+        self._stopped = asyncio.Event()
+        if USE_UNIX_SOCKETS and self.address_family == socket.AF_UNIX:
+            self._server = await asyncio.start_unix_server(
+                self._handle_connection, sock=self.socket)
+        else:
+            self._server = await asyncio.start_server(
+                self._handle_connection, sock=self.socket)
+
+    async def serve(self):
+        """ Starts the server (if needed) and waits until shutdown. """
+        if self._server is None:
+            await self.start()
+        await self._stopped.wait()
+        self._server.close()
+        await self._server.wait_closed()
+        # Idle keep-alive connections would otherwise outlive the loop.
+        for writer in list(self._connections):
+            writer.close()
+        if self._connections:
+            await asyncio.wait(list(self._connections.values()))
+
+    def serve_forever(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.serve())
+        finally:
+            loop.close()
+
+    def shutdown(self):
+        """ Thread-safe request to stop serve() / serve_forever(). """
+        if self.loop is not None and self._stopped is not None:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+
+    def server_close(self):
+        self.socket.close()
+
+    async def _handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername') or '-'
+        finished = self.loop.create_future()
+        self._connections[writer] = finished
+        try:
+            keep_alive = True
+            while keep_alive:
+                # Only the wait for the next request is bounded by the
+                # idle timeout -- a slow method is never cut off.
+                try:
+                    request_line = await asyncio.wait_for(
+                        reader.readline(), self.keepalive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                keep_alive = await self._handle_request(
+                    reader, writer, peer, request_line)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            del self._connections[writer]
+            finished.set_result(None)
+
+    async def _handle_request(self, reader, writer, peer, request_line):
+        if not request_line:
+            return False
+        request_line = request_line.decode('latin-1').rstrip('\r\n')
+        parts = request_line.split()
+        if len(parts) != 3:
+            await self._send_response(writer, 400, b'', False)
+            return False
+        command, path, version = parts
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+
+        encoding = headers.get('content-encoding', 'identity').lower()
+        content_encoding = None
+        content_type = 'application/json-rpc'
+        trace = None
+        if command == 'GET' and self.metrics is not None:
+            if path == self.metrics_path:
+                code, body = 200, self.metrics.render().encode()
+                content_type = 'text/plain; version=0.0.4'
+            else:
+                code, body = 404, b'No such page'
+        elif command != 'POST':
+            code, body = 501, b''
+            keep_alive = False
+        elif encoding != 'identity' and encoding not in CONTENT_ENCODINGS:
+            code, body = 501, b''
+            keep_alive = False
+        elif self.rpc_paths and path not in self.rpc_paths:
+            code, body = 404, b'No such page'
+            keep_alive = False
+        elif 'content-length' not in headers:
+            code, body = 411, b''
+            keep_alive = False
+        else:
+            try:
+                size = int(headers['content-length'])
+            except ValueError:
+                size = -1
+            if size < 0 or self.max_request_size is not None and \
+                    size > self.max_request_size:
+                code, body = 400, b''
+                keep_alive = False
+            else:
+                data = await reader.readexactly(size)
+                if self.profile_hooks:
+                    trace = Trace('server')
+                    trace.request_size = size
+                code, body, content_encoding = await self._dispatch_body(
+                    data, headers, trace)
+
+        if trace is not None:
+            start = time.perf_counter()
+        await self._send_response(
+            writer, code, body, keep_alive, content_encoding, content_type)
+        if trace is not None:
+            trace.response_size = len(body)
+            trace.add('write', start)
+            self._run_profile_hooks(trace)
+        if self.logRequests:
+            self.log_request(peer, request_line, code, len(body))
+        return keep_alive
+
+    async def _dispatch_body(self, data, headers, trace=None):
+        try:
+            encoding = headers.get('content-encoding', 'identity').lower()
+            if encoding != 'identity':
+                # (De)compression runs in the executor, like dispatching,
+                # so large bodies do not stall the event loop.
+                data = await self.loop.run_in_executor(
+                    self.executor, decode_content, data, encoding,
+                    self.max_request_size)
+            response = await self._async_marshaled_dispatch(data, trace)
+            code = 200
+        except Exception as exc:
+            code = 500
+            response = self.fault_policy.fault(exc).response()
+        if response is None:
+            response = ''
+        if not isinstance(response, bytes):
+            response = response.encode()
+        content_encoding = None
+        if self.encode_threshold is not None and \
+                len(response) > self.encode_threshold:
+            content_encoding = preferred_encoding(
+                headers.get('accept-encoding', ''))
+            if content_encoding:
+                response = await self.loop.run_in_executor(
+                    self.executor, encode_content, response,
+                    content_encoding, self.compress_level)
+        return code, response, content_encoding
+
+    async def _send_response(self, writer, code, body, keep_alive,
+                             content_encoding=None,
+                             content_type='application/json-rpc'):
+        headers = [
+            'HTTP/1.1 %d %s' % (code, HTTP_REASONS.get(code, '')),
+            'Content-type: %s' % content_type,
+            'Content-length: %d' % len(body),
+            'Connection: %s' % ('keep-alive' if keep_alive else 'close'),
+        ]
+        if content_encoding:
+            headers.append('Content-Encoding: %s' % content_encoding)
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1'))
+        writer.write(body)
+        await writer.drain()
+
+    def log_request(self, peer, request_line, code, size):
+        if isinstance(peer, tuple):
+            peer = peer[0]
+        sys.stderr.write('%s - - [%s] "%s" %s %s\n' % (
+            peer or '-', time.strftime('%d/%b/%Y %H:%M:%S'),
+            request_line, code, size))
@@ -1,10 +1,19 @@
+import collections
+import functools
+import inspect
+import itertools
 import logging
 import os
+import queue
+import signal
 import socket
 import socketserver
 import sys
+import threading
+import time
 import traceback
 import xmlrpc.server
+import zlib
 
 try:
     import fcntl
@@ -14,7 +23,86 @@ except ImportError:
 
 import jsonrpclib
 from jsonrpclib import Fault
-from jsonrpclib.jsonrpc import USE_UNIX_SOCKETS
+from jsonrpclib.jsonrpc import USE_UNIX_SOCKETS, JSONArrayDecoder
+from jsonrpclib.jsonrpc import CONTENT_ENCODINGS, content_compressor
+from jsonrpclib.jsonrpc import encode_content, iter_decoded_content
+from jsonrpclib.jsonrpc import encode_id, jdumps, preferred_encoding
+from jsonrpclib.metrics import Metrics
+from jsonrpclib.profiling import Trace, current_trace, run_traced
+
+# JSON-RPC reserves -32000 to -32099 for implementation-defined
+# server errors.
+OVERLOAD_FAULT_CODE = -32001
+
+
+class FaultPolicy(object):
+    """
+    Turns exceptions raised while handling a call into Faults. In the
+    default 'fast' mode the message holds only the exception type and
+    text, so a failing call costs about as much as a successful one.
+    In 'detailed' mode one in traceback_every failures also reports
+    where it was raised, taken from the formatted traceback.
+
+    Exception classes given to register() (or in codes) are answered
+    with their own code and just str(exc) as the message; subclasses
+    match too, and no traceback is ever formatted for them.
+    """
+
+    def __init__(self, mode='fast', traceback_every=1, codes=None):
+        if mode not in ('fast', 'detailed'):
+            raise ValueError('Unknown fault policy mode %r.' % mode)
+        self.mode = mode
+        self.traceback_every = traceback_every
+        self._codes = {}
+        # Exception class -> registered code (or None), so the MRO is
+        # only searched once per class.
+        self._resolved = {}
+        self._failures = itertools.count()
+        for exc_class, code in (codes or {}).items():
+            self.register(exc_class, code)
+
+    def register(self, exc_class, code):
+        self._codes[exc_class] = code
+        self._resolved = {}
+
+    def code_for(self, exc_class):
+        resolved = self._resolved
+        try:
+            return resolved[exc_class]
+        except KeyError:
+            pass
+        code = None
+        for cls in exc_class.__mro__:
+            if cls in self._codes:
+                code = self._codes[cls]
+                break
+        resolved[exc_class] = code
+        return code
+
+    def fault(self, exc, code=-32603):
+        exc_class = type(exc)
+        registered = self.code_for(exc_class)
+        if registered is not None:
+            return Fault(registered, str(exc))
+        if self.mode == 'detailed' and (
+                self.traceback_every <= 1 or
+                next(self._failures) % self.traceback_every == 0):
+            err_lines = ''.join(traceback.format_exception(
+                exc_class, exc, exc.__traceback__)).splitlines()
+            if len(err_lines) >= 3:
+                return Fault(code, 'Server error: %s | %s' % (
+                    err_lines[-3], err_lines[-1]))
+        return Fault(code, 'Server error: %s: %s' % (
+            exc_class.__name__, exc))
+
+
+# Yielded among the fragments of a streamed batch response when the
+# next one has to be waited for, to send out what is buffered.
+FLUSH_HINT = ''
+
+# The id cached responses are serialized with, to be replaced by the
+# id of each request they answer.
+CACHED_ID = '\x00cached-id'
 
 
 def get_version(request):
@@ -49,45 +137,486 @@ def validate_request(request):
     return True
 
 
+class ParamsChecker(object):
+    """
+    Checks params against a function's signature before the function
+    is called, so invalid params can be answered with -32602. Only
+    counts and names are compared, which is much cheaper than
+    Signature.bind().
+    """
+
+    def __init__(self, signature):
+        self.min_args = 0
+        self.max_args = 0
+        self.var_args = False
+        self.var_kwargs = False
+        self.names = set()
+        self.required_names = set()
+        self.required_keyword_only = False
+        self.required_positional_only = False
+        empty = inspect.Parameter.empty
+        for param in signature.parameters.values():
+            kind = param.kind
+            if kind == param.VAR_POSITIONAL:
+                self.var_args = True
+            elif kind == param.VAR_KEYWORD:
+                self.var_kwargs = True
+            elif kind == param.KEYWORD_ONLY:
+                self.names.add(param.name)
+                if param.default is empty:
+                    self.required_names.add(param.name)
+                    self.required_keyword_only = True
+            else:
+                self.max_args += 1
+                if param.default is empty:
+                    self.min_args += 1
+                if kind == param.POSITIONAL_ONLY:
+                    if param.default is empty:
+                        self.required_positional_only = True
+                else:
+                    self.names.add(param.name)
+                    if param.default is empty:
+                        self.required_names.add(param.name)
+
+    def check(self, params):
+        """ Returns what is wrong with params, or None. """
+        if isinstance(params, dict):
+            if self.required_positional_only:
+                return 'Positional parameters required.'
+            if not self.var_kwargs:
+                unknown = [key for key in params if key not in self.names]
+                if unknown:
+                    return 'Unexpected parameters: %s.' % ', '.join(
+                        sorted(str(key) for key in unknown))
+            missing = self.required_names.difference(params)
+            if missing:
+                return 'Missing parameters: %s.' % ', '.join(sorted(missing))
+            return None
+        if self.required_keyword_only:
+            return 'Keyword parameters required.'
+        count = len(params)
+        if count < self.min_args or \
+                (count > self.max_args and not self.var_args):
+            return 'Expected %s parameters, got %d.' % (
+                self.min_args if self.min_args == self.max_args else
+                '%d to %s' % (self.min_args,
+                              'any' if self.var_args else self.max_args),
+                count)
+        return None
+
+
+def dispatch_entry(func):
+    """
+    Returns the (callable, checker) pair the dispatch table holds for
+    func; the checker is None if func has no usable signature.
+    """
+    try:
+        checker = ParamsChecker(inspect.signature(func))
+    except (TypeError, ValueError):
+        checker = None
+    return func, checker
+
+
+# Bounded, and keyed by the callable itself, so a callable that is
+# replaced simply misses.
+cached_dispatch_entry = functools.lru_cache(maxsize=1024)(dispatch_entry)
+
+
+def is_routine(value):
+    if isinstance(value, (staticmethod, classmethod)):
+        return True
+    return inspect.isroutine(value)
+
+
 class SimpleJSONRPCDispatcher(xmlrpc.server.SimpleXMLRPCDispatcher):
 
+    # Set to a concurrent.futures executor to run the entries of a batch
+    # concurrently instead of one after the other. Responses keep the
+    # order of the requests either way.
+    batch_executor = None
+    # Most entries of a single batch in flight on the executor at once,
+    # so one big batch cannot monopolize it. None means no limit.
+    max_batch_concurrency = 10
+    # Largest request body (in bytes) the server will accept, before
+    # and after decompression. None for no limit.
+    max_request_size = 100 * 1024 * 1024
+    # Stream batch responses to HTTP/1.1 clients with chunked encoding,
+    # in chunks of a few elements, instead of building the whole
+    # response.
+    stream_batches = True
+    # Request bodies of at least this many bytes are decoded while they
+    # are read (when the response is streamed), instead of all at once.
+    # None turns incremental parsing off.
+    incremental_parse_threshold = 1024 * 1024
+    # Per-method counters and latency histograms, see enable_metrics().
+    # None records nothing.
+    metrics = None
+    # Where the request handler serves the metrics to GET requests.
+    metrics_path = '/metrics'
+    # Called with a profiling.Trace of every request once it has been
+    # answered, see add_profile_hook(). Nothing is timed without hooks.
+    profile_hooks = ()
+    # A profiling.SamplingProfiler to run some calls under, or None.
+    profile_sampler = None
+
     def __init__(self, encoding=None):
         xmlrpc.server.SimpleXMLRPCDispatcher.__init__(
             self, allow_none=True, encoding=encoding)
+        # Method name -> (callable, ParamsChecker), filled in when
+        # functions and instances are registered.
+        self._dispatch_table = {}
+        self.fault_policy = FaultPolicy()
+        # Method name -> cache.ResponseCache of the functions registered
+        # with a cache policy.
+        self.response_caches = {}
 
-    def _marshaled_dispatch(self, data, dispatch_method=None):
-        response = None
+    def register_function(self, function=None, name=None, cache=None):
+        """
+        Registers function under name (its own name by default). With
+        a cache.CachePolicy as cache, its responses are kept, already
+        serialized, and calls with the same params are answered from
+        there without calling it again; faults are never kept.
+        """
+        if function is None:
+            # Used as a decorator.
+            return functools.partial(
+                self.register_function, name=name, cache=cache)
+        if name is None:
+            name = function.__name__
+        self.funcs[name] = function
+        self._dispatch_table[name] = dispatch_entry(function)
+        if cache is None:
+            self.response_caches.pop(name, None)
+        else:
+            self.response_caches[name] = cache.new_cache(name)
+        return function
+
+    def invalidate_cache(self, name=None, params=None):
+        """
+        Drops the cached response of one call (name and params), of
+        every call of name, or of every cached function.
+        """
+        if name is None:
+            for cache in self.response_caches.values():
+                cache.invalidate()
+            return
+        cache = self.response_caches.get(name)
+        if cache is not None:
+            cache.invalidate(name, params)
+
+    def enable_metrics(self, buckets=None, stats_method='rpc.stats',
+                       path='/metrics'):
+        """
+        Starts recording call counts, fault codes and latencies per
+        method. They can be read with the stats_method call and, in
+        the Prometheus text format, with a GET of path. Returns the
+        Metrics object.
+        """
+        self.metrics = Metrics(buckets)
+        if stats_method:
+            self.register_function(self.metrics.snapshot, stats_method)
+        self.metrics_path = path
+        return self.metrics
+
+    def add_profile_hook(self, hook):
+        """
+        Registers a callable that gets the profiling.Trace of every
+        request: the start and end of its parse, validate, dispatch,
+        serialize and write phases, and the payload sizes. A
+        profiling.PhaseStats makes a ready-made aggregator.
+        """
+        # Replaced, not changed in place, so requests in flight keep
+        # a consistent view.
+        self.profile_hooks = tuple(self.profile_hooks) + (hook,)
+        return hook
+
+    def remove_profile_hook(self, hook):
+        self.profile_hooks = tuple(
+            h for h in self.profile_hooks if h != hook)
+
+    def _trace(self):
+        """ The Trace to record into, or None when not profiling. """
+        if not self.profile_hooks:
+            return None
+        return current_trace()
+
+    def _run_profile_hooks(self, trace):
+        trace.end = time.perf_counter()
+        for hook in self.profile_hooks:
+            try:
+                hook(trace)
+            except Exception:
+                logging.exception('Profile hook %r failed', hook)
+
+    def register_instance(self, instance, allow_dotted_names=False):
+        xmlrpc.server.SimpleXMLRPCDispatcher.register_instance(
+            self, instance, allow_dotted_names)
+        self._compile_dispatch_table()
+
+    def _compile_dispatch_table(self):
+        """
+        Rebuilds the table from the registered functions and the public
+        methods of the registered instance. Dotted names, and anything
+        else not found here, are resolved by _resolve_method on every
+        call and never added.
+        """
+        table = {}
+        instance = self.instance
+        if instance is not None and not hasattr(instance, '_dispatch'):
+            for name in dir(instance):
+                if name.startswith('_'):
+                    continue
+                try:
+                    # Static lookup, so properties are not run here.
+                    value = inspect.getattr_static(instance, name)
+                except AttributeError:
+                    continue
+                if is_routine(value):
+                    table[name] = dispatch_entry(getattr(instance, name))
+        for name, func in self.funcs.items():
+            table[name] = dispatch_entry(func)
+        self._dispatch_table = table
+
+    def _resolve_method(self, method):
+        """
+        Finds a method missing from the dispatch table. It is resolved
+        again on every call, so reassigned attributes are picked up
+        and client-chosen names (think of a catch-all __getattr__)
+        cannot grow the table; only the signature checks are cached.
+        """
+        func = self.funcs.get(method)
+        if func is None and self.instance is not None:
+            try:
+                func = xmlrpc.server.resolve_dotted_attribute(
+                    self.instance, method, True)
+            except AttributeError:
+                return None
+        if func is None:
+            return None
         try:
-            request = jsonrpclib.loads(data)
-        except Exception as e:
-            fault = Fault(-32700, 'Request %s invalid. (%s)' % (data, e))
-            response = fault.response()
-            return response
-        if not request:
-            fault = Fault(-32600, 'Request invalid -- no request data.')
-            return fault.response()
+            return cached_dispatch_entry(func)
+        except TypeError:
+            # Not hashable.
+            return dispatch_entry(func)
+
+    def _marshaled_dispatch(self, data, dispatch_method=None):
+        request = self._load_request(data)
+        if type(request) is Fault:
+            return request.response()
         if isinstance(request, list):
             # This SHOULD be a batch, by spec
-            responses = []
-            for req_entry in request:
-                result = validate_request(req_entry)
-                if type(result) is Fault:
-                    responses.append(result.response())
-                    continue
-                resp_entry = self._marshaled_single_dispatch(req_entry)
-                if resp_entry is not None:
-                    responses.append(resp_entry)
+            responses = list(self._iter_batch_responses(request))
             if len(responses) > 0:
                 response = '[%s]' % ','.join(responses)
             else:
                 response = ''
         else:
-            result = validate_request(request)
+            result = self._validate_request(request)
             if type(result) is Fault:
                 return result.response()
             response = self._marshaled_single_dispatch(request)
         return response
 
+    def _marshaled_dispatch_iter(self, data):
+        """
+        Like _marshaled_dispatch, but yields the response in pieces: a
+        batch response is yielded one element at a time (the first
+        piece starting with '['), as soon as each entry is done.
+        """
+        return self._iter_request_responses(self._load_request(data))
+
+    def _marshaled_dispatch_stream(self, chunks):
+        """
+        Like _marshaled_dispatch_iter, but decodes the request from an
+        iterable of byte chunks as they are read. Batch entries are
+        dispatched as soon as they have been parsed, so only about one
+        entry (plus a chunk) of the request is held in memory.
+
+        A batch that turns out to be malformed after some entries were
+        dispatched cannot be answered with a single parse error any
+        more -- the error is added as the last element instead.
+        """
+        decoder = JSONArrayDecoder()
+        chunks = iter(chunks)
+        entries = []
+        trace = self._trace()
+        if trace is not None:
+            start = time.perf_counter()
+        try:
+            for chunk in chunks:
+                entries.extend(decoder.feed(chunk))
+                if decoder.is_array is not None:
+                    break
+            if not decoder.is_array:
+                # Not a batch, so there is nothing to gain from
+                # streaming -- decode it in one go.
+                for chunk in chunks:
+                    decoder.feed(chunk)
+                documents = decoder.close()
+        except Exception as e:
+            yield Fault(-32700, 'Request invalid. (%s)' % e).response()
+            return
+        finally:
+            if trace is not None:
+                trace.add('parse', start)
+        if not decoder.is_array:
+            if not documents or not documents[0]:
+                request = Fault(-32600, 'Request invalid -- no request data.')
+            else:
+                request = self._load_entry(documents[0])
+            for fragment in self._iter_request_responses(request):
+                yield fragment
+            return
+        entries = self._iter_stream_entries(decoder, entries, chunks)
+        if trace is not None:
+            entries = self._iter_timed(trace, 'parse', entries)
+        first = next(entries, None)
+        if first is None:
+            first = Fault(-32600, 'Request invalid -- no request data.')
+        if type(first) is Fault:
+            yield first.response()
+            return
+        for fragment in self._iter_batch_fragments(
+                itertools.chain([first], entries)):
+            yield fragment
+
+    def _iter_stream_entries(self, decoder, entries, chunks):
+        try:
+            for entry in entries:
+                yield self._load_entry(entry)
+            for chunk in chunks:
+                for entry in decoder.feed(chunk):
+                    yield self._load_entry(entry)
+            for entry in decoder.close():
+                yield self._load_entry(entry)
+        except Exception as e:
+            yield Fault(-32700, 'Request invalid. (%s)' % e)
+
+    def _iter_timed(self, trace, phase, iterator):
+        """ Records the time taken to produce each item as phase. """
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                trace.add(phase, start)
+                return
+            trace.add(phase, start)
+            yield item
+
+    def _load_entry(self, entry):
+        if jsonrpclib.config.use_jsonclass is True:
+            from jsonrpclib import jsonclass
+            entry = jsonclass.load(entry)
+        return entry
+
+    def _iter_request_responses(self, request):
+        if type(request) is Fault:
+            yield request.response()
+            return
+        if not isinstance(request, list):
+            result = self._validate_request(request)
+            if type(result) is Fault:
+                yield result.response()
+            else:
+                yield self._marshaled_single_dispatch(request)
+            return
+        for fragment in self._iter_batch_fragments(request):
+            yield fragment
+
+    def _iter_batch_fragments(self, request):
+        prefix = '['
+        for resp_entry in self._iter_batch_responses(
+                request, flush_hint=FLUSH_HINT):
+            if resp_entry is FLUSH_HINT:
+                if prefix == ',':
+                    yield resp_entry
+                continue
+            yield prefix + resp_entry
+            prefix = ','
+        if prefix == ',':
+            yield ']'
+
+    def _load_request(self, data):
+        """ Returns the decoded request, or a Fault if it is invalid. """
+        trace = self._trace()
+        if trace is not None:
+            start = time.perf_counter()
+        try:
+            request = jsonrpclib.loads(data)
+        except Exception as e:
+            if isinstance(data, bytes):
+                data = data.decode('utf-8', 'replace')
+            return Fault(-32700, 'Request %s invalid. (%s)' % (data, e))
+        finally:
+            if trace is not None:
+                trace.add('parse', start)
+        if not request:
+            return Fault(-32600, 'Request invalid -- no request data.')
+        return request
+
+    def _iter_batch_responses(self, request, skip_notifications=True,
+                              flush_hint=None):
+        """
+        Yields the marshaled response of every batch entry, in request
+        order, skipping notifications (or yielding None for them). With
+        a flush_hint, that is yielded whenever the next response is not
+        done yet, so what came before can be sent in the meantime.
+        """
+        executor = self.batch_executor
+        if executor is None:
+            for req_entry in request:
+                resp_entry = self._marshaled_batch_entry(req_entry)
+                if resp_entry is not None or not skip_notifications:
+                    yield resp_entry
+            return
+        limit = self.max_batch_concurrency
+        pending = collections.deque()
+        trace = self._trace()
+        for req_entry in request:
+            if limit and len(pending) >= limit:
+                # Waiting on the oldest entry keeps both the order and
+                # the number of entries in flight bounded.
+                if flush_hint is not None and not pending[0].done():
+                    yield flush_hint
+                resp_entry = pending.popleft().result()
+                if resp_entry is not None or not skip_notifications:
+                    yield resp_entry
+            if trace is not None:
+                # The executor's threads record into this request too.
+                future = executor.submit(
+                    run_traced, trace, self._marshaled_batch_entry,
+                    req_entry)
+            else:
+                future = executor.submit(
+                    self._marshaled_batch_entry, req_entry)
+            pending.append(future)
+        while pending:
+            if flush_hint is not None and not pending[0].done():
+                yield flush_hint
+            resp_entry = pending.popleft().result()
+            if resp_entry is not None or not skip_notifications:
+                yield resp_entry
+
+    def _marshaled_batch_entry(self, req_entry):
+        if type(req_entry) is Fault:
+            # Stands in for an entry that could not be decoded.
+            return req_entry.response()
+        result = self._validate_request(req_entry)
+        if type(result) is Fault:
+            return result.response()
+        return self._marshaled_single_dispatch(req_entry)
+
+    def _validate_request(self, request):
+        trace = self._trace()
+        if trace is None:
+            return validate_request(request)
+        start = time.perf_counter()
+        try:
+            return validate_request(request)
+        finally:
+            trace.add('validate', start)
+
     def _marshaled_single_dispatch(self, request):
         # TODO - Use the multiprocessing and skip the response if
         # it is a notification
@@ -95,99 +624,413 @@ class SimpleJSONRPCDispatcher(xmlrpc.server.SimpleXMLRPCDispatcher):
         # (See SimpleXMLRPCServer._marshaled_dispatch)
         method = request.get('method')
         params = request.get('params')
+        metrics = self.metrics
+        trace = self._trace()
+        start = None
+        if metrics is not None or trace is not None:
+            start = time.perf_counter()
+            if trace is not None:
+                trace.methods.append(method)
+        cache, key, version, cached = self._cached_response(
+            request, method, params)
+        if cached is not None:
+            self._record_call(method, start, metrics, trace)
+            return cached
+        sampler = self.profile_sampler
         try:
-            response = self._dispatch(method, params)
-        except Exception:
-            exc_type, exc_value, exc_tb = sys.exc_info()
-            fault = Fault(-32603, '%s:%s' % (exc_type, exc_value))
+            if sampler is not None and sampler.wants(method):
+                response = sampler.run(self._dispatch, method, params)
+            else:
+                response = self._dispatch(method, params)
+        except Exception as exc:
+            fault = self.fault_policy.fault(exc)
+            self._record_call(method, start, metrics, trace,
+                              fault.faultCode)
             return fault.response()
+        self._record_call(
+            method, start, metrics, trace,
+            response.faultCode if type(response) is Fault else None)
+        return self._marshal_response(
+            request, response, trace, cache, key, version)
+
+    def _cached_response(self, request, method, params):
+        """
+        Looks request up in the response cache of its method. Returns
+        (cache, key, version, response), where response is the cached
+        text with the id of request put in, or None on a miss; key is
+        None when the call cannot be cached at all.
+        """
+        cache = key = version = None
+        if self.response_caches and request.get('id') is not None:
+            cache = self.response_caches.get(method)
+            if cache is not None:
+                key = cache.make_key(method, params)
+        if key is not None:
+            version = get_version(request)
+            cached = cache.get(key)
+            if cached is not None and cached[0] == version:
+                return cache, key, version, \
+                    cached[1] + encode_id(request['id']) + cached[2]
+        return cache, key, version, None
+
+    def _record_call(self, method, start, metrics, trace, code=None):
+        if metrics is not None:
+            metrics.observe(method, time.perf_counter() - start, code)
+        if trace is not None:
+            trace.add('dispatch', start)
+
+    def _marshal_response(self, request, response, trace=None, cache=None,
+                          key=None, version=None):
+        """ Serializes the result (or Fault) of request, if it has an id. """
         if 'id' not in request.keys() or request['id'] is None:
             # It's a notification
             return None
+        if trace is not None:
+            start = time.perf_counter()
         try:
+            if key is not None and type(response) is not Fault:
+                return self._cache_response(
+                    cache, key, version, response, request['id'])
             response = jsonrpclib.dumps(response,
                                         version=get_version(request),
                                         methodresponse=True,
                                         rpcid=request['id']
                                         )
             return response
-        except Exception:
-            exc_type, exc_value, exc_tb = sys.exc_info()
-            fault = Fault(-32603, '%s:%s' % (exc_type, exc_value))
-            return fault.response()
+        except Exception as exc:
+            return self.fault_policy.fault(exc).response()
+        finally:
+            if trace is not None:
+                trace.add('serialize', start)
+
+    def _cache_response(self, cache, key, version, result, rpcid):
+        """
+        Serializes result once with a placeholder id and caches the
+        text around it, so hits only have to put their own id in.
+        """
+        response = jsonrpclib.dumps(result, version=version,
+                                    methodresponse=True, rpcid=CACHED_ID)
+        parts = response.split(jdumps(CACHED_ID))
+        if len(parts) != 2:
+            # The result holds the placeholder too -- do not cache it.
+            return jsonrpclib.dumps(result, version=version,
+                                    methodresponse=True, rpcid=rpcid)
+        cache.put(key, (version, parts[0], parts[1]), len(response))
+        return parts[0] + encode_id(rpcid) + parts[1]
 
     def _dispatch(self, method, params):
-        func = None
+        entry = self._dispatch_table.get(method)
+        if entry is None:
+            instance = self.instance
+            if method not in self.funcs and instance is not None and \
+                    hasattr(instance, '_dispatch'):
+                return instance._dispatch(method, params)
+            entry = self._resolve_method(method)
+            if entry is None:
+                return Fault(-32601, 'Method %s not supported.' % method)
+        func, checker = entry
+        if checker is not None:
+            error = checker.check(params)
+            if error is not None:
+                return Fault(-32602, 'Invalid parameters. (%s)' % error)
         try:
-            func = self.funcs[method]
-        except KeyError:
-            if self.instance is not None:
-                if hasattr(self.instance, '_dispatch'):
-                    return self.instance._dispatch(method, params)
-                else:
-                    try:
-                        func = xmlrpc.server.resolve_dotted_attribute(
-                            self.instance,
-                            method,
-                            True
-                            )
-                    except AttributeError:
-                        pass
-        if func is not None:
-            try:
-                if isinstance(params, list):
-                    response = func(*params)
-                else:
-                    response = func(**params)
-                return response
-            # except TypeError:
-            #     return Fault(-32602, 'Invalid parameters.')
-            except Exception:
-                err_lines = traceback.format_exc().splitlines()
-                trace_string = '%s | %s' % (err_lines[-3], err_lines[-1])
-                fault = jsonrpclib.Fault(-32603, 'Server error: %s' %
-                                         trace_string)
-                return fault
-        else:
-            return Fault(-32601, 'Method %s not supported.' % method)
+            if isinstance(params, list):
+                response = func(*params)
+            else:
+                response = func(**params)
+            return response
+        except Exception as exc:
+            return self.fault_policy.fault(exc)
 
 
 class SimpleJSONRPCRequestHandler(
         xmlrpc.server.SimpleXMLRPCRequestHandler):
 
+    # HTTP/1.1 so connections can persist between calls -- whether they
+    # do is controlled by the server's keepalive_timeout.
+    protocol_version = 'HTTP/1.1'
+    # Responses larger than encode_threshold bytes are compressed for
+    # clients that accept gzip or deflate, at compress_level. Off by
+    # default: on fast networks compressing costs more than it saves.
+    encode_threshold = None
+    compress_level = 6
+    # Streamed batch responses are written in chunks of about this many
+    # bytes (or less, when the next element is not done yet).
+    stream_chunk_size = 64 * 1024
+
+    def setup(self):
+        self.keepalive_timeout = getattr(
+            self.server, 'keepalive_timeout', None)
+        self.max_keepalive_requests = getattr(
+            self.server, 'max_keepalive_requests', None)
+        if self.keepalive_timeout is not None and (
+                self.timeout is None or
+                self.keepalive_timeout < self.timeout):
+            # An idle connection times out waiting for the next request
+            # line, which ends handle(). A shorter timeout of the
+            # handler class itself is kept.
+            self.timeout = self.keepalive_timeout
+        self.requests_handled = 0
+        xmlrpc.server.SimpleXMLRPCRequestHandler.setup(self)
+
     def do_POST(self):
+        if not getattr(self.server, 'profile_hooks', None):
+            self._handle_post(None)
+            return
+        trace = Trace('server')
+        try:
+            run_traced(trace, self._handle_post, trace)
+        finally:
+            self.server._run_profile_hooks(trace)
+
+    def _handle_post(self, trace):
         if not self.is_rpc_path_valid():
             self.report_404()
             return
+        encoding = self.headers.get(
+            "content-encoding", "identity").lower()
+        if encoding != 'identity' and encoding not in CONTENT_ENCODINGS:
+            self._reject(501, "encoding %r not supported" % encoding)
+            return
+        max_size = getattr(self.server, 'max_request_size', None)
+        fragments = None
         try:
-            max_chunk_size = 10*1024*1024
             size_remaining = int(self.headers["content-length"])
-            L = []
-            while size_remaining:
-                chunk_size = min(size_remaining, max_chunk_size)
-                chunk = self.rfile.read(chunk_size).decode()
-                L.append(chunk)
-                size_remaining -= len(L[-1])
-            data = ''.join(L)
-            response = self.server._marshaled_dispatch(data)
+            if max_size is not None and size_remaining > max_size:
+                self._reject(400, "request too large")
+                return
+            if trace is not None:
+                trace.request_size = size_remaining
+            stream = getattr(self.server, 'stream_batches', False) and \
+                self.request_version != 'HTTP/1.0'
+            threshold = getattr(
+                self.server, 'incremental_parse_threshold', None)
+            if stream and threshold is not None and \
+                    size_remaining >= threshold:
+                self.request_body_read = False
+                chunks = self.iter_request_body(size_remaining, 64 * 1024)
+                if encoding != 'identity':
+                    chunks = iter_decoded_content(chunks, encoding, max_size)
+                fragments = self._hold_until_read(
+                    self.server._marshaled_dispatch_stream(chunks))
+            else:
+                # Kept as bytes, the JSON backend decodes them directly.
+                chunks = self.iter_request_body(size_remaining)
+                if encoding != 'identity':
+                    chunks = iter_decoded_content(chunks, encoding, max_size)
+                data = b''.join(chunks)
+                if stream:
+                    fragments = self.server._marshaled_dispatch_iter(data)
+                else:
+                    response = self.server._marshaled_dispatch(data)
+            if fragments is not None:
+                response = next(fragments, None)
+                if response is None or not response.startswith('['):
+                    # Not a batch -- a single response, sent as usual.
+                    fragments = None
             self.send_response(200)
-        except Exception:
+        except Exception as exc:
             self.send_response(500)
-            err_lines = traceback.format_exc().splitlines()
-            trace_string = '%s | %s' % (err_lines[-3], err_lines[-1])
-            fault = jsonrpclib.Fault(-32603, 'Server error: %s' % trace_string)
-            response = fault.response()
+            fragments = None
+            response = self.server.fault_policy.fault(exc).response()
         if response is None:
             response = ''
+        if not isinstance(response, bytes):
+            response = response.encode()
+        if trace is not None:
+            start = time.perf_counter()
+        content_encoding = None
+        if self.encode_threshold is not None and \
+                (fragments is not None or
+                 len(response) > self.encode_threshold):
+            content_encoding = preferred_encoding(
+                self.headers.get("accept-encoding", ""))
+            if content_encoding and fragments is None:
+                response = encode_content(
+                    response, content_encoding, self.compress_level)
+        self.requests_handled += 1
+        if self.keepalive_timeout is None or \
+                (self.max_keepalive_requests and
+                 self.requests_handled >= self.max_keepalive_requests):
+            self.close_connection = True
         self.send_header("Content-type", "application/json-rpc")
-        self.send_header("Content-length", str(len(response)))
+        if content_encoding:
+            self.send_header("Content-Encoding", content_encoding)
+        if fragments is not None:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-length", str(len(response)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
         self.end_headers()
-        if isinstance(response, bytes):
-            self.wfile.write(response)
+        if fragments is not None:
+            compressor = None
+            if content_encoding:
+                compressor = content_compressor(
+                    content_encoding, self.compress_level)
+            self.write_chunks(response, fragments, compressor, trace)
         else:
-            self.wfile.write(response.encode())
+            self.wfile.write(response)
+            if trace is not None:
+                trace.response_size = len(response)
+        self.wfile.flush()
+        if trace is not None and fragments is None:
+            trace.add('write', start)
+
+    def do_GET(self):
+        metrics = getattr(self.server, 'metrics', None)
+        if metrics is None:
+            self.send_error(501, "Unsupported method ('GET')")
+            return
+        if self.path != self.server.metrics_path:
+            self.report_404()
+            return
+        response = metrics.render().encode()
+        self.requests_handled += 1
+        if self.keepalive_timeout is None or \
+                (self.max_keepalive_requests and
+                 self.requests_handled >= self.max_keepalive_requests):
+            self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-type", "text/plain; version=0.0.4")
+        self.send_header("Content-length", str(len(response)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(response)
+
+    def _reject(self, code, message):
+        # The body is left unread, so the connection cannot be reused.
+        self.close_connection = True
+        self.send_response(code, message)
+        self.send_header("Content-length", "0")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+    def report_404(self):
+        # A request body is left unread, so the connection cannot be
+        # reused -- and an idle one would block a single-threaded
+        # server.
+        self.close_connection = True
+        response = b'No such page'
+        self.send_response(404)
+        self.send_header("Content-type", "text/plain")
+        self.send_header("Content-length", str(len(response)))
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(response)
+
+    def iter_request_body(self, size_remaining, max_chunk_size=10*1024*1024):
+        while size_remaining:
+            chunk_size = min(size_remaining, max_chunk_size)
+            chunk = self.rfile.read(chunk_size)
+            if not chunk:
+                break
+            size_remaining -= len(chunk)
+            yield chunk
+        self.request_body_read = True
+
+    def _hold_until_read(self, fragments):
+        """
+        Collects the fragments answered while the request body is still
+        arriving. Clients send the whole body before they read anything,
+        so writing earlier could leave both sides blocked on full socket
+        buffers.
+        """
+        held = []
+        for fragment in fragments:
+            held.append(fragment)
+            if self.request_body_read:
+                break
+        if not self.request_body_read:
+            # Answered before the end (a parse error) -- the rest of the
+            # body is unread, so the connection cannot be reused.
+            self.close_connection = True
+        return itertools.chain(held, fragments)
+
+    def write_chunks(self, first, fragments, compressor=None, trace=None):
+        """
+        Writes a batch response with chunked encoding, gathering the
+        elements into chunks of about stream_chunk_size bytes. What is
+        gathered is written early when the dispatcher has to wait for
+        the next element. With a compressor, each chunk is flushed on
+        its own so the client can decode elements as they arrive.
+        """
+        def write(data):
+            if trace is not None:
+                start = time.perf_counter()
+            if compressor is not None:
+                data = compressor.compress(data) + \
+                    compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.write_chunk(data)
+            if trace is not None:
+                trace.response_size += len(data)
+                trace.add('write', start)
+
+        try:
+            buffered = [first]
+            size = len(first)
+            for fragment in fragments:
+                if fragment is not FLUSH_HINT:
+                    data = fragment.encode()
+                    buffered.append(data)
+                    size += len(data)
+                    if size < self.stream_chunk_size:
+                        continue
+                if buffered:
+                    write(b''.join(buffered))
+                    buffered = []
+                    size = 0
+            if buffered:
+                write(b''.join(buffered))
+            if compressor is not None:
+                # The end of the compressed stream.
+                self.write_chunk(compressor.flush())
+        except Exception:
+            # The headers are gone already, so there is no way to
+            # report this to the client -- drop the connection instead
+            # of terminating the chunked body.
+            self.close_connection = True
+            self.log_error('Batch response aborted: %s',
+                           traceback.format_exc().splitlines()[-1])
+            return
+        self.wfile.write(b'0\r\n\r\n')
+
+    def write_chunk(self, data):
+        self.wfile.write(
+            ('%x\r\n' % len(data)).encode('latin-1') + data + b'\r\n')
+        # wfile is buffered (wbufsize = -1), so push every element out.
+        self.wfile.flush()
+
+
+class OverloadedJSONRPCRequestHandler(SimpleJSONRPCRequestHandler):
+    """
+    Reads (and discards) a request, then answers it with an overload
+    fault. It runs on the accepting thread, so reads are kept short.
+    """
+
+    timeout = 1
+    # A single write followed by a close -- Nagle does not matter, and
+    # leaving it alone keeps this usable on Unix sockets.
+    disable_nagle_algorithm = False
+
+    def do_POST(self):
+        size_remaining = int(self.headers.get("content-length", 0))
+        while size_remaining > 0:
+            chunk = self.rfile.read(min(size_remaining, 64 * 1024))
+            if not chunk:
+                break
+            size_remaining -= len(chunk)
+        fault = Fault(OVERLOAD_FAULT_CODE, 'Server overloaded.')
+        response = fault.response().encode()
+        self.send_response(200)
+        self.send_header("Content-type", "application/json-rpc")
+        self.send_header("Content-length", str(len(response)))
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(response)
         self.wfile.flush()
-        self.connection.shutdown(1)
+        self.close_connection = True
 
 
 class SimpleJSONRPCUnixRequestHandler(SimpleJSONRPCRequestHandler):
@@ -198,6 +1041,14 @@ class SimpleJSONRPCUnixRequestHandler(SimpleJSONRPCRequestHandler):
 class SimpleJSONRPCServer(socketserver.TCPServer, SimpleJSONRPCDispatcher):
 
     allow_reuse_address = True
+    # Seconds a persistent (keep-alive) connection may sit idle between
+    # requests. None closes the connection after every response, which
+    # suits this single-threaded server: an idle keep-alive client holds
+    # up everyone else until it times out.
+    keepalive_timeout = None
+    # Requests served on one connection before it is closed (0 or None
+    # for no limit).
+    max_keepalive_requests = 100
 
     def __init__(self, addr, requestHandler=SimpleJSONRPCRequestHandler,
                  logRequests=True, encoding=None, bind_and_activate=True,
@@ -227,6 +1078,245 @@ class SimpleJSONRPCServer(socketserver.TCPServer, SimpleJSONRPCDispatcher):
             fcntl.fcntl(self.fileno(), fcntl.F_SETFD, flags)
 
 
+class PooledJSONRPCServer(SimpleJSONRPCServer):
+    """
+    A SimpleJSONRPCServer that hands accepted connections to a fixed
+    number of worker threads through a bounded queue. When the queue
+    is full, the connection is answered straight away with an
+    overload fault (OVERLOAD_FAULT_CODE) instead of being accepted.
+    """
+
+    rejectHandler = OverloadedJSONRPCRequestHandler
+
+    def __init__(self, addr, requestHandler=SimpleJSONRPCRequestHandler,
+                 logRequests=True, encoding=None, bind_and_activate=True,
+                 address_family=socket.AF_INET, workers=8, queue_size=None):
+        if queue_size is None:
+            queue_size = workers * 4
+        self.workers = workers
+        self.queue_size = queue_size
+        self.rejected_requests = 0
+        self._queue = queue.Queue(queue_size)
+        self._busy_workers = 0
+        self._busy_lock = threading.Lock()
+        SimpleJSONRPCServer.__init__(
+            self, addr, requestHandler, logRequests, encoding,
+            bind_and_activate, address_family)
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._process_queue)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def busy_workers(self):
+        return self._busy_workers
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'busy_workers': self._busy_workers,
+            'utilization': float(self._busy_workers) / self.workers,
+            'queue_depth': self._queue.qsize(),
+            'queue_size': self.queue_size,
+            'rejected_requests': self.rejected_requests,
+        }
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address))
+        except queue.Full:
+            self.reject_request(request, client_address)
+
+    def reject_request(self, request, client_address):
+        self.rejected_requests += 1
+        try:
+            self.rejectHandler(request, client_address, self)
+        except Exception:
+            self.handle_error(request, client_address)
+        self.shutdown_request(request)
+
+    def _process_queue(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            request, client_address = item
+            with self._busy_lock:
+                self._busy_workers += 1
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._busy_lock:
+                    self._busy_workers -= 1
+
+    def server_close(self):
+        SimpleJSONRPCServer.server_close(self)
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        del self._threads[:]
+
+
+class PreForkJSONRPCServer(SimpleJSONRPCServer):
+    """
+    Starts a number of worker processes that each run the regular
+    dispatcher, so CPU heavy methods can use every core. Register
+    functions and instances before calling serve_forever(), which
+    forks the workers and then supervises them:
+
+    * workers that die are replaced,
+    * SIGTERM (or shutdown()) stops accepting, lets every worker
+      finish its current request and then waits for them to exit.
+
+    By default the workers share the inherited listening socket. With
+    reuse_port=True each worker binds its own SO_REUSEPORT socket, and
+    the kernel spreads connections between them.
+    """
+
+    # How often workers check for a drain and the supervisor for
+    # dead workers.
+    poll_interval = 0.5
+    # Seconds to wait for draining workers before killing them.
+    drain_timeout = 30
+
+    def __init__(self, addr, requestHandler=SimpleJSONRPCRequestHandler,
+                 logRequests=True, encoding=None, bind_and_activate=True,
+                 address_family=socket.AF_INET, processes=None,
+                 reuse_port=False):
+        if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+            raise ValueError('SO_REUSEPORT is not supported here.')
+        self.processes = processes or os.cpu_count() or 1
+        self.reuse_port = reuse_port
+        self.worker_pids = set()
+        self._draining = False
+        self._supervisor_done = threading.Event()
+        SimpleJSONRPCServer.__init__(
+            self, addr, requestHandler, logRequests, encoding,
+            bind_and_activate, address_family)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        SimpleJSONRPCServer.server_bind(self)
+
+    def server_activate(self):
+        # With SO_REUSEPORT the supervisor just holds on to the bound
+        # address -- only the workers' sockets listen, so the kernel
+        # never hands a connection to a process that won't accept it.
+        if not self.reuse_port:
+            SimpleJSONRPCServer.server_activate(self)
+
+    def get_request(self):
+        request, client_address = SimpleJSONRPCServer.get_request(self)
+        # The listening socket is non-blocking in the workers (see
+        # _run_worker); make sure that never leaks into the requests.
+        request.setblocking(True)
+        return request, client_address
+
+    def serve_forever(self, poll_interval=None):
+        if poll_interval is not None:
+            self.poll_interval = poll_interval
+        self._draining = False
+        self._supervisor_done.clear()
+        previous_handler = None
+        if threading.current_thread() is threading.main_thread():
+            previous_handler = signal.signal(
+                signal.SIGTERM, self._handle_sigterm)
+        try:
+            while not self._draining:
+                while len(self.worker_pids) < self.processes:
+                    self._spawn_worker()
+                time.sleep(self.poll_interval)
+                self._reap_workers()
+        finally:
+            self._stop_workers()
+            if previous_handler is not None:
+                signal.signal(signal.SIGTERM, previous_handler)
+            self._supervisor_done.set()
+
+    def shutdown(self):
+        """ Drains the workers and waits for serve_forever to return. """
+        self._draining = True
+        self._supervisor_done.wait()
+
+    def _handle_sigterm(self, signum, frame):
+        self._draining = True
+
+    def _spawn_worker(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                self._run_worker()
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                os._exit(status)
+        self.worker_pids.add(pid)
+        return pid
+
+    def _run_worker(self):
+        self.worker_pids = set()
+        self._draining = False
+        signal.signal(signal.SIGTERM, self._handle_sigterm)
+        if self.reuse_port:
+            self.socket.close()
+            self.socket = socket.socket(
+                self.address_family, self.socket_type)
+            self.socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.socket.bind(self.server_address)
+            self.socket.listen(self.request_queue_size)
+        # Every worker wakes up for a new connection on a shared socket
+        # but only one wins the accept() -- the rest must not block.
+        self.socket.setblocking(False)
+        self.timeout = self.poll_interval
+        while not self._draining:
+            self.handle_request()
+
+    def _reap_workers(self):
+        for pid in list(self.worker_pids):
+            try:
+                finished, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                finished = pid
+            if finished:
+                self.worker_pids.discard(pid)
+
+    def _stop_workers(self):
+        for pid in self.worker_pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + self.drain_timeout
+        while self.worker_pids and time.time() < deadline:
+            self._reap_workers()
+            if self.worker_pids:
+                time.sleep(0.05)
+        for pid in self.worker_pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.worker_pids.clear()
+
+
 class CGIJSONRPCRequestHandler(SimpleJSONRPCDispatcher):
 
     def __init__(self, encoding=None):
@@ -235,7 +1325,7 @@ class CGIJSONRPCRequestHandler(SimpleJSONRPCDispatcher):
     def handle_jsonrpc(self, request_text):
         response = self._marshaled_dispatch(request_text)
         print('Content-Type: application/json-rpc')
-        print('Content-Length: %d' % len(response))
+        print('Content-Length: %d' % len(response.encode()))
         print()
         sys.stdout.write(response)
 
@@ -0,0 +1,317 @@
+"""
+Asyncio equivalents of the ServerProxy and MultiCall classes in
+jsonrpclib.jsonrpc. Calls return awaitables, so many requests can
+be issued concurrently with asyncio.gather():
+
+>>> proxy = AsyncServerProxy('http://localhost:8181', pool_size=10)
+>>> results = await asyncio.gather(*[proxy.add(i, i) for i in range(500)])
+>>> await proxy._notify.add(5, 6)
+>>> batch = AsyncMultiCall(proxy)
+>>> batch.add(3, 50)
+>>> batch.add(2, 3)
+>>> list(await batch())
+[53, 5]
+>>> await proxy.close()
+
+Requests share a bounded pool of keep-alive connections, so no more
+than pool_size sockets are opened no matter how many calls are in
+flight.
+"""
+
+import asyncio
+import ssl
+import xmlrpc.client
+
+from jsonrpclib import Config
+from jsonrpclib import History
+from jsonrpclib.jsonrpc import USE_UNIX_SOCKETS, UnixSocketMissing
+from jsonrpclib.jsonrpc import MultiCall, MultiCallIterator
+from jsonrpclib.jsonrpc import _Method, _Notify
+from jsonrpclib.jsonrpc import RequestTemplates, NOT_CACHED
+from jsonrpclib.jsonrpc import check_for_errors, decode_content, encode_content
+from jsonrpclib.jsonrpc import loads
+
+
+class AsyncConnectionPool(object):
+    """
+    Holds up to max_size open connections to a single host. Callers
+    acquire() a (reader, writer) pair and release() it when finished,
+    flagging whether the connection can be reused.
+    """
+
+    def __init__(self, schema, host, max_size=10, ssl_context=None):
+        self.schema = schema
+        self.host = host
+        self.max_size = max_size
+        self.ssl_context = ssl_context
+        self._idle = []
+        self._slots = None
+
+    async def acquire(self):
+        if self._slots is None:
+            # Created lazily so it binds to the loop actually in use.
+            self._slots = asyncio.Semaphore(self.max_size)
+        await self._slots.acquire()
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if reader.at_eof() or writer.transport.is_closing():
+                # The server went away while this was parked.
+                writer.close()
+                continue
+            return reader, writer, True
+        try:
+            reader, writer = await self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+        return reader, writer, False
+
+    def release(self, connection, reusable=True):
+        reader, writer = connection
+        if reusable and not reader.at_eof():
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        self._slots.release()
+
+    async def _connect(self):
+        if self.schema == 'unix':
+            return await asyncio.open_unix_connection(self.host)
+        host, _, port = self.host.rpartition(':')
+        if not host or not port.isdigit():
+            host, port = self.host, None
+        if self.schema == 'https':
+            context = self.ssl_context or ssl.create_default_context()
+            return await asyncio.open_connection(
+                host, int(port or 443), ssl=context)
+        return await asyncio.open_connection(host, int(port or 80))
+
+    def close(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            writer.close()
+
+
+class AsyncTransport(object):
+    """
+    Sends JSON-RPC payloads over pooled HTTP/1.1 connections. Like the
+    blocking transports, it accepts compressed responses and gzips
+    requests larger than encode_threshold bytes (None never does).
+    """
+
+    user_agent = Config.instance().user_agent
+    accept_encoding = 'gzip, deflate'
+    encode_threshold = None
+
+    def __init__(self, schema, host, pool_size=10, ssl_context=None):
+        self.host = host
+        self.pool = AsyncConnectionPool(
+            schema, host, pool_size, ssl_context)
+        if schema == 'unix':
+            self.host_header = 'localhost'
+        else:
+            self.host_header = host
+
+    async def request(self, handler, request_body):
+        if isinstance(request_body, str):
+            request_body = request_body.encode('utf-8')
+        extra_headers = ''
+        if self.accept_encoding:
+            extra_headers += 'Accept-Encoding: %s\r\n' % self.accept_encoding
+        if self.encode_threshold is not None and \
+                len(request_body) > self.encode_threshold:
+            extra_headers += 'Content-Encoding: gzip\r\n'
+            request_body = encode_content(request_body, 'gzip')
+        # Retry once if a parked keep-alive connection has gone cold,
+        # just like the blocking xmlrpc Transport does.
+        for attempt in (0, 1):
+            reader, writer, reused = await self.pool.acquire()
+            reusable = False
+            try:
+                status, reason, headers, body, reusable = \
+                    await self._exchange(reader, writer, handler,
+                                         request_body, extra_headers)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if attempt or not reused:
+                    raise
+                continue
+            finally:
+                self.pool.release((reader, writer), reusable)
+            if status != 200:
+                raise xmlrpc.client.ProtocolError(
+                    self.host + handler, status, reason, headers)
+            encoding = headers.get('content-encoding', 'identity').lower()
+            if encoding != 'identity':
+                body = decode_content(body, encoding)
+            return body
+
+    async def _exchange(self, reader, writer, handler, request_body,
+                        extra_headers=''):
+        head = (
+            'POST %s HTTP/1.1\r\n'
+            'Host: %s\r\n'
+            'User-Agent: %s\r\n'
+            'Content-Type: application/json-rpc\r\n'
+            'Content-Length: %d\r\n'
+            '%s'
+            '\r\n' % (handler or '/', self.host_header, self.user_agent,
+                      len(request_body), extra_headers))
+        writer.write(head.encode('latin-1') + request_body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by server.')
+        version, status, reason = \
+            status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            reusable = connection != 'close'
+        else:
+            reusable = connection == 'keep-alive'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await self._read_chunked(reader)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            reusable = False
+        return int(status), reason, headers, body, reusable
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                # Skip any trailers up to the terminating blank line.
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    def close(self):
+        self.pool.close()
+
+
+class AsyncServerProxy(object):
+    """
+    The asyncio version of ServerProxy. Attribute access builds
+    method calls just like the blocking proxy, but every call
+    returns an awaitable.
+    """
+
+    def __init__(self, uri, transport=None, encoding=None,
+                 version=None, pool_size=10, ssl_context=None,
+                 history=None, id_generator=None, cache=None):
+        from urllib.parse import splittype, splithost
+        if not version:
+            version = Config.instance().version
+        self.__version = version
+        schema, uri = splittype(uri)
+        if schema not in ('http', 'https', 'unix'):
+            raise IOError('Unsupported JSON-RPC protocol.')
+        if schema == 'unix':
+            if not USE_UNIX_SOCKETS:
+                raise UnixSocketMissing("Unix sockets not available.")
+            host = uri
+            self.__handler = '/'
+        else:
+            host, self.__handler = splithost(uri)
+        if transport is None:
+            transport = AsyncTransport(
+                schema, host, pool_size, ssl_context)
+        self.__transport = transport
+        self.__encoding = encoding
+        self.__templates = RequestTemplates(version, id_generator)
+        if history is None:
+            history = History.instance()
+        self.__history = history or None
+        self.__cache = cache
+
+    async def _request(self, methodname, params, rpcid=None):
+        cache = self.__cache
+        if cache is not None:
+            key = cache.make_key(methodname, params)
+            if key is not None:
+                result = cache.get(key, NOT_CACHED)
+                if result is not NOT_CACHED:
+                    return result
+                result = await self._send_request(methodname, params, rpcid)
+                cache.put(key, result)
+                return result
+        return await self._send_request(methodname, params, rpcid)
+
+    async def _send_request(self, methodname, params, rpcid=None):
+        request = self.__templates.encode(methodname, params, rpcid)
+        response = await self._run_request(request)
+        check_for_errors(response)
+        return response['result']
+
+    async def _request_notify(self, methodname, params, rpcid=None):
+        request = self.__templates.encode(
+            methodname, params, rpcid, notify=True)
+        response = await self._run_request(request, notify=True)
+        check_for_errors(response)
+        return
+
+    def _new_id(self):
+        return self.__templates.new_id()
+
+    async def _run_request(self, request, notify=None):
+        history = self.__history
+        if history is not None and history.sample():
+            history.add_request(request)
+        else:
+            history = None
+        response = await self.__transport.request(self.__handler, request)
+        if history is not None:
+            history.add_response(response)
+        if not response:
+            return None
+        return loads(response)
+
+    async def close(self):
+        self.__transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def __getattr__(self, name):
+        return _Method(self._request, name)
+
+    @property
+    def _notify(self):
+        return _Notify(self._request_notify)
+
+
+class AsyncMultiCall(MultiCall):
+    """ A MultiCall whose __call__ is awaited. """
+
+    async def _request(self):
+        if len(self._job_list) < 1:
+            return
+        request_body = '[ {0} ]'.format(
+            ','.join([self._job_request(job) for job in self._job_list]))
+        del self._job_list[:]
+        responses = await self._server._run_request(request_body)
+        if not responses:
+            responses = []
+        return MultiCallIterator(responses)
+
+    __call__ = _request
+
+
+AsyncServer = AsyncServerProxy
@@ -0,0 +1,163 @@
+import collections
+import json
+import threading
+import time
+
+
+class ResponseCache(object):
+    """
+    Results of read-only methods, for a ServerProxy (cache=...) to
+    answer repeated calls without a round trip. Only the methods given
+    in methods are cached -- a dict of method name to TTL in seconds,
+    or a list of names that all use ttl. Entries are keyed by method
+    and params (canonical JSON, so the order of named params does not
+    matter); params that are not plain JSON are never cached.
+
+    At most max_entries results are kept, and, if max_bytes is set,
+    at most that many bytes of JSON-encoded results; the least recently
+    used ones go first. Results are shared between callers, so they
+    should not be modified. A cache is safe to use from many threads,
+    and can be shared by several proxies to the same server.
+    """
+
+    def __init__(self, methods=(), ttl=60, max_entries=1024, max_bytes=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._methods = {}
+        if isinstance(methods, dict):
+            self._methods.update(methods)
+        else:
+            for method in methods:
+                self._methods[method] = ttl
+        # key -> (expires, result, size), least recently used first.
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def add_method(self, method, ttl=None):
+        self._methods[method] = self.ttl if ttl is None else ttl
+
+    def remove_method(self, method):
+        self._methods.pop(method, None)
+        self.invalidate(method)
+
+    def make_key(self, method, params):
+        """ The cache key of a call, or None if it is not cacheable. """
+        if method not in self._methods:
+            return None
+        try:
+            canonical = json.dumps(
+                params, sort_keys=True, separators=(',', ':'))
+        except (TypeError, ValueError):
+            return None
+        return method, canonical
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result, size=None):
+        """
+        Stores result under key. size is its weight against max_bytes;
+        when not given, it is the length of the JSON-encoded result.
+        """
+        ttl = self._methods.get(key[0])
+        if ttl is None:
+            return
+        if self.max_bytes is None:
+            size = 0
+        elif size is None:
+            try:
+                size = len(json.dumps(result))
+            except (TypeError, ValueError):
+                return
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, result, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and
+                    self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, method=None, params=None):
+        """
+        Drops the cached result of one call (method and params), of
+        every call of method, or everything.
+        """
+        with self._lock:
+            if method is None:
+                self._entries.clear()
+                self._bytes = 0
+            elif params is not None:
+                key = self.make_key(method, params)
+                if key in self._entries:
+                    self._remove(key)
+            else:
+                for key in [k for k in self._entries if k[0] == method]:
+                    self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[2]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CachePolicy(object):
+    """
+    How a server keeps the responses of a function registered with
+    register_function(..., cache=policy): for ttl seconds, at most
+    max_entries different params and, if max_bytes is set, at most
+    that many bytes of responses, least recently used first out. Only
+    pure functions should be cached -- a hit does not call the function
+    at all. Every function gets a ResponseCache of its own.
+    """
+
+    def __init__(self, ttl=60, max_entries=1024, max_bytes=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def new_cache(self, method):
+        return ResponseCache(
+            [method], self.ttl, self.max_entries, self.max_bytes)
+
+    def __repr__(self):
+        return '<CachePolicy ttl=%r max_entries=%r max_bytes=%r>' % (
+            self.ttl, self.max_entries, self.max_bytes)
@@ -1,9 +1,114 @@
+import json
 import sys
+import warnings
 
 
 class LocalClasses(dict):
+    """
+    The classes jsonclass may create, by name. A class is found by its
+    bare name, or by its module qualified name once added with add().
+    version changes whenever the registry does, so lookups cached by
+    jsonclass know to start over.
+    """
+    version = 0
+
     def add(self, cls):
         self[cls.__name__] = cls
+        self['%s.%s' % (cls.__module__, cls.__name__)] = cls
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.version += 1
+
+    def pop(self, *args):
+        self.version += 1
+        return dict.pop(self, *args)
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.version += 1
+
+    def clear(self):
+        dict.clear(self)
+        self.version += 1
+
+
+class JSONBackend(object):
+    """
+    A named dumps / loads pair. dumps must return a str, loads must
+    accept both str and bytes. Anything the backend cannot encode
+    (huge integers, non-string keys, NaN...) is handed to the standard
+    library json module instead, so every backend produces a document
+    for whatever the stdlib accepts.
+    """
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self._dumps = dumps
+        self.loads = loads
+
+    def dumps(self, obj):
+        try:
+            return self._dumps(obj)
+        except (TypeError, ValueError, OverflowError):
+            if self._dumps is json.dumps:
+                raise
+            return json.dumps(obj)
+
+    def __repr__(self):
+        return '<JSONBackend %s>' % self.name
+
+
+def _orjson_backend():
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+    return JSONBackend('orjson', dumps, orjson.loads)
+
+
+def _ujson_backend():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(
+            obj, ensure_ascii=True, escape_forward_slashes=False)
+    return JSONBackend('ujson', dumps, ujson.loads)
+
+
+def _rapidjson_backend():
+    import rapidjson
+    return JSONBackend('rapidjson', rapidjson.dumps, rapidjson.loads)
+
+
+def _simplejson_backend():
+    import simplejson
+    return JSONBackend('simplejson', simplejson.dumps, simplejson.loads)
+
+
+# Backends that are installed, by name. Filled in when this module is
+# imported; use register_json_backend() to add your own.
+JSON_BACKENDS = {'json': JSONBackend('json', json.dumps, json.loads)}
+# The order json_backend = 'auto' tries them in -- fastest first.
+AUTO_JSON_BACKENDS = ['orjson', 'rapidjson', 'ujson', 'simplejson', 'json']
+
+for _name, _factory in (('orjson', _orjson_backend),
+                        ('ujson', _ujson_backend),
+                        ('rapidjson', _rapidjson_backend),
+                        ('simplejson', _simplejson_backend)):
+    try:
+        JSON_BACKENDS[_name] = _factory()
+    except ImportError:
+        pass
+
+
+def register_json_backend(name, dumps, loads):
+    JSON_BACKENDS[name] = JSONBackend(name, dumps, loads)
+    Config.instance()._backend = None
 
 
 class Config(object):
@@ -26,15 +131,48 @@ class Config(object):
     # references of the attributes the class translator should ignore.
     classes = LocalClasses()
     # The list of classes to use for jsonclass translation.
+    registered_classes_only = False
+    # Set to True to only create the classes in 'classes'. Otherwise
+    # classes from modules that are already imported are found too
+    # (modules are never imported for a __jsonclass__ hint).
     version = 2.0
     # Version of the JSON-RPC spec to support
     user_agent = 'jsonrpclib/0.1 (Python %s)' % \
         '.'.join([str(ver) for ver in sys.version_info[0:3]])
     # User agent to use for calls.
+    id_generator = 'random'
+    # How proxies make request ids: 'random' (8 random characters),
+    # 'counter' (1, 2, 3... per proxy), 'prefixed' (a per-process prefix
+    # plus a counter, unique across processes) or a callable returning
+    # the next id.
+    json_backend = 'json'
+    # The JSON library used to encode and decode messages: 'json',
+    # 'orjson', 'ujson', 'rapidjson', 'simplejson' or 'auto' (the
+    # fastest one installed). A backend that is not installed falls
+    # back to 'json' with a warning.
     _instance = None
+    _backend = None
 
     @classmethod
     def instance(cls):
         if not cls._instance:
             cls._instance = cls()
         return cls._instance
+
+    def get_json_backend(self):
+        backend = self._backend
+        if backend is not None and backend[0] == self.json_backend:
+            return backend[1]
+        name = self.json_backend
+        if name == 'auto':
+            selected = [b for b in AUTO_JSON_BACKENDS if b in JSON_BACKENDS]
+            selected = JSON_BACKENDS[selected[0]]
+        elif name in JSON_BACKENDS:
+            selected = JSON_BACKENDS[name]
+        else:
+            warnings.warn(
+                'JSON backend %r is not available, using json.' % name,
+                RuntimeWarning)
+            selected = JSON_BACKENDS['json']
+        self._backend = (name, selected)
+        return selected
@@ -1,49 +1,97 @@
+import collections
+import itertools
+
+
 class History(object):
     """
-    This holds all the response and request objects for a
-    session. A server using this should call "clear" after
-    each request cycle in order to keep it from clogging
-    memory.
+    This holds the most recent response and request objects for a
+    session, in a ring buffer of 'size' entries (-1 keeps everything,
+    0 turns the history off). A ServerProxy records into the shared
+    History.instance() unless it is given its own History, so each
+    proxy (or each thread, with a proxy per thread) can be kept apart.
+
+    With sample_every set to N, only one in N calls is recorded.
+    Appending to the buffers is thread-safe and never copies them.
     """
-    size = 20
-    requests = []
-    responses = []
+    default_size = 20
     _instance = None
 
+    def __init__(self, size=None, sample_every=1):
+        if size is None:
+            size = self.default_size
+        self._requests = collections.deque()
+        self._responses = collections.deque()
+        self.size = size
+        self.sample_every = sample_every
+        self._calls = itertools.count()
+
     @classmethod
     def instance(cls):
         if not cls._instance:
             cls._instance = cls()
         return cls._instance
 
+    @property
+    def size(self):
+        return self._size
+
+    @size.setter
+    def size(self, size):
+        maxlen = size if size > 0 else None
+        if size == 0:
+            # Disabled -- drop what was kept so far.
+            self._requests.clear()
+            self._responses.clear()
+        self._requests = collections.deque(self._requests, maxlen)
+        self._responses = collections.deque(self._responses, maxlen)
+        self._size = size
+
+    def sample(self):
+        """
+        True if the next call should be recorded. Callers check this
+        once per call, so the request and response stay paired.
+        """
+        if not self._size:
+            return False
+        return self.sample_every <= 1 or \
+            next(self._calls) % self.sample_every == 0
+
     def add_response(self, response_obj):
-        if self.size == 0:
+        if self._size == 0:
             return
-        self.responses.append(response_obj)
-        if self.size > 0:
-            self.responses = self.responses[0 - self.size:]
+        if isinstance(response_obj, bytes):
+            # Transports hand over raw bytes; only decode them for
+            # the history when it is actually kept.
+            response_obj = response_obj.decode('utf-8', 'replace')
+        self._responses.append(response_obj)
 
     def add_request(self, request_obj):
-        if self.size == 0:
+        if self._size == 0:
             return
-        self.requests.append(request_obj)
-        if self.size > 0:
-            self.requests = self.requests[0 - self.size:]
+        self._requests.append(request_obj)
+
+    @property
+    def requests(self):
+        return list(self._requests)
+
+    @property
+    def responses(self):
+        return list(self._responses)
 
     @property
     def request(self):
-        if len(self.requests) == 0:
+        try:
+            return self._requests[-1]
+        except IndexError:
             return None
-        else:
-            return self.requests[-1]
 
     @property
     def response(self):
-        if len(self.responses) == 0:
+        try:
+            return self._responses[-1]
+        except IndexError:
             return None
-        else:
-            return self.responses[-1]
 
     def clear(self):
-        del self.requests[:]
-        del self.responses[:]
+        self._requests.clear()
+        self._responses.clear()
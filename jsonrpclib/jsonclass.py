@@ -1,5 +1,5 @@
-import inspect
 import re
+import sys
 
 from jsonrpclib import config
 
@@ -9,119 +9,274 @@ string_types = (str, )
 numeric_types = (int, float)
 
 supported_types = iter_types+string_types+numeric_types+value_types
+_supported_types = frozenset(supported_types)
+# Values that never need translating, checked by exact type.
+_leaf_types = frozenset((str, int, float, bool))
+_container_types = frozenset((dict, list, tuple))
 invalid_module_chars = r'[^a-zA-Z0-9\_\.]'
+_valid_class_name = re.compile(r'[a-zA-Z0-9_.]+\Z')
 
 
 class TranslationError(Exception):
     pass
 
 
-def dump(obj, serialize_method=None, ignore_attribute=None, ignore=[]):
-    if not serialize_method:
-        serialize_method = config.serialize_method
-    if not ignore_attribute:
-        ignore_attribute = config.ignore_attribute
+# Serialization plans, by (class, serialize_method, ignore_attribute).
+# Keying on the config values means changing them simply builds new
+# plans; call clear_cache() after changing a class itself.
+_plans = {}
+_max_plans = 1024
+
+
+# Classes found for __jsonclass__ hints. They stay valid as long as
+# config.classes and config.registered_classes_only do not change.
+_resolved = {}
+_resolved_state = None
+_max_resolved = 1024
+
+
+def clear_cache():
+    _plans.clear()
+    _resolved.clear()
+
+
+def _build_plan(cls, serialize_method, ignore_attribute):
+    module_name = cls.__module__
+    json_class = cls.__name__
+    if module_name not in ['', '__main__', None]:
+        json_class = '%s.%s' % (module_name, json_class)
+    has_serialize = hasattr(cls, serialize_method)
+    class_ignore = list(getattr(cls, ignore_attribute, []))
+    plan = (json_class, has_serialize, class_ignore)
+    if len(_plans) >= _max_plans:
+        # Classes created on the fly should not pile up forever.
+        _plans.clear()
+    _plans[(cls, serialize_method, ignore_attribute)] = plan
+    return plan
+
+
+class _Frame(object):
+    """ A container part way through _transform. """
+    __slots__ = ('container', 'items', 'new', 'key')
+
+    def __init__(self, container, owned):
+        self.container = container
+        if isinstance(container, dict):
+            self.items = iter(container.items())
+        else:
+            self.items = enumerate(container)
+        # The copy that receives converted values -- only made once
+        # the first value actually changes (unless we own the original).
+        self.new = container if owned else None
+        self.key = None
+
+    def set(self, key, value):
+        if self.new is None:
+            if isinstance(self.container, dict):
+                self.new = dict(self.container)
+            else:
+                self.new = list(self.container)
+        self.new[key] = value
+
+    def result(self):
+        if self.new is None:
+            return self.container
+        if isinstance(self.container, tuple):
+            return tuple(self.new)
+        return self.new
+
+
+def _transform(obj, is_container, convert):
+    """
+    Returns obj with convert(value) applied to every value below it
+    that is not a container. convert returns the replacement and
+    whether it is a (new) container that must be walked as well.
+    Containers in which nothing changed are returned as they are, so
+    plain data is never copied. Walks with an explicit stack, so deep
+    nesting cannot hit the recursion limit.
+    """
+    owned = False
+    if not is_container(obj):
+        obj, owned = convert(obj)
+        if not owned:
+            return obj
+    stack = [_Frame(obj, owned)]
+    active = set([id(obj)])
+    while True:
+        frame = stack[-1]
+        for key, value in frame.items:
+            if value is None or type(value) in _leaf_types:
+                continue
+            if is_container(value):
+                if id(value) in active:
+                    raise ValueError('Circular reference detected.')
+                frame.key = key
+                stack.append(_Frame(value, False))
+                active.add(id(value))
+                break
+            new_value, descend = convert(value)
+            if descend:
+                frame.key = key
+                stack.append(_Frame(new_value, True))
+                break
+            if new_value is not value:
+                frame.set(key, new_value)
+        else:
+            stack.pop()
+            active.discard(id(frame.container))
+            result = frame.result()
+            if not stack:
+                return result
+            if frame.new is not None:
+                parent = stack[-1]
+                parent.set(parent.key, result)
+
+
+def _is_plain(obj, hint_key=None):
+    """
+    True if there is nothing but plain data below the container obj
+    (and no dict holding hint_key), in which case translating it would
+    change nothing. Much cheaper than _transform, as nothing is built.
+    """
+    stack = [obj]
+    seen = set()
+    while stack:
+        container = stack.pop()
+        if id(container) in seen:
+            continue
+        seen.add(id(container))
+        if isinstance(container, dict):
+            if hint_key is not None and hint_key in container:
+                return False
+            values = container.values()
+        else:
+            values = container
+        for value in values:
+            if value is None or type(value) in _leaf_types:
+                continue
+            if type(value) in _container_types:
+                stack.append(value)
+            else:
+                return False
+    return True
+
+
+def _is_dump_container(obj):
+    return isinstance(obj, iter_types)
+
+
+def _dump_object(obj, serialize_method, ignore_attribute, ignore):
+    """
+    Translates a single object. Returns the translation and whether
+    its values still need translating too.
+    """
     # Parse / return default "types"...
     if obj is None or isinstance(obj, numeric_types+string_types+value_types):
-        return obj
-    if isinstance(obj, iter_types):
-        if isinstance(obj, (list, tuple)):
-            new_obj = []
-            for item in obj:
-                new_obj.append(
-                    dump(item, serialize_method, ignore_attribute, ignore))
-            if isinstance(obj, tuple):
-                new_obj = tuple(new_obj)
-            return new_obj
-        # It's a dict...
-        else:
-            new_obj = {}
-            for key, value in obj.items():
-                new_obj[key] = dump(
-                    value, serialize_method, ignore_attribute, ignore)
-            return new_obj
+        return obj, False
     # It's not a standard type, so it needs __jsonclass__
-    module_name = inspect.getmodule(obj).__name__
-    class_name = obj.__class__.__name__
-    json_class = class_name
-    if module_name not in ['', '__main__']:
-        json_class = '%s.%s' % (module_name, json_class)
+    cls = obj.__class__
+    plan = _plans.get((cls, serialize_method, ignore_attribute))
+    if plan is None:
+        plan = _build_plan(cls, serialize_method, ignore_attribute)
+    json_class, has_serialize, ignore_list = plan
+    instance_dict = getattr(obj, '__dict__', {})
     return_obj = {"__jsonclass__": [json_class]}
     # If a serialization method is defined..
-    if serialize_method in dir(obj):
+    if has_serialize or serialize_method in instance_dict:
         # Params can be a dict (keyword) or list (positional)
         # Attrs MUST be a dict.
         serialize = getattr(obj, serialize_method)
         params, attrs = serialize()
         return_obj['__jsonclass__'].append(params)
         return_obj.update(attrs)
-        return return_obj
+        return return_obj, False
     # Otherwise, try to figure it out
     # Obviously, we can't assume to know anything about the
     # parameters passed to __init__
     return_obj['__jsonclass__'].append([])
-    attrs = {}
-    ignore_list = getattr(obj, ignore_attribute, [])+ignore
+    if ignore_attribute in instance_dict:
+        ignore_list = list(instance_dict[ignore_attribute])
+    if ignore:
+        ignore_list = ignore_list + ignore
     for attr_name, attr_value in obj.__dict__.items():
-        if type(attr_value) in supported_types and \
-                attr_name not in ignore_list and \
-                attr_value not in ignore_list:
-            attrs[attr_name] = dump(
-                attr_value, serialize_method, ignore_attribute, ignore)
-    return_obj.update(attrs)
-    return return_obj
+        if type(attr_value) in _supported_types and (
+                not ignore_list or (attr_name not in ignore_list and
+                                    attr_value not in ignore_list)):
+            return_obj[attr_name] = attr_value
+    return return_obj, True
 
 
-def load(obj):
-    if obj is None or isinstance(
-            obj, string_types + numeric_types + value_types):
+def dump(obj, serialize_method=None, ignore_attribute=None, ignore=[]):
+    if not serialize_method:
+        serialize_method = config.serialize_method
+    if not ignore_attribute:
+        ignore_attribute = config.ignore_attribute
+
+    if type(obj) in _container_types and _is_plain(obj):
         return obj
 
-    if isinstance(obj, list):
-        return_list = []
-        for entry in obj:
-            return_list.append(load(entry))
-        return return_list
-    # Othewise, it's a dict type
-    if '__jsonclass__' not in obj:
-        return_dict = {}
-        for key, value in obj.items():
-            new_value = load(value)
-            return_dict[key] = new_value
-        return return_dict
-    # It's a dict, and it's a __jsonclass__
-    orig_module_name = obj['__jsonclass__'][0]
-    params = obj['__jsonclass__'][1]
+    def convert(value):
+        return _dump_object(value, serialize_method, ignore_attribute, ignore)
+    return _transform(obj, _is_dump_container, convert)
+
+
+def _resolver_state():
+    return (config.classes.version, config.registered_classes_only)
+
+
+def _resolve_class(orig_module_name):
+    global _resolved_state
+    state = _resolver_state()
+    if _resolved_state != state:
+        _resolved.clear()
+        _resolved_state = state
     if orig_module_name == '':
         raise TranslationError('Module name empty.')
-    json_module_clean = re.sub(invalid_module_chars, '', orig_module_name)
-    if json_module_clean != orig_module_name:
+    if not _valid_class_name.match(orig_module_name):
         raise TranslationError('Module name %s has invalid characters.' %
                                orig_module_name)
-    json_module_parts = json_module_clean.split('.')
-    json_class = None
-    if len(json_module_parts) == 1:
-        # Local class name -- probably means it won't work
-        if json_module_parts[0] not in config.classes.keys():
+    json_class = config.classes.get(orig_module_name)
+    if json_class is None and config.registered_classes_only:
+        raise TranslationError('Class %s is not registered.' %
+                               orig_module_name)
+    if json_class is None:
+        json_module_parts = orig_module_name.split('.')
+        if len(json_module_parts) == 1:
+            # Local class name -- probably means it won't work
             raise TranslationError('Unknown class or module %s.' %
                                    json_module_parts[0])
-        json_class = config.classes[json_module_parts[0]]
-    else:
         json_class_name = json_module_parts.pop()
         json_module_tree = '.'.join(json_module_parts)
-        try:
-            temp_module = __import__(json_module_tree)
-        except ImportError:
+        # Modules are never imported on behalf of the remote side --
+        # the class must be registered, or its module already loaded.
+        temp_module = sys.modules.get(json_module_tree)
+        if temp_module is None:
             raise TranslationError('Could not import %s from module %s.' %
                                    (json_class_name, json_module_tree))
+        json_class = getattr(temp_module, json_class_name, None)
+        if not isinstance(json_class, type):
+            raise TranslationError('Unknown class %s in module %s.' %
+                                   (json_class_name, json_module_tree))
+    if len(_resolved) >= _max_resolved:
+        _resolved.clear()
+    _resolved[orig_module_name] = json_class
+    return json_class
+
+
+def _is_load_container(obj):
+    return isinstance(obj, list) or \
+        (isinstance(obj, dict) and '__jsonclass__' not in obj)
 
-        # The returned class is the top-level module, not the one we really
-        # want.  (E.g., if we import a.b.c, we now have a.)  Walk through other
-        # path components to get to b and c.
-        for i in json_module_parts[1:]:
-            temp_module = getattr(temp_module, i)
 
-        json_class = getattr(temp_module, json_class_name)
+def _load_object(obj):
+    if not isinstance(obj, dict):
+        return obj, False
+    # It's a dict, and it's a __jsonclass__
+    orig_module_name = obj['__jsonclass__'][0]
+    params = obj['__jsonclass__'][1]
+    json_class = _resolved.get(orig_module_name)
+    if json_class is None or _resolved_state != _resolver_state():
+        json_class = _resolve_class(orig_module_name)
     # Creating the object...
     new_obj = None
     if isinstance(params, list):
@@ -134,4 +289,10 @@ def load(obj):
         if key == '__jsonclass__':
             continue
         setattr(new_obj, key, value)
-    return new_obj
+    return new_obj, False
+
+
+def load(obj):
+    if type(obj) in _container_types and _is_plain(obj, '__jsonclass__'):
+        return obj
+    return _transform(obj, _is_load_container, _load_object)
@@ -50,14 +50,25 @@ from xmlrpc.client import Transport as XMLTransport
 from xmlrpc.client import SafeTransport as XMLSafeTransport
 from xmlrpc.client import ServerProxy as XMLServerProxy
 from xmlrpc.client import _Method as XML_Method
+from xmlrpc.client import ProtocolError as XMLProtocolError
+import codecs
+import http.client
+import itertools
 import json
+import os
+import select
 import string
 import random
+import re
+import threading
+import time
+import zlib
 
 from jsonrpclib import Config
 from jsonrpclib import History
+from jsonrpclib.profiling import Trace
 
-from http.client import HTTPConnection
+from http.client import HTTPConnection, HTTPSConnection
 from socket import socket
 
 USE_UNIX_SOCKETS = False
@@ -84,12 +95,243 @@ class UnixSocketMissing(Exception):
 
 
 def jdumps(obj, encoding='utf-8'):
-    # Do 'serialize' test at some point for other classes
-    return json.dumps(obj)
+    # Every backend escapes non-ASCII characters or returns text, so
+    # the encoding only matters once the str is turned into bytes.
+    return Config.instance().get_json_backend().dumps(obj)
 
 
 def jloads(json_string):
-    return json.loads(json_string)
+    return Config.instance().get_json_backend().loads(json_string)
+
+
+class JSONArrayDecoder(object):
+    """
+    Incrementally decodes a JSON array that arrives in pieces. Every
+    call to feed() returns the elements completed by that piece, so
+    they can be used before the rest of the array has arrived. The
+    pieces of an element are only scanned for its end (nesting and
+    strings), and it is decoded once that has arrived, so the cost
+    stays linear in the size of the element. If the document turns
+    out not to be an array, it is decoded as a whole by close().
+    """
+
+    _whitespace = ' \t\n\r'
+    # The end of a string (or an escape in it), a change of nesting
+    # and the end of a number or literal.
+    _string_end = re.compile(r'["\\]').search
+    _structure = re.compile(r'[\[\]{}"]').search
+    _scalar_end = re.compile(r'[ \t\n\r,\]]').search
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._state = 'start'
+        # The pieces of the current element (or of the whole document
+        # when it is not an array).
+        self._parts = []
+        self._scalar = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._trailing = False
+        self._offset = 0
+
+    @property
+    def is_array(self):
+        """ None until the first character has been seen. """
+        if self._state == 'start':
+            return None
+        return self._state != 'document'
+
+    def feed(self, data):
+        if isinstance(data, bytes):
+            data = self._text.decode(data)
+        return self._parse(data)
+
+    def close(self):
+        """ Returns any remaining elements, or the non-array document. """
+        elements = self._parse(self._text.decode(b'', final=True))
+        if self._state == 'document':
+            document = ''.join(self._parts)
+            if not document.strip():
+                return []
+            return [jloads(document)]
+        if self._state not in ('start', 'end') or self._trailing:
+            raise ValueError('Incomplete or invalid JSON array.')
+        return elements
+
+    def _parse(self, text):
+        elements = []
+        index = 0
+        length = len(text)
+        while index < length:
+            state = self._state
+            if state == 'document':
+                self._parts.append(text[index:])
+                break
+            if state == 'element':
+                end = self._scan(text, index)
+                if end is None:
+                    self._parts.append(text[index:])
+                    break
+                self._parts.append(text[index:end])
+                element = ''.join(self._parts)
+                self._parts = []
+                elements.append(self._decoder.decode(element))
+                self._state = 'separator'
+                index = end
+                continue
+            char = text[index]
+            if char in self._whitespace:
+                index += 1
+                continue
+            if state == 'start':
+                if char != '[':
+                    self._state = 'document'
+                    continue
+                self._state = 'first'
+            elif state == 'end':
+                self._trailing = True
+                break
+            elif state in ('first', 'value'):
+                if char == ']' and state == 'first':
+                    self._state = 'end'
+                else:
+                    self._state = 'element'
+                    self._scalar = char not in '{["'
+                    self._depth = 0
+                    self._in_string = False
+                    self._escape = False
+                    continue
+            elif char == ',':
+                self._state = 'value'
+            elif char == ']':
+                self._state = 'end'
+            else:
+                raise ValueError('Expected "," or "]" at position %d.' %
+                                 (self._offset + index))
+            index += 1
+        self._offset += length
+        return elements
+
+    def _scan(self, text, index):
+        """ Where the current element ends in text, or None. """
+        if self._scalar:
+            # A number (or literal) is only complete once the next
+            # character shows it does not continue.
+            match = self._scalar_end(text, index)
+            return match.start() if match else None
+        while True:
+            if self._in_string:
+                if self._escape:
+                    if index >= len(text):
+                        return None
+                    index += 1
+                    self._escape = False
+                match = self._string_end(text, index)
+                if match is None:
+                    return None
+                index = match.end()
+                if match.group() == '\\':
+                    self._escape = True
+                    continue
+                self._in_string = False
+                if self._depth == 0:
+                    return index
+            else:
+                match = self._structure(text, index)
+                if match is None:
+                    return None
+                index = match.end()
+                char = match.group()
+                if char == '"':
+                    self._in_string = True
+                elif char in '[{':
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        return index
+
+
+# Content codings
+
+
+# The Content-Encodings understood in both directions, as zlib wbits.
+CONTENT_ENCODINGS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'x-gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+def content_compressor(encoding, level=6):
+    return zlib.compressobj(level, zlib.DEFLATED, CONTENT_ENCODINGS[encoding])
+
+
+def encode_content(data, encoding, level=6):
+    compressor = content_compressor(encoding, level)
+    return compressor.compress(data) + compressor.flush()
+
+
+def iter_decoded_content(chunks, encoding, max_size=None,
+                         max_chunk_size=1024 * 1024):
+    """
+    Decompresses an iterable of byte chunks as they come. Every
+    decoded piece is at most max_chunk_size bytes, and a ValueError is
+    raised if the whole exceeds max_size, so a small compressed body
+    cannot blow up in memory.
+    """
+    if encoding not in CONTENT_ENCODINGS:
+        raise ValueError('Content encoding %r not supported.' % encoding)
+    decompressor = zlib.decompressobj(CONTENT_ENCODINGS[encoding])
+    decoded_size = 0
+    for data in chunks:
+        while data:
+            piece = decompressor.decompress(data, max_chunk_size)
+            data = decompressor.unconsumed_tail
+            decoded_size += len(piece)
+            if max_size is not None and decoded_size > max_size:
+                raise ValueError('Decoded content is too large.')
+            if piece:
+                yield piece
+    piece = decompressor.flush()
+    if max_size is not None and decoded_size + len(piece) > max_size:
+        raise ValueError('Decoded content is too large.')
+    if piece:
+        yield piece
+    if not decompressor.eof:
+        raise ValueError('Compressed content is truncated.')
+
+
+def decode_content(data, encoding, max_size=None):
+    return b''.join(iter_decoded_content([data], encoding, max_size))
+
+
+def preferred_encoding(accept_encoding):
+    """
+    The content coding to answer with, given an Accept-Encoding
+    header value, or None if the client accepts none we support.
+    """
+    best, best_q = None, 0
+    for entry in accept_encoding.split(','):
+        name, _, params = entry.partition(';')
+        name = name.strip().lower()
+        if name == '*':
+            name = 'gzip'
+        if name not in CONTENT_ENCODINGS:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                continue
+        # Ties go to whichever the client listed first.
+        if q > best_q:
+            best, best_q = name, q
+    return best
 
 
 # XMLRPClib re-implementations
@@ -100,22 +342,130 @@ class ProtocolError(Exception):
 
 
 class TransportMixIn(object):
-    """ Just extends the XMLRPC transport where necessary. """
+    """
+    Just extends the XMLRPC transport where necessary.
+
+    Compressed responses are accepted unless accept_gzip_encoding is
+    False, and request bodies larger than encode_threshold bytes are
+    sent gzipped (None, the default, never compresses them -- older
+    servers do not accept compressed requests).
+    """
     user_agent = Config.instance().user_agent
+    accept_encoding = 'gzip, deflate'
+    # The connection of a streamed response that has not been read to
+    # the end (yet).
+    _unread_connection = None
+
+    def send_request(self, host, handler, request_body, debug):
+        connection = self.make_connection(host)
+        if connection is self._unread_connection:
+            # A streamed response was abandoned part way -- the
+            # connection cannot carry another request.
+            connection.close()
+            self._unread_connection = None
+        # Transport only has _headers (headers=...) from Python 3.8.
+        headers = list(getattr(self, '_headers', ())) + self._extra_headers
+        if debug:
+            connection.set_debuglevel(1)
+        if self.accept_gzip_encoding:
+            connection.putrequest("POST", handler, skip_accept_encoding=True)
+            headers.append(("Accept-Encoding", self.accept_encoding))
+        else:
+            connection.putrequest("POST", handler)
+        headers.append(("User-Agent", self.user_agent))
+        self.send_headers(connection, headers)
+        self.send_content(connection, request_body)
+        return connection
 
     def send_content(self, connection, request_body):
+        if isinstance(request_body, str):
+            request_body = request_body.encode("utf8")
+        if self.encode_threshold is not None and \
+                len(request_body) > self.encode_threshold:
+            connection.putheader("Content-Encoding", "gzip")
+            request_body = encode_content(request_body, "gzip")
         connection.putheader("Content-Type", "application/json-rpc")
         connection.putheader("Content-Length", str(len(request_body)))
         connection.endheaders()
         if request_body:
-            if type(request_body) == str:
-                request_body = request_body.encode("utf8")
             connection.send(request_body)
 
     def getparser(self):
         target = JSONTarget()
         return JSONParser(target), target
 
+    def parse_response(self, response):
+        # Read the body into a single buffer, instead of the 1K pieces
+        # the XML-RPC transport feeds its parser.
+        data = response.read()
+        encoding = self.content_encoding(response)
+        if encoding:
+            data = decode_content(data, encoding)
+        if self.verbose:
+            print("body:", repr(data))
+        parser, target = self.getparser()
+        parser.feed(data)
+        parser.close()
+        return target.close()
+
+    def stream_request(self, host, handler, request_body, verbose=False):
+        """
+        Sends a request and returns an iterator over the elements of
+        the (batch) response, decoded as they arrive.
+        """
+        connection = self.send_request(
+            host, handler, request_body, verbose)
+        response = connection.getresponse()
+        if response.status != 200:
+            if response.getheader("content-length", ""):
+                response.read()
+            raise XMLProtocolError(
+                host + handler, response.status, response.reason,
+                dict(response.getheaders()))
+        self._unread_connection = connection
+        return self._close_unless_read(
+            connection, self.iter_response(response))
+
+    def _close_unless_read(self, connection, elements):
+        finished = False
+        try:
+            for element in elements:
+                yield element
+            finished = True
+        finally:
+            if self._unread_connection is connection:
+                self._unread_connection = None
+            if not finished:
+                connection.close()
+
+    def iter_response(self, response):
+        decoder = JSONArrayDecoder()
+        chunks = self.iter_response_body(response)
+        encoding = self.content_encoding(response)
+        if encoding:
+            chunks = iter_decoded_content(chunks, encoding)
+        for data in chunks:
+            for element in decoder.feed(data):
+                yield element
+        for element in decoder.close():
+            yield element
+
+    def iter_response_body(self, response):
+        read = getattr(response, 'read1', response.read)
+        while True:
+            data = read(64 * 1024)
+            if not data:
+                break
+            yield data
+
+    def content_encoding(self, response):
+        if not hasattr(response, 'getheader'):
+            return None
+        encoding = response.getheader("Content-Encoding", "").lower()
+        if encoding in ('', 'identity'):
+            return None
+        return encoding
+
 
 class JSONParser(object):
     def __init__(self, target):
@@ -136,7 +486,8 @@ class JSONTarget(object):
         self.data.append(data)
 
     def close(self):
-        return ''.join([d.decode() for d in self.data])
+        # The raw bytes -- loads() decodes them in one go.
+        return b''.join(self.data)
 
 
 class Transport(TransportMixIn, XMLTransport):
@@ -161,8 +512,243 @@ if (USE_UNIX_SOCKETS):
     class UnixTransport(TransportMixIn, XMLTransport):
 
         def make_connection(self, host):
-            host, extra_headers, x509 = self.get_host_info(host)
-            return UnixHTTPConnection(host)
+            # Cache the connection like XMLTransport, so HTTP/1.1
+            # keep-alive works over Unix sockets too.
+            if self._connection and host == self._connection[0]:
+                return self._connection[1]
+            chost, self._extra_headers, x509 = self.get_host_info(host)
+            self._connection = host, UnixHTTPConnection(chost)
+            return self._connection[1]
+
+
+class PoolTimeout(Exception):
+    """ Raised when no pooled connection frees up in time. """
+    pass
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of HTTP connections, keyed by host. At most
+    max_size connections exist at once (idle or in use); callers
+    block in acquire() until one is released. Connections idle for
+    longer than idle_timeout seconds are closed, and idle sockets
+    that became readable (the server closed them, or sent garbage)
+    are reconnected before being handed out again.
+    """
+
+    def __init__(self, max_size=10, idle_timeout=60, acquire_timeout=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self._idle = {}
+        self._size = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, key, factory):
+        """
+        Returns a (connection, reused) tuple, where reused tells
+        whether the connection already holds an open socket.
+        """
+        deadline = None
+        if self.acquire_timeout is not None:
+            deadline = time.time() + self.acquire_timeout
+        with self._condition:
+            while True:
+                self._evict_idle()
+                idle = self._idle.get(key)
+                if idle:
+                    connection = idle.pop()[0]
+                    break
+                if self._size >= self.max_size:
+                    # Make room by dropping an idle connection to
+                    # another host, if there is one.
+                    self._close_one_idle()
+                if self._size < self.max_size:
+                    self._size += 1
+                    connection = None
+                    break
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            'No connection available for %s.' % key)
+                self._condition.wait(remaining)
+        if connection is None:
+            try:
+                connection = factory(key)
+            except BaseException:
+                self.discard()
+                raise
+            return connection, False
+        if self._is_stale(connection):
+            connection.close()
+        return connection, connection.sock is not None
+
+    def release(self, key, connection, reusable=True):
+        with self._condition:
+            if reusable:
+                self._idle.setdefault(key, []).append(
+                    (connection, time.time()))
+            else:
+                connection.close()
+                self._size -= 1
+            self._condition.notify()
+
+    def discard(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            for idle in self._idle.values():
+                for connection, last_used in idle:
+                    connection.close()
+                    self._size -= 1
+            self._idle.clear()
+            self._condition.notify_all()
+
+    def _evict_idle(self):
+        if self.idle_timeout is None:
+            return
+        cutoff = time.time() - self.idle_timeout
+        for idle in self._idle.values():
+            # Oldest connections are at the front of each list.
+            while idle and idle[0][1] < cutoff:
+                idle.pop(0)[0].close()
+                self._size -= 1
+
+    def _close_one_idle(self):
+        for idle in self._idle.values():
+            if idle:
+                idle.pop(0)[0].close()
+                self._size -= 1
+                return
+
+    @staticmethod
+    def _is_stale(connection):
+        sock = connection.sock
+        if sock is None:
+            return False
+        try:
+            # An idle keep-alive socket should have nothing to read --
+            # if it is readable, the server closed it (or it is junk).
+            readable = select.select([sock], [], [], 0)[0]
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+
+class PooledTransportMixIn(TransportMixIn):
+    """
+    Hands every request a connection from a ConnectionPool, so one
+    transport (and one ServerProxy) can be shared between threads.
+    """
+
+    def __init__(self, max_size=10, idle_timeout=60, pool=None):
+        if pool is None:
+            pool = ConnectionPool(max_size, idle_timeout)
+        self.pool = pool
+        self._local = threading.local()
+
+    def request(self, host, handler, request_body, verbose=False):
+        # Retry once if a pooled connection turns out to be dead.
+        for attempt in (0, 1):
+            connection, reused = self.pool.acquire(
+                host, self.new_connection)
+            self._local.connection = connection
+            reusable = False
+            try:
+                response = self.single_request(
+                    host, handler, request_body, verbose)
+                reusable = True
+                return response
+            except http.client.RemoteDisconnected:
+                if attempt or not reused:
+                    raise
+            except (ConnectionResetError, ConnectionAbortedError,
+                    BrokenPipeError):
+                if attempt or not reused:
+                    raise
+            finally:
+                self._local.connection = None
+                self.pool.release(host, connection, reusable)
+
+    def stream_request(self, host, handler, request_body, verbose=False):
+        connection, reused = self.pool.acquire(host, self.new_connection)
+        self._local.connection = connection
+        try:
+            elements = TransportMixIn.stream_request(
+                self, host, handler, request_body, verbose)
+        except BaseException:
+            self.pool.release(host, connection, False)
+            raise
+        finally:
+            self._local.connection = None
+        return self._release_after(host, connection, elements)
+
+    def _release_after(self, host, connection, elements):
+        # The connection stays checked out until the response has been
+        # read completely (or the caller gives up on it).
+        reusable = False
+        try:
+            for element in elements:
+                yield element
+            reusable = True
+        finally:
+            self.pool.release(host, connection, reusable)
+
+    def make_connection(self, host):
+        # Called by send_request() -- use this thread's connection.
+        return self._local.connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            # single_request() closes the connection after errors.
+            connection.close()
+        else:
+            self.pool.close()
+
+
+class PooledTransport(PooledTransportMixIn, XMLTransport):
+    def __init__(self, max_size=10, idle_timeout=60, pool=None):
+        PooledTransportMixIn.__init__(self, max_size, idle_timeout, pool)
+        XMLTransport.__init__(self)
+
+    def new_connection(self, host):
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        return HTTPConnection(chost)
+
+
+class PooledSafeTransport(PooledTransportMixIn, XMLSafeTransport):
+    def __init__(self, max_size=10, idle_timeout=60, pool=None,
+                 context=None):
+        PooledTransportMixIn.__init__(self, max_size, idle_timeout, pool)
+        XMLSafeTransport.__init__(self, context=context)
+
+    def new_connection(self, host):
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        return HTTPSConnection(
+            chost, None, context=self.context, **(x509 or {}))
+
+
+if (USE_UNIX_SOCKETS):
+
+    class PooledUnixTransport(PooledTransportMixIn, XMLTransport):
+        def __init__(self, max_size=10, idle_timeout=60, pool=None):
+            PooledTransportMixIn.__init__(
+                self, max_size, idle_timeout, pool)
+            XMLTransport.__init__(self)
+
+        def new_connection(self, host):
+            chost, self._extra_headers, x509 = self.get_host_info(host)
+            return UnixHTTPConnection(chost)
+
+
+# Stands in for a result missing from a ResponseCache.
+NOT_CACHED = object()
 
 
 class ServerProxy(XMLServerProxy):
@@ -172,7 +758,8 @@ class ServerProxy(XMLServerProxy):
     """
 
     def __init__(self, uri, transport=None, encoding=None,
-                 verbose=0, version=None):
+                 verbose=0, version=None, history=None, id_generator=None,
+                 profile_hook=None, cache=None):
         try:
             from urllib.parse import splittype, splithost  # python 3.x
         except ImportError:
@@ -205,23 +792,74 @@ class ServerProxy(XMLServerProxy):
         self.__transport = transport
         self.__encoding = encoding
         self.__verbose = verbose
+        # Request ids come from id_generator (see make_id_generator).
+        self.__templates = RequestTemplates(version, id_generator)
+        # The shared History by default; pass a History of your own to
+        # keep this proxy's calls apart, or False to record nothing.
+        if history is None:
+            history = History.instance()
+        self.__history = history or None
+        # Called with a profiling.Trace of every call (serialize,
+        # transport and parse phases), if set.
+        self.__profile_hook = profile_hook
+        # A cache.ResponseCache answering repeated read-only calls.
+        self.__cache = cache
 
     def _request(self, methodname, params, rpcid=None):
-        request = dumps(params, methodname, encoding=self.__encoding,
-                        rpcid=rpcid, version=self.__version)
-        response = self._run_request(request)
+        cache = self.__cache
+        if cache is not None:
+            key = cache.make_key(methodname, params)
+            if key is not None:
+                result = cache.get(key, NOT_CACHED)
+                if result is not NOT_CACHED:
+                    return result
+                result = self._send_request(methodname, params, rpcid)
+                cache.put(key, result)
+                return result
+        return self._send_request(methodname, params, rpcid)
+
+    def _send_request(self, methodname, params, rpcid=None):
+        trace = self._start_trace(methodname)
+        request = self.__templates.encode(methodname, params, rpcid)
+        if trace is not None:
+            trace.add('serialize', trace.start)
+        response = self._run_request(request, trace=trace)
         check_for_errors(response)
         return response['result']
 
     def _request_notify(self, methodname, params, rpcid=None):
-        request = dumps(params, methodname, encoding=self.__encoding,
-                        rpcid=rpcid, version=self.__version, notify=True)
-        response = self._run_request(request, notify=True)
+        trace = self._start_trace(methodname)
+        request = self.__templates.encode(
+            methodname, params, rpcid, notify=True)
+        if trace is not None:
+            trace.add('serialize', trace.start)
+        response = self._run_request(request, notify=True, trace=trace)
         check_for_errors(response)
         return
 
-    def _run_request(self, request, notify=None):
-        History.instance().add_request(request)
+    def _start_trace(self, methodname=None):
+        if self.__profile_hook is None:
+            return None
+        trace = Trace('client')
+        if methodname is not None:
+            trace.methods.append(methodname)
+        return trace
+
+    def _new_id(self):
+        return self.__templates.new_id()
+
+    def _run_request(self, request, notify=None, trace=None):
+        history = self.__history
+        if history is not None and history.sample():
+            history.add_request(request)
+        else:
+            history = None
+        if trace is None:
+            # A batch from MultiCall, say -- time what is left.
+            trace = self._start_trace()
+        if trace is not None:
+            trace.request_size = len(request)
+            start = time.perf_counter()
 
         response = self.__transport.request(
             self.__host,
@@ -229,6 +867,8 @@ class ServerProxy(XMLServerProxy):
             request,
             verbose=self.__verbose
         )
+        if trace is not None:
+            trace.add('transport', start)
 
         # Here, the XMLRPC library translates a single list
         # response to the single value -- should we do the
@@ -236,12 +876,42 @@ class ServerProxy(XMLServerProxy):
         # the response object, or expect the Server to be
         # outputting the response appropriately?
 
-        History.instance().add_response(response)
+        if history is not None:
+            history.add_response(response)
         if not response:
-            return None
-        return_obj = loads(response)
+            return_obj = None
+        elif trace is None:
+            return loads(response)
+        else:
+            trace.response_size = len(response)
+            start = time.perf_counter()
+            return_obj = loads(response)
+            trace.add('parse', start)
+        if trace is not None:
+            trace.end = time.perf_counter()
+            self.__profile_hook(trace)
         return return_obj
 
+    def _run_stream_request(self, request):
+        """
+        Sends a batch request and returns an iterator over the decoded
+        response entries, as they arrive. The response is not recorded
+        in the History.
+        """
+        history = self.__history
+        if history is not None and history.sample():
+            history.add_request(request)
+        elements = self.__transport.stream_request(
+            self.__host,
+            self.__handler,
+            request,
+            verbose=self.__verbose
+        )
+        if Config.instance().use_jsonclass is True:
+            from jsonrpclib import jsonclass
+            return (jsonclass.load(element) for element in elements)
+        return elements
+
     def __getattr__(self, name):
         # Same as original, just with new _Method reference
         return _Method(self._request, name)
@@ -329,41 +999,86 @@ class MultiCallNotify(object):
 
 
 class MultiCallIterator(object):
+    """
+    The results of a MultiCall. The results can also be an iterator
+    (from a streamed response), in which case they are pulled in as
+    they are needed, and iterating yields each result as it arrives.
+    """
 
     def __init__(self, results):
+        self._source = None
+        if hasattr(results, '__next__'):
+            self._source = results
+            results = []
         self.results = results
 
     def __iter__(self):
-        for i in range(0, len(self.results)):
+        i = 0
+        while i < len(self.results) or self._fetch(i):
             yield self[i]
+            i += 1
 
     def __getitem__(self, i):
+        if self._source is not None:
+            if i < 0:
+                self._fetch()
+            else:
+                self._fetch(i)
         item = self.results[i]
         check_for_errors(item)
         return item['result']
 
     def __len__(self):
+        self._fetch()
         return len(self.results)
 
+    def _fetch(self, index=None):
+        """
+        Pulls results from the source until index is available (or
+        all of them, if index is None). Returns whether it is.
+        """
+        while self._source is not None and \
+                (index is None or len(self.results) <= index):
+            try:
+                self.results.append(next(self._source))
+            except StopIteration:
+                self._source = None
+        return index is not None and index < len(self.results)
+
 
 class MultiCall(object):
+    """
+    Collects calls into a batch request. With stream=True, the
+    results can be used as the server streams them back instead of
+    after the whole response has been read.
+    """
 
-    def __init__(self, server):
+    def __init__(self, server, stream=False):
         self._server = server
         self._job_list = []
+        self._stream = stream
 
     def _request(self):
         if len(self._job_list) < 1:
             # Should we alert? This /is/ pretty obvious.
             return
         request_body = '[ {0} ]'.format(
-            ','.join([job.request() for job in self._job_list]))
+            ','.join([self._job_request(job) for job in self._job_list]))
+        if self._stream:
+            del self._job_list[:]
+            return MultiCallIterator(
+                iter(self._server._run_stream_request(request_body)))
         responses = self._server._run_request(request_body)
         del self._job_list[:]
         if not responses:
             responses = []
         return MultiCallIterator(responses)
 
+    def _job_request(self, job):
+        if job.notify:
+            return job.request()
+        return job.request(rpcid=self._server._new_id())
+
     @property
     def _notify(self):
         return MultiCallNotify(self)
@@ -405,11 +1120,91 @@ class Fault(object):
         return '<Fault %s: %s>' % (self.faultCode, self.faultString)
 
 
+# Maps every byte value onto IDCHARS, so random bytes become an id in
+# one translate() call.
+_ID_TABLE = bytes(
+    ord(IDCHARS[i % len(IDCHARS)]) for i in range(256))
+
+
 def random_id(length=8):
-    return_id = ''
-    for i in range(length):
-        return_id += random.choice(IDCHARS)
-    return return_id
+    data = random.getrandbits(length * 8).to_bytes(length, 'little')
+    return data.translate(_ID_TABLE).decode('ascii')
+
+
+class RandomIdGenerator(object):
+    """ Random 8 character ids -- the default. """
+
+    def __init__(self, length=8):
+        self.length = length
+
+    def __call__(self):
+        return random_id(self.length)
+
+
+class CounterIdGenerator(object):
+    """
+    Consecutive integer ids, starting at start. Each proxy gets its
+    own counter, which is safe to share between threads.
+    """
+
+    def __init__(self, start=1):
+        self._counter = itertools.count(start)
+
+    def __call__(self):
+        return next(self._counter)
+
+
+class PrefixedIdGenerator(object):
+    """
+    A prefix unique to the process followed by a counter, so ids never
+    collide -- across threads, proxies or processes. A forked child
+    picks a new prefix.
+    """
+
+    def __init__(self, prefix=None):
+        self._prefix = prefix
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if self._pid != os.getpid():
+            self._reset()
+        return self._base + str(next(self._counter))
+
+    def _reset(self):
+        with self._lock:
+            pid = os.getpid()
+            if self._pid == pid:
+                return
+            prefix = self._prefix
+            if prefix is None:
+                prefix = '%x%s' % (pid, random_id(4))
+            self._base = prefix + '-'
+            self._counter = itertools.count(1)
+            self._pid = pid
+
+
+ID_GENERATORS = {
+    'random': RandomIdGenerator,
+    'counter': CounterIdGenerator,
+    'prefixed': PrefixedIdGenerator,
+}
+
+
+def make_id_generator(strategy=None):
+    """
+    Returns an id generator: strategy is the name of one of the
+    ID_GENERATORS, or a callable returning ids (used as is). None
+    uses Config.id_generator.
+    """
+    if strategy is None:
+        strategy = Config.instance().id_generator
+    if callable(strategy):
+        return strategy
+    try:
+        return ID_GENERATORS[strategy]()
+    except KeyError:
+        raise ValueError('Unknown id generator %r.' % strategy)
 
 
 class Payload(dict):
@@ -505,13 +1300,104 @@ def dumps(
     return jdumps(request, encoding=encoding)
 
 
+_plain_id = re.compile(r'[A-Za-z0-9_.:-]*\Z').match
+
+
+def encode_id(rpcid, dumps=jdumps):
+    """ The JSON encoding of a request id. """
+    if type(rpcid) is str and _plain_id(rpcid):
+        # Nothing to escape -- skip the encoder for the common case.
+        return '"%s"' % rpcid
+    if type(rpcid) is int:
+        return str(rpcid)
+    return dumps(rpcid)
+
+
+class RequestTemplate(object):
+    """
+    The encoded envelope of a request (or notification) to one method,
+    with holes for the params and the id, so a call only has to encode
+    those two. Built with the JSON backend in use, so the output is the
+    same as what dumps() produces.
+    """
+    _params_mark = '\x00params'
+    _id_mark = '\x00id'
+
+    def __init__(self, methodname, version, notify=False, has_params=True):
+        payload = Payload(rpcid=self._id_mark, version=version)
+        params = self._params_mark if has_params else []
+        if notify:
+            envelope = payload.notify(methodname, params)
+        else:
+            envelope = payload.request(methodname, params)
+        text = jdumps(envelope).replace('{', '{{').replace('}', '}}')
+        holes = []
+        for index, mark in enumerate((self._params_mark, self._id_mark)):
+            encoded = jdumps(mark)
+            if text.count(encoded) > 1:
+                raise ValueError('Method name clashes with the template.')
+            holes.append(encoded in text)
+            text = text.replace(encoded, '{%d}' % index)
+        self.format = text.format
+        self.has_id = holes[1]
+
+    def encode(self, params, rpcid=None, backend=None):
+        dumps = (backend or Config.instance().get_json_backend()).dumps
+        if not self.has_id:
+            return self.format(dumps(params))
+        return self.format(dumps(params), encode_id(rpcid or random_id(),
+                                                    dumps))
+
+
+class RequestTemplates(dict):
+    """
+    A proxy's RequestTemplates, by method. encode() is a drop in for
+    dumps() when building requests.
+    """
+    max_size = 256
+
+    def __init__(self, version=None, id_generator=None):
+        self.version = version
+        self.new_id = make_id_generator(id_generator)
+
+    def encode(self, methodname, params, rpcid=None, notify=False):
+        if not rpcid and not notify:
+            rpcid = self.new_id()
+        if not isinstance(methodname, str) or \
+                not isinstance(params, (tuple, list, dict)):
+            # Let dumps() raise its usual errors.
+            return dumps(params, methodname, rpcid=rpcid,
+                         version=self.version, notify=notify)
+        config = Config.instance()
+        backend = config.get_json_backend()
+        key = (methodname, notify, bool(params), backend)
+        template = self.get(key)
+        if template is None:
+            if len(self) >= self.max_size:
+                self.clear()
+            try:
+                template = RequestTemplate(
+                    methodname, self.version, notify, bool(params))
+            except ValueError:
+                template = False
+            self[key] = template
+        if template is False:
+            return dumps(params, methodname, rpcid=rpcid,
+                         version=self.version, notify=notify)
+        if config.use_jsonclass is True:
+            from jsonrpclib import jsonclass
+            params = jsonclass.dump(params)
+        return template.encode(params, rpcid, backend)
+
+
 def loads(data):
     """
     This differs from the Python implementation, in that it returns
     the request structure in Dict format instead of the method, params.
     It will return a list in the case of a batch request / response.
+    The data can be a str or UTF-8 encoded bytes.
     """
-    if data == '':
+    if not data:
         # notification
         return None
     result = jloads(data)
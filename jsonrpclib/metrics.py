@@ -0,0 +1,111 @@
+import bisect
+import threading
+
+# Calls to methods that do not exist are all counted under this name,
+# so clients cannot grow the table without bounds.
+UNKNOWN_METHOD = '<unknown>'
+
+
+class MethodStats(object):
+    __slots__ = ('calls', 'errors', 'total_time', 'histogram')
+
+    def __init__(self, size):
+        self.calls = 0
+        self.errors = {}
+        self.total_time = 0.0
+        self.histogram = [0] * size
+
+
+class Metrics(object):
+    """
+    Per-method call counts, fault counts by code and latency
+    histograms, as collected by a dispatcher with enable_metrics().
+    The histogram buckets are fixed upper bounds in seconds (plus one
+    for anything slower), so recording a call is a bisect and a few
+    additions under a lock.
+    """
+    default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                       0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=None):
+        if buckets is None:
+            buckets = self.default_buckets
+        self.buckets = tuple(sorted(buckets))
+        self._methods = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method, seconds, code=None):
+        if code == -32601 or not isinstance(method, str):
+            method = UNKNOWN_METHOD
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            stats = self._methods.get(method)
+            if stats is None:
+                stats = self._methods[method] = MethodStats(
+                    len(self.buckets) + 1)
+            stats.calls += 1
+            stats.total_time += seconds
+            stats.histogram[index] += 1
+            if code is not None:
+                stats.errors[code] = stats.errors.get(code, 0) + 1
+
+    def snapshot(self):
+        """
+        The current numbers as plain (JSON-friendly) data. histogram
+        holds the calls per bucket, the last entry counting the ones
+        slower than every bound.
+        """
+        with self._lock:
+            methods = dict(
+                (name, {'calls': stats.calls,
+                        'errors': dict((str(code), count) for code, count
+                                       in stats.errors.items()),
+                        'total_time': stats.total_time,
+                        'histogram': list(stats.histogram)})
+                for name, stats in self._methods.items())
+        return {'buckets': list(self.buckets), 'methods': methods}
+
+    def render(self):
+        """ The numbers in the Prometheus text exposition format. """
+        snapshot = self.snapshot()
+        methods = sorted(snapshot['methods'].items())
+        lines = [
+            '# HELP jsonrpc_calls_total Calls handled, by method.',
+            '# TYPE jsonrpc_calls_total counter']
+        for name, stats in methods:
+            lines.append('jsonrpc_calls_total{method="%s"} %d' % (
+                _escape(name), stats['calls']))
+        lines.extend([
+            '# HELP jsonrpc_errors_total Faults returned, by method and code.',
+            '# TYPE jsonrpc_errors_total counter'])
+        for name, stats in methods:
+            for code, count in sorted(stats['errors'].items()):
+                lines.append(
+                    'jsonrpc_errors_total{method="%s",code="%s"} %d' % (
+                        _escape(name), code, count))
+        lines.extend([
+            '# HELP jsonrpc_call_duration_seconds Time spent in methods.',
+            '# TYPE jsonrpc_call_duration_seconds histogram'])
+        bounds = ['%r' % bound for bound in snapshot['buckets']] + ['+Inf']
+        for name, stats in methods:
+            label = _escape(name)
+            total = 0
+            for bound, count in zip(bounds, stats['histogram']):
+                total += count
+                lines.append(
+                    'jsonrpc_call_duration_seconds_bucket'
+                    '{method="%s",le="%s"} %d' % (label, bound, total))
+            lines.append('jsonrpc_call_duration_seconds_sum{method="%s"} %r'
+                         % (label, stats['total_time']))
+            lines.append('jsonrpc_call_duration_seconds_count{method="%s"} %d'
+                         % (label, stats['calls']))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._methods.clear()
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
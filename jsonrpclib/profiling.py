@@ -0,0 +1,208 @@
+import collections
+import cProfile
+import itertools
+import pstats
+import threading
+import time
+import tracemalloc
+
+# The Trace of the request being handled on this thread, if any.
+_local = threading.local()
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+def run_traced(trace, func, *args):
+    """ Calls func with trace as the current trace of this thread. """
+    previous = current_trace()
+    _local.trace = trace
+    try:
+        return func(*args)
+    finally:
+        _local.trace = previous
+
+
+class Trace(object):
+    """
+    The phases of one request, as (phase, start, end) tuples of
+    time.perf_counter() timestamps, plus the payload sizes in bytes.
+    Profile hooks get one once the request is done.
+
+    On the server the phases are parse, validate, dispatch, serialize
+    and write, with validate, dispatch and serialize repeated for every
+    entry of a batch (in whatever order the entries ran). When a large
+    batch is parsed while it is read, parse also includes waiting for
+    the client. On the client they are serialize, transport (sending
+    the request and reading the response) and parse.
+    """
+    __slots__ = ('side', 'methods', 'phases', 'request_size',
+                 'response_size', 'start', 'end')
+
+    def __init__(self, side):
+        self.side = side
+        self.methods = []
+        self.phases = []
+        self.request_size = 0
+        self.response_size = 0
+        self.start = time.perf_counter()
+        self.end = None
+
+    def add(self, phase, start, end=None):
+        if end is None:
+            end = time.perf_counter()
+        self.phases.append((phase, start, end))
+
+    @property
+    def method(self):
+        """ The method called, or None for batches and bad requests. """
+        if len(self.methods) == 1:
+            return self.methods[0]
+        return None
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def durations(self):
+        """ Seconds spent in each phase, summed over batch entries. """
+        totals = {}
+        for phase, start, end in self.phases:
+            totals[phase] = totals.get(phase, 0.0) + end - start
+        return totals
+
+    def __repr__(self):
+        return '<Trace %s %s %.6fs>' % (
+            self.side, self.method, self.duration)
+
+
+class PhaseStats(object):
+    """
+    A profile hook that sums up traces per side and method: request
+    count, bytes in and out, and the count, total and worst time of
+    every phase. Batches are filed under '<batch>', requests that
+    never reached a method under '<none>'.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, trace):
+        if trace.method is not None:
+            method = trace.method
+        elif trace.methods:
+            method = '<batch>'
+        else:
+            method = '<none>'
+        durations = trace.durations()
+        with self._lock:
+            stats = self._stats.get((trace.side, method))
+            if stats is None:
+                stats = self._stats[(trace.side, method)] = {
+                    'requests': 0, 'request_bytes': 0, 'response_bytes': 0,
+                    'total_time': 0.0, 'phases': {}}
+            stats['requests'] += 1
+            stats['request_bytes'] += trace.request_size
+            stats['response_bytes'] += trace.response_size
+            stats['total_time'] += trace.duration
+            for phase, seconds in durations.items():
+                phase_stats = stats['phases'].get(phase)
+                if phase_stats is None:
+                    phase_stats = stats['phases'][phase] = {
+                        'count': 0, 'total_time': 0.0, 'max_time': 0.0}
+                phase_stats['count'] += 1
+                phase_stats['total_time'] += seconds
+                if seconds > phase_stats['max_time']:
+                    phase_stats['max_time'] = seconds
+
+    def snapshot(self):
+        """ {side: {method: stats}}, as plain data. """
+        result = {}
+        with self._lock:
+            for (side, method), stats in self._stats.items():
+                copied = dict(stats)
+                copied['phases'] = dict(
+                    (phase, dict(values))
+                    for phase, values in stats['phases'].items())
+                result.setdefault(side, {})[method] = copied
+        return result
+
+    def report(self):
+        """ A text table of the mean and worst time per phase. """
+        lines = ['%-6s %-24s %-10s %9s %12s %12s' % (
+            'side', 'method', 'phase', 'count', 'mean ms', 'max ms')]
+        for side, methods in sorted(self.snapshot().items()):
+            for method, stats in sorted(methods.items()):
+                for phase, values in sorted(stats['phases'].items()):
+                    lines.append('%-6s %-24s %-10s %9d %12.3f %12.3f' % (
+                        side, method, phase, values['count'],
+                        values['total_time'] / values['count'] * 1000,
+                        values['max_time'] * 1000))
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class SamplingProfiler(object):
+    """
+    Profiles one in every calls of method, with cProfile (mode
+    'cprofile', each result a pstats.Stats) or tracemalloc (mode
+    'tracemalloc', each result the list of StatisticDiffs between the
+    snapshots before and after the call). The last keep results are
+    in profiles. Only one call is profiled at a time; a sampled call
+    that overlaps another simply runs unprofiled.
+    """
+
+    def __init__(self, method, every=100, mode='cprofile', keep=10):
+        if mode not in ('cprofile', 'tracemalloc'):
+            raise ValueError('Unknown profiling mode %r.' % mode)
+        self.method = method
+        self.every = every
+        self.mode = mode
+        self.profiles = collections.deque(maxlen=keep)
+        self._calls = itertools.count()
+        self._lock = threading.Lock()
+
+    def wants(self, method):
+        return method == self.method and \
+            next(self._calls) % self.every == 0
+
+    def run(self, func, *args):
+        if not self._lock.acquire(False):
+            return func(*args)
+        try:
+            if self.mode == 'cprofile':
+                return self._run_cprofile(func, args)
+            return self._run_tracemalloc(func, args)
+        finally:
+            self._lock.release()
+
+    def _run_cprofile(self, func, args):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (a debugger, coverage...) is active.
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            profiler.disable()
+            self.profiles.append(pstats.Stats(profiler))
+
+    def _run_tracemalloc(self, func, args):
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        try:
+            return func(*args)
+        finally:
+            after = tracemalloc.take_snapshot()
+            if started:
+                tracemalloc.stop()
+            self.profiles.append(after.compare_to(before, 'lineno'))
@@ -19,10 +19,18 @@ try:
     import json
 except ImportError:
     import simplejson as json
+import asyncio
+import gzip
 import os
+import queue
+import signal
 import socket
 import sys
 import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
 from threading import Thread
 
 if sys.version_info < (2, 7):
@@ -30,10 +38,26 @@ if sys.version_info < (2, 7):
 else:
     import unittest
 
-from jsonrpclib import Server, MultiCall, history, ProtocolError
+from jsonrpclib import Server, MultiCall, history, ProtocolError, History
+from jsonrpclib import config as jsonrpclib_config
 from jsonrpclib import jsonrpc
+from jsonrpclib import jsonclass
+from jsonrpclib.jsonrpc import RequestTemplates
+from jsonrpclib.cache import CachePolicy, ResponseCache
+from jsonrpclib.metrics import Metrics
+from jsonrpclib.profiling import PhaseStats, SamplingProfiler
+from jsonrpclib.config import Config, JSON_BACKENDS, AUTO_JSON_BACKENDS
+from jsonrpclib.config import register_json_backend
 from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCDispatcher
+from jsonrpclib.SimpleJSONRPCServer import FaultPolicy, CACHED_ID
 from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCRequestHandler
+from jsonrpclib.SimpleJSONRPCServer import PooledJSONRPCServer
+from jsonrpclib.SimpleJSONRPCServer import OverloadedJSONRPCRequestHandler
+from jsonrpclib.SimpleJSONRPCServer import OVERLOAD_FAULT_CODE
+from jsonrpclib.SimpleJSONRPCServer import PreForkJSONRPCServer
+from jsonrpclib.AsyncJSONRPCServer import AsyncJSONRPCServer
+from jsonrpclib.asyncjsonrpc import AsyncServerProxy, AsyncMultiCall
 
 
 ORIGINAL_HISTORY_SIZE = history.size
@@ -296,8 +320,8 @@ class InternalTests(unittest.TestCase):
         history.size = ORIGINAL_HISTORY_SIZE
         history.clear()
 
-    def get_client(self):
-        return Server('http://localhost:%d' % self.port)
+    def get_client(self, **kwargs):
+        return Server('http://localhost:%d' % self.port, **kwargs)
 
     def get_multicall_client(self):
         server = self.get_client()
@@ -404,6 +428,55 @@ class InternalTests(unittest.TestCase):
         self.assertEqual(0, len(history.requests))
         self.assertEqual(0, len(history.responses))
 
+    def test_history_response_is_text(self):
+        client = self.get_client()
+        self.assertEqual(u'\u2603x', client.add(u'\u2603', 'x'))
+        self.assertTrue(isinstance(history.response, str))
+        self.assertEqual(u'\u2603x', jsonrpc.loads(history.response)['result'])
+        self.assertEqual(
+            u'\u2603x', jsonrpc.loads(history.response.encode())['result'])
+
+    def test_history_per_proxy(self):
+        own_history = History(size=5)
+        client = self.get_client(history=own_history)
+        history.clear()
+        for i in range(8):
+            client.add(i, i)
+        self.assertEqual(0, len(history.requests))
+        self.assertEqual(5, len(own_history.requests))
+        self.assertEqual(14, json.loads(own_history.response)['result'])
+        quiet = self.get_client(history=False)
+        self.assertEqual(2, quiet.add(1, 1))
+        self.assertEqual(0, len(history.requests))
+
+    def test_history_sampling(self):
+        sampled = History(size=-1, sample_every=3)
+        client = self.get_client(history=sampled)
+        for i in range(9):
+            client.add(i, 1)
+        self.assertEqual(3, len(sampled.requests))
+        self.assertEqual(
+            [1, 4, 7],
+            [json.loads(r)['result'] for r in sampled.responses])
+
+    def test_counter_ids(self):
+        recorded = History(size=-1)
+        client = self.get_client(history=recorded, id_generator='counter')
+        self.assertEqual(3, client.add(1, 2))
+        client._notify.add(1, 2)
+        multicall = MultiCall(client)
+        multicall.add(1, 2)
+        multicall._notify.add(1, 2)
+        multicall.ping()
+        self.assertEqual([3, True], list(multicall()))
+        requests = [json.loads(r) for r in recorded.requests]
+        self.assertEqual(1, requests[0]['id'])
+        self.assertFalse('id' in requests[1])
+        self.assertEqual(
+            [2, None, 3], [entry.get('id') for entry in requests[2]])
+        self.assertEqual(
+            [2, 3], [entry['id'] for entry in json.loads(recorded.response)])
+
     def test_multicall_success(self):
         multicall = self.get_multicall_client()
         multicall.ping()
@@ -464,8 +537,8 @@ class UnixSocketInternalTests(InternalTests):
             address_family=socket.AF_UNIX
         )
 
-    def get_client(self):
-        return Server('unix:/%s' % self.port)
+    def get_client(self, **kwargs):
+        return Server('unix:/%s' % self.port, **kwargs)
 
     def tearDown(self):
         """ Removes the tempory socket file """
@@ -495,6 +568,1865 @@ class UnixSocketErrorTests(unittest.TestCase):
         jsonrpc.USE_UNIX_SOCKETS = self.original_value
 
 
+class AsyncServerTests(unittest.TestCase):
+    """
+    Runs calls against the asyncio based server, including
+    coroutine functions and slow calls that must not block others.
+    """
+
+    def setUp(self):
+        self.port = get_port()
+        self.server = AsyncJSONRPCServer(
+            ('', self.port), logRequests=False)
+        service = ExampleAggregateService()
+        self.server.register_instance(service, allow_dotted_names=True)
+        self.server.register_function(service.summation, 'sum')
+
+        async def async_add(x, y):
+            await asyncio.sleep(0)
+            return x + y
+
+        async def async_sleep(seconds):
+            await asyncio.sleep(seconds)
+            return seconds
+
+        async def async_fail():
+            raise ValueError('broken')
+
+        self.server.register_function(async_add)
+        self.server.register_function(async_sleep)
+        self.server.register_function(async_fail)
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.addCleanup(self.cleanup)
+
+    def cleanup(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def get_client(self):
+        return Server('http://localhost:%d' % self.port)
+
+    def test_sync_function(self):
+        client = self.get_client()
+        self.assertEqual(15, client.add(5, 10))
+        self.assertEqual(7, client.sum(1, 2, 4))
+        self.assertEqual(-5, client.sub_service.subtract(5, 10))
+
+    def test_coroutine_function(self):
+        client = self.get_client()
+        self.assertEqual(15, client.async_add(5, 10))
+        self.assertEqual(15, client.async_add(x=5, y=10))
+
+    def test_coroutine_error(self):
+        client = self.get_client()
+        with self.assertRaises(ProtocolError) as error:
+            client.async_fail()
+        self.assertEqual(-32603, error.exception.args[0][0])
+
+    def test_batch(self):
+        multicall = MultiCall(self.get_client())
+        multicall.async_add(1, 2)
+        multicall._notify.sum(1, 2)
+        multicall.add(3, 4)
+        self.assertEqual([3, 7], list(multicall()))
+
+    def test_slow_call_does_not_block(self):
+        slow_result = []
+
+        def slow_call():
+            slow_result.append(self.get_client().async_sleep(1))
+
+        slow_thread = Thread(target=slow_call)
+        slow_thread.start()
+        time.sleep(0.1)
+        start = time.time()
+        self.assertEqual(3, self.get_client().async_add(1, 2))
+        self.assertTrue(time.time() - start < 0.5)
+        slow_thread.join()
+        self.assertEqual([1], slow_result)
+
+    def test_waiting_calls_hold_no_threads(self):
+        # Far more sleeping calls than executor threads, which must all
+        # wait at the same time.
+        executor = ThreadPoolExecutor(2)
+        self.addCleanup(executor.shutdown)
+        self.server.executor = executor
+        start = time.time()
+        with ThreadPoolExecutor(20) as clients:
+            results = list(clients.map(
+                lambda _: self.get_client().async_sleep(0.5), range(20)))
+        self.assertEqual([0.5] * 20, results)
+        self.assertLess(time.time() - start, 2)
+        multicall = MultiCall(self.get_client())
+        for _ in range(20):
+            multicall.async_sleep(0.5)
+        multicall.add(1, 2)
+        start = time.time()
+        self.assertEqual([0.5] * 20 + [3], list(multicall()))
+        self.assertLess(time.time() - start, 2)
+
+    def test_compression(self):
+        connection = HTTPConnection('localhost', self.port)
+        self.addCleanup(connection.close)
+        body = jsonrpc.dumps(['x' * 10000], 'update', rpcid=1).encode()
+        connection.request('POST', '/', body, {'Accept-Encoding': 'gzip'})
+        response = connection.getresponse()
+        self.assertEqual(None, response.getheader('Content-Encoding'))
+        response.read()
+        self.server.encode_threshold = 1400
+        connection.request('POST', '/', gzip.compress(body), {
+            'Content-Encoding': 'gzip', 'Accept-Encoding': 'deflate'})
+        response = connection.getresponse()
+        self.assertEqual('deflate', response.getheader('Content-Encoding'))
+        data = zlib.decompress(response.read())
+        self.assertEqual(['x' * 10000], jsonrpc.loads(data)['result'])
+        connection.request('POST', '/', body, {'Content-Encoding': 'br'})
+        self.assertEqual(501, connection.getresponse().status)
+        client = self.get_client()
+        self.assertEqual(['y' * 10000], client.update('y' * 10000))
+
+    def test_bad_content_length(self):
+        for length in ('abc', '-5'):
+            sock = socket.create_connection(('localhost', self.port), 2)
+            self.addCleanup(sock.close)
+            sock.sendall(('POST / HTTP/1.1\r\nContent-Length: %s\r\n\r\n'
+                          % length).encode())
+            response = sock.makefile('rb').read()
+            self.assertTrue(response.startswith(b'HTTP/1.1 400 '), response)
+            self.assertIn(b'Connection: close', response)
+        self.assertEqual(15, self.get_client().add(5, 10))
+
+
+class AsyncServerProxyTests(AsyncServerTests):
+    """
+    Drives the asyncio server with the asyncio client, checking that
+    concurrent calls share a bounded set of keep-alive connections.
+    """
+
+    def run_async(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def get_async_client(self, pool_size=10):
+        return AsyncServerProxy(
+            'http://localhost:%d' % self.port, pool_size=pool_size)
+
+    def test_async_calls(self):
+        async def run():
+            async with self.get_async_client() as client:
+                result = await client.add(5, 10)
+                named = await client.add(x=1, y=2)
+                namespaced = await client.sub_service.subtract(5, 10)
+                notified = await client._notify.add(1, 2)
+                return result, named, namespaced, notified
+        self.assertEqual((15, 3, -5, None), self.run_async(run()))
+
+    def test_async_error(self):
+        async def run():
+            async with self.get_async_client() as client:
+                await client.foobar()
+        with self.assertRaises(ProtocolError):
+            self.run_async(run())
+
+    def test_async_multicall(self):
+        async def run():
+            async with self.get_async_client() as client:
+                batch = AsyncMultiCall(client)
+                batch.add(1, 2)
+                batch._notify.add(3, 4)
+                batch.async_add(5, 6)
+                return list(await batch())
+        self.assertEqual([3, 11], self.run_async(run()))
+
+    def test_async_compression(self):
+        async def run():
+            async with self.get_async_client() as client:
+                transport = client._AsyncServerProxy__transport
+                transport.encode_threshold = 100
+                return await client.update('y' * 10000)
+        self.server.encode_threshold = 1400
+        self.assertEqual(['y' * 10000], self.run_async(run()))
+
+    def test_gather_uses_bounded_pool(self):
+        connects = []
+
+        async def run():
+            client = self.get_async_client(pool_size=3)
+            pool = client._AsyncServerProxy__transport.pool
+            original_connect = pool._connect
+
+            async def counting_connect():
+                connects.append(1)
+                return await original_connect()
+
+            pool._connect = counting_connect
+            start = time.time()
+            results = await asyncio.gather(
+                *[client.async_sleep(0.1) for i in range(12)])
+            elapsed = time.time() - start
+            await client.close()
+            return results, elapsed
+
+        results, elapsed = self.run_async(run())
+        self.assertEqual([0.1] * 12, results)
+        self.assertEqual(3, len(connects))
+        # Four rounds of three concurrent calls, not twelve sequential.
+        self.assertTrue(elapsed < 1.0)
+
+    def test_against_simple_server(self):
+        port = get_port()
+        server = server_set_up(addr=('', port))
+        self.addCleanup(server.join)
+        self.addCleanup(server.stop)
+
+        async def run():
+            async with AsyncServerProxy('http://localhost:%d' % port) as c:
+                return await asyncio.gather(*[c.add(i, i) for i in range(5)])
+        self.assertEqual([0, 2, 4, 6, 8], self.run_async(run()))
+
+
+class KeepAliveTests(unittest.TestCase):
+    """
+    Checks the request handler keeps connections open when the
+    server has a keepalive_timeout, and honours the request cap.
+    """
+
+    def setUp(self):
+        self.port = get_port()
+        self.server = server_set_up(
+            addr=('', self.port), server_class=PooledJSONRPCServer,
+            workers=2)
+        self.rpc_server = self.server.rpc_server
+        self.rpc_server.keepalive_timeout = 5
+        self.addCleanup(self.server.join)
+        self.addCleanup(self.server.stop)
+
+    def get_client(self):
+        return Server('http://localhost:%d' % self.port)
+
+    def get_socket(self, client):
+        connection = client._ServerProxy__transport._connection[1]
+        return connection.sock
+
+    def test_connection_is_reused(self):
+        client = self.get_client()
+        client.add(1, 2)
+        sock = self.get_socket(client)
+        self.assertTrue(sock is not None)
+        for i in range(5):
+            self.assertEqual(i * 2, client.add(i, i))
+            self.assertTrue(self.get_socket(client) is sock)
+
+    def test_disabled_closes_connection(self):
+        self.rpc_server.keepalive_timeout = None
+        client = self.get_client()
+        self.assertEqual(3, client.add(1, 2))
+        self.assertTrue(self.get_socket(client) is None)
+        self.assertEqual(7, client.add(3, 4))
+
+    def test_max_requests_per_connection(self):
+        self.rpc_server.max_keepalive_requests = 2
+        client = self.get_client()
+        client.add(1, 2)
+        self.assertTrue(self.get_socket(client) is not None)
+        client.add(1, 2)
+        self.assertTrue(self.get_socket(client) is None)
+        self.assertEqual(3, client.add(1, 2))
+
+    def test_idle_timeout(self):
+        self.rpc_server.keepalive_timeout = 0.2
+        client = self.get_client()
+        self.assertEqual(3, client.add(1, 2))
+        time.sleep(0.5)
+        # The server dropped the connection; the client reconnects.
+        self.assertEqual(7, client.add(3, 4))
+
+    def test_bad_path_closes_connection(self):
+        # A connection left open would block a single-threaded server.
+        port = get_port()
+        server = server_set_up(addr=('', port))
+        self.addCleanup(server.join)
+        self.addCleanup(server.stop)
+        connection = HTTPConnection('localhost', port)
+        self.addCleanup(connection.close)
+        for method in ('POST', 'GET'):
+            connection.request(method, '/nowhere', b'{"id": 1}')
+            response = connection.getresponse()
+            self.assertEqual(404, response.status)
+            self.assertEqual('close', response.getheader('Connection'))
+            response.read()
+            other = HTTPConnection('localhost', port, timeout=2)
+            other.request('POST', '/', jsonrpc.dumps([1, 2], 'add', rpcid=1))
+            self.assertEqual(3, jsonrpc.loads(
+                other.getresponse().read())['result'])
+            other.close()
+            server.rpc_server.enable_metrics()
+
+    def test_handler_timeout_is_kept(self):
+        # The overload handler runs on the accepting thread, so its
+        # short timeout must not grow to the keep-alive timeout.
+        handler = OverloadedJSONRPCRequestHandler.__new__(
+            OverloadedJSONRPCRequestHandler)
+        handler.server = self.rpc_server
+        handler.request, other = socket.socketpair()
+        self.addCleanup(handler.request.close)
+        self.addCleanup(other.close)
+        handler.setup()
+        self.assertEqual(1, handler.connection.gettimeout())
+        self.rpc_server.keepalive_timeout = 0.5
+        handler.setup()
+        self.assertEqual(0.5, handler.connection.gettimeout())
+
+    def test_non_ascii_content_length(self):
+        client = self.get_client()
+        self.assertEqual(
+            u'h\xe9llo w\xf6rld', client.add(u'h\xe9llo ', u'w\xf6rld'))
+        self.assertEqual(u'\u2603\u2603', client.add(u'\u2603', u'\u2603'))
+
+
+class CompressingRequestHandler(SimpleJSONRPCRequestHandler):
+    encode_threshold = 1400
+
+
+class CompressionTests(unittest.TestCase):
+    """
+    Checks responses are compressed for clients that accept it, and
+    that compressed requests are decoded, streamed batches included.
+    """
+
+    def setUp(self):
+        self.port = get_port()
+        self.server = server_set_up(
+            addr=('', self.port), requestHandler=CompressingRequestHandler)
+        self.rpc_server = self.server.rpc_server
+        self.addCleanup(self.server.join)
+        self.addCleanup(self.server.stop)
+
+    def post(self, body, headers):
+        connection = HTTPConnection('localhost', self.port)
+        self.addCleanup(connection.close)
+        connection.request('POST', '/', body, headers)
+        response = connection.getresponse()
+        return response, response.read()
+
+    def test_response_encodings(self):
+        body = jsonrpc.dumps(['x' * 10000], 'update', rpcid=1)
+        for accept, encoding, decode in (
+                ('gzip', 'gzip', gzip.decompress),
+                ('gzip;q=0, deflate', 'deflate', zlib.decompress),
+                ('br', None, bytes),
+                (None, None, bytes)):
+            headers = {'Accept-Encoding': accept} if accept else {}
+            response, data = self.post(body, headers)
+            self.assertEqual(
+                encoding, response.getheader('Content-Encoding'))
+            self.assertEqual(
+                ['x' * 10000], jsonrpc.loads(decode(data))['result'])
+            if encoding:
+                self.assertLess(len(data), 1000)
+
+    def test_off_by_default(self):
+        port = get_port()
+        server = server_set_up(addr=('', port))
+        self.addCleanup(server.join)
+        self.addCleanup(server.stop)
+        connection = HTTPConnection('localhost', port)
+        self.addCleanup(connection.close)
+        body = jsonrpc.dumps(['x' * 10000], 'update', rpcid=1)
+        connection.request('POST', '/', body, {'Accept-Encoding': 'gzip'})
+        response = connection.getresponse()
+        self.assertEqual(None, response.getheader('Content-Encoding'))
+        self.assertEqual(
+            ['x' * 10000], jsonrpc.loads(response.read())['result'])
+
+    def test_small_responses_are_not_compressed(self):
+        body = jsonrpc.dumps([1, 2], 'add', rpcid=1)
+        response, data = self.post(body, {'Accept-Encoding': 'gzip'})
+        self.assertEqual(None, response.getheader('Content-Encoding'))
+        self.assertEqual(3, jsonrpc.loads(data)['result'])
+
+    def test_compressed_requests(self):
+        body = jsonrpc.dumps([1, 2], 'add', rpcid=1).encode()
+        for encoding, data in (('gzip', gzip.compress(body)),
+                               ('deflate', zlib.compress(body))):
+            response, data = self.post(data, {'Content-Encoding': encoding})
+            self.assertEqual(3, jsonrpc.loads(data)['result'])
+        response, data = self.post(body, {'Content-Encoding': 'br'})
+        self.assertEqual(501, response.status)
+        response, data = self.post(b'\x1f\x8b garbage',
+                                   {'Content-Encoding': 'gzip'})
+        self.assertEqual(500, response.status)
+
+    def test_request_size_limit(self):
+        self.rpc_server.max_request_size = 5000
+        body = jsonrpc.dumps(['x' * 10000], 'update', rpcid=1).encode()
+        response, data = self.post(body, {})
+        self.assertEqual(400, response.status)
+        self.assertEqual('close', response.getheader('Connection'))
+        # A small compressed body must not expand past the limit either.
+        response, data = self.post(
+            gzip.compress(body), {'Content-Encoding': 'gzip'})
+        self.assertEqual(500, response.status)
+        self.assertIn('too large', jsonrpc.loads(data)['error']['message'])
+        self.rpc_server.incremental_parse_threshold = 0
+        batch = '[%s]' % body.decode()
+        response, data = self.post(
+            gzip.compress(batch.encode()), {'Content-Encoding': 'gzip'})
+        error = jsonrpc.loads(data)['error']
+        self.assertEqual(-32700, error['code'])
+        self.assertIn('too large', error['message'])
+        self.rpc_server.max_request_size = None
+        response, data = self.post(
+            gzip.compress(body), {'Content-Encoding': 'gzip'})
+        self.assertEqual(['x' * 10000], jsonrpc.loads(data)['result'])
+
+    def test_client_round_trip(self):
+        client = Server('http://localhost:%d' % self.port)
+        client._ServerProxy__transport.encode_threshold = 100
+        self.assertEqual(['y' * 10000], client.update('y' * 10000))
+        self.assertIn('yyyy', history.response)
+
+    def test_streamed_batch(self):
+        client = Server('http://localhost:%d' % self.port)
+        multicall = MultiCall(client, stream=True)
+        for i in range(200):
+            multicall.summation(i, i)
+        self.assertEqual([i * 2 for i in range(200)], list(multicall()))
+        body = '[%s]' % ','.join(
+            jsonrpc.dumps([i], 'update', rpcid=i) for i in range(200))
+        response, data = self.post(
+            gzip.compress(body.encode()),
+            {'Accept-Encoding': 'gzip', 'Content-Encoding': 'gzip'})
+        self.assertEqual('chunked', response.getheader('Transfer-Encoding'))
+        self.assertEqual('gzip', response.getheader('Content-Encoding'))
+        results = jsonrpc.loads(gzip.decompress(data))
+        self.assertEqual([[i] for i in range(200)],
+                         [result['result'] for result in results])
+
+    def test_incremental_parse_of_compressed_request(self):
+        self.rpc_server.incremental_parse_threshold = 0
+        client = Server('http://localhost:%d' % self.port)
+        client._ServerProxy__transport.encode_threshold = 0
+        multicall = MultiCall(client, stream=True)
+        for i in range(50):
+            multicall.update('z' * 100)
+        self.assertEqual([['z' * 100]] * 50, list(multicall()))
+
+
+class MetricsTests(unittest.TestCase):
+    """ Checks the per-method counters and their endpoints. """
+
+    def setUp(self):
+        self.port = get_port()
+        self.server = server_set_up(addr=('', self.port))
+        self.rpc_server = self.server.rpc_server
+        self.addCleanup(self.server.join)
+        self.addCleanup(self.server.stop)
+
+    def get(self, path):
+        connection = HTTPConnection('localhost', self.port)
+        self.addCleanup(connection.close)
+        connection.request('GET', path)
+        response = connection.getresponse()
+        return response, response.read()
+
+    def test_histogram_buckets(self):
+        metrics = Metrics(buckets=(0.1, 0.01))
+        for seconds in (0.005, 0.01, 0.05, 3):
+            metrics.observe('add', seconds)
+        metrics.observe('add', 0.001, -32602)
+        metrics.observe('nope', 0.001, -32601)
+        metrics.observe(None, 0.001, -32600)
+        snapshot = metrics.snapshot()
+        self.assertEqual([0.01, 0.1], snapshot['buckets'])
+        add = snapshot['methods']['add']
+        self.assertEqual(5, add['calls'])
+        self.assertEqual([3, 1, 1], add['histogram'])
+        self.assertEqual({'-32602': 1}, add['errors'])
+        self.assertEqual(['<unknown>', 'add'], sorted(snapshot['methods']))
+        text = metrics.render()
+        self.assertIn('jsonrpc_calls_total{method="add"} 5\n', text)
+        self.assertIn('jsonrpc_call_duration_seconds_bucket'
+                      '{method="add",le="0.1"} 4\n', text)
+        self.assertIn('jsonrpc_call_duration_seconds_bucket'
+                      '{method="add",le="+Inf"} 5\n', text)
+        self.assertIn('jsonrpc_errors_total'
+                      '{method="<unknown>",code="-32601"} 1\n', text)
+        metrics.reset()
+        self.assertEqual({}, metrics.snapshot()['methods'])
+
+    def test_disabled(self):
+        client = Server('http://localhost:%d' % self.port)
+        self.assertEqual(3, client.add(1, 2))
+        self.assertTrue(self.rpc_server.metrics is None)
+        self.assertEqual(501, self.get('/metrics')[0].status)
+        with self.assertRaises(ProtocolError):
+            client.rpc.stats()
+
+    def test_server_metrics(self):
+        self.rpc_server.enable_metrics()
+        client = Server('http://localhost:%d' % self.port)
+        self.assertEqual(3, client.add(1, 2))
+        client._notify.add(1, 2)
+        for params in ([1], 'x'):
+            with self.assertRaises(ProtocolError):
+                client.add(*params)
+        with self.assertRaises(ProtocolError):
+            client.missing()
+        batch = MultiCall(client)
+        batch.sub_service.add(1, 2)
+        batch.ping()
+        list(batch())
+        stats = client.rpc.stats()['methods']
+        self.assertEqual(4, stats['add']['calls'])
+        self.assertEqual({'-32602': 2}, stats['add']['errors'])
+        self.assertEqual(1, stats['sub_service.add']['calls'])
+        self.assertEqual({'-32601': 1}, stats['<unknown>']['errors'])
+        response, data = self.get('/metrics')
+        self.assertEqual(200, response.status)
+        self.assertEqual('text/plain; version=0.0.4',
+                         response.getheader('Content-type'))
+        self.assertIn(b'jsonrpc_calls_total{method="ping"} 1\n', data)
+        self.assertIn(b'jsonrpc_calls_total{method="rpc.stats"} 1\n', data)
+        self.assertEqual(404, self.get('/other')[0].status)
+
+    def test_async_server_metrics(self):
+        port = get_port()
+        server = AsyncJSONRPCServer(('', port), logRequests=False)
+        server.register_function(lambda x: x, 'echo')
+        server.enable_metrics(path='/stats')
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        client = Server('http://localhost:%d' % port)
+        self.assertEqual(5, client.echo(5))
+        self.assertEqual(1, client.rpc.stats()['methods']['echo']['calls'])
+        connection = HTTPConnection('localhost', port)
+        self.addCleanup(connection.close)
+        connection.request('GET', '/stats')
+        response = connection.getresponse()
+        self.assertEqual(200, response.status)
+        self.assertIn(b'jsonrpc_calls_total{method="echo"} 1\n',
+                      response.read())
+
+
+class ProfilingTests(unittest.TestCase):
+    """ Checks the phase timings handed to profile hooks. """
+
+    def setUp(self):
+        self.port = get_port()
+        self.server = server_set_up(addr=('', self.port))
+        self.rpc_server = self.server.rpc_server
+        self.addCleanup(self.server.join)
+        self.addCleanup(self.server.stop)
+        # Hooks run after the response is sent, so wait for them.
+        self.traces = queue.Queue()
+        self.rpc_server.add_profile_hook(self.traces.put)
+
+    def get_trace(self):
+        return self.traces.get(timeout=5)
+
+    def test_single_call(self):
+        client = Server('http://localhost:%d' % self.port)
+        self.assertEqual(3, client.add(1, 2))
+        trace = self.get_trace()
+        self.assertEqual(('server', 'add'), (trace.side, trace.method))
+        self.assertEqual(
+            ['parse', 'validate', 'dispatch', 'serialize', 'write'],
+            [phase[0] for phase in trace.phases])
+        for phase, start, end in trace.phases:
+            self.assertTrue(trace.start <= start <= end <= trace.end)
+        self.assertEqual(len(history.request), trace.request_size)
+        self.assertTrue(trace.response_size > 0)
+        self.assertEqual(set(['parse', 'validate', 'dispatch', 'serialize',
+                              'write']), set(trace.durations()))
+
+    def test_batches(self):
+        self.rpc_server.batch_executor = ThreadPoolExecutor(4)
+        self.addCleanup(self.rpc_server.batch_executor.shutdown)
+        stats = self.rpc_server.add_profile_hook(PhaseStats())
+        client = Server('http://localhost:%d' % self.port)
+        for stream in (False, True):
+            multicall = MultiCall(client, stream=stream)
+            for i in range(10):
+                multicall.add(i, i)
+            multicall._notify.ping()
+            self.assertEqual(10, len(list(multicall())))
+            trace = self.get_trace()
+            self.assertEqual(None, trace.method)
+            self.assertEqual(11, len(trace.methods))
+            self.assertEqual(11, [phase[0] for phase in trace.phases].count(
+                'dispatch'))
+            self.assertEqual(10, [phase[0] for phase in trace.phases].count(
+                'serialize'))
+        self.assertEqual(2, stats.snapshot()['server']['<batch>']['requests'])
+        self.assertIn('<batch>', stats.report())
+
+    def test_incremental_parse(self):
+        self.rpc_server.incremental_parse_threshold = 0
+        client = Server('http://localhost:%d' % self.port)
+        multicall = MultiCall(client, stream=True)
+        multicall.add(1, 2)
+        multicall.add(3, 4)
+        self.assertEqual([3, 7], list(multicall()))
+        phases = [phase[0] for phase in self.get_trace().phases]
+        self.assertEqual('parse', phases[0])
+        self.assertEqual(2, phases.count('dispatch'))
+        self.assertIn('write', phases)
+
+    def test_client_hook(self):
+        stats = PhaseStats()
+        client = Server('http://localhost:%d' % self.port,
+                        profile_hook=stats)
+        self.assertEqual(3, client.add(1, 2))
+        client._notify.add(1, 2)
+        batch = MultiCall(client)
+        batch.add(1, 2)
+        list(batch())
+        snapshot = stats.snapshot()['client']
+        self.assertEqual(2, snapshot['add']['requests'])
+        self.assertEqual(set(['serialize', 'transport', 'parse']),
+                         set(snapshot['add']['phases']))
+        self.assertEqual(1, snapshot['<none>']['requests'])
+        stats.reset()
+        self.assertEqual({}, stats.snapshot())
+
+    def test_failing_hook(self):
+        def fail(trace):
+            raise ValueError('broken hook')
+        # Runs before the hook the test waits for.
+        self.rpc_server.remove_profile_hook(self.traces.put)
+        self.rpc_server.add_profile_hook(fail)
+        self.rpc_server.add_profile_hook(self.traces.put)
+        client = Server('http://localhost:%d' % self.port)
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(3, client.add(1, 2))
+            self.get_trace()
+        self.rpc_server.remove_profile_hook(fail)
+        self.rpc_server.remove_profile_hook(self.traces.put)
+        self.assertEqual((), self.rpc_server.profile_hooks)
+
+    def test_sampling_profiler(self):
+        client = Server('http://localhost:%d' % self.port)
+        for mode in ('cprofile', 'tracemalloc'):
+            sampler = SamplingProfiler('add', every=2, mode=mode)
+            self.rpc_server.profile_sampler = sampler
+            for i in range(4):
+                self.assertEqual(i * 2, client.add(i, i))
+            self.assertTrue(client.ping())
+            self.assertEqual(2, len(sampler.profiles))
+        self.assertTrue(isinstance(sampler.profiles[0], list))
+        with self.assertRaises(ValueError):
+            SamplingProfiler('add', mode='perf')
+
+    def test_async_server(self):
+        port = get_port()
+        server = AsyncJSONRPCServer(('', port), logRequests=False)
+        server.register_function(lambda x: x, 'echo')
+        server.add_profile_hook(self.traces.put)
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        client = Server('http://localhost:%d' % port)
+        self.assertEqual(5, client.echo(5))
+        trace = self.get_trace()
+        self.assertEqual('echo', trace.method)
+        self.assertEqual(
+            ['parse', 'validate', 'dispatch', 'serialize', 'write'],
+            [phase[0] for phase in trace.phases])
+        self.assertIn('echo', repr(trace))
+
+
+class ResponseCacheTests(unittest.TestCase):
+    """ Checks the client side cache of read-only results. """
+
+    def setUp(self):
+        self.port = get_port()
+        self.server = server_set_up(addr=('', self.port))
+        self.addCleanup(self.server.join)
+        self.addCleanup(self.server.stop)
+        self.calls = []
+
+        def lookup(name, default=None):
+            self.calls.append(name)
+            return {'name': name, 'value': default}
+
+        self.server.rpc_server.register_function(lookup)
+
+    def get_client(self, cache):
+        return Server('http://localhost:%d' % self.port, cache=cache)
+
+    def test_keys(self):
+        cache = ResponseCache(['lookup'])
+        self.assertEqual(cache.make_key('lookup', {'a': 1, 'b': 2}),
+                         cache.make_key('lookup', {'b': 2, 'a': 1}))
+        self.assertNotEqual(cache.make_key('lookup', [1]),
+                            cache.make_key('lookup', ['1']))
+        self.assertEqual(None, cache.make_key('add', [1]))
+        self.assertEqual(None, cache.make_key('lookup', [object()]))
+
+    def test_cached_calls(self):
+        cache = ResponseCache(['lookup'])
+        client = self.get_client(cache)
+        for i in range(3):
+            self.assertEqual({'name': 'a', 'value': None},
+                             client.lookup('a'))
+            self.assertEqual({'name': 'a', 'value': 1},
+                             client.lookup(name='a', default=1))
+        self.assertEqual(3, client.add(1, 2))
+        self.assertEqual(['a', 'a'], self.calls)
+        stats = cache.stats()
+        self.assertEqual((4, 2, 2), (stats['hits'], stats['misses'],
+                                     stats['entries']))
+        with self.assertRaises(ProtocolError):
+            client.lookup()
+        self.assertEqual(2, len(cache))
+
+    def test_invalidation(self):
+        cache = ResponseCache({'lookup': 60})
+        client = self.get_client(cache)
+        client.lookup('a')
+        client.lookup('b')
+        client.lookup('c', 1)
+        cache.invalidate('lookup', ['a'])
+        client.lookup('a')
+        client.lookup('b')
+        self.assertEqual(['a', 'b', 'c', 'a'], self.calls)
+        cache.invalidate('lookup')
+        client.lookup('b')
+        cache.invalidate()
+        self.assertEqual(0, len(cache))
+        cache.remove_method('lookup')
+        client.lookup('b')
+        client.lookup('b')
+        self.assertEqual(['a', 'b', 'c', 'a', 'b', 'b', 'b'], self.calls)
+
+    def test_expiry_and_limits(self):
+        cache = ResponseCache(['x'], ttl=0)
+        key = cache.make_key('x', [])
+        cache.put(key, None)
+        self.assertEqual('missing', cache.get(key, 'missing'))
+        self.assertEqual(1, cache.stats()['expirations'])
+        cache.add_method('x', 60)
+        cache.put(key, None)
+        self.assertEqual(None, cache.get(key, 'missing'))
+        cache = ResponseCache(['x'], max_entries=2)
+        for i in range(3):
+            cache.put(cache.make_key('x', [i]), i)
+            cache.get(cache.make_key('x', [0]))
+        self.assertEqual(0, cache.get(cache.make_key('x', [0])))
+        self.assertEqual(None, cache.get(cache.make_key('x', [1])))
+        self.assertEqual(1, cache.stats()['evictions'])
+        cache = ResponseCache(['x'], max_bytes=10)
+        cache.put(cache.make_key('x', [0]), 'a' * 20)
+        cache.put(cache.make_key('x', [1]), 'b' * 4)
+        cache.put(cache.make_key('x', [2]), 'c' * 4)
+        self.assertEqual((1, 6), (len(cache), cache.stats()['bytes']))
+
+    def test_threads(self):
+        cache = ResponseCache(['lookup'])
+
+        def call(i):
+            return self.get_client(cache).lookup(str(i % 4))['name']
+
+        with ThreadPoolExecutor(4) as executor:
+            names = list(executor.map(call, range(40)))
+        self.assertEqual([str(i % 4) for i in range(40)], names)
+        self.assertEqual(40, cache.hits + cache.misses)
+        self.assertTrue(len(self.calls) < 40)
+
+    def test_async_proxy(self):
+        port = get_port()
+        server = AsyncJSONRPCServer(('', port), logRequests=False)
+        server.register_function(lambda name: self.calls.append(name) or
+                                 name, 'lookup')
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        cache = ResponseCache(['lookup'])
+
+        async def run():
+            async with AsyncServerProxy('http://localhost:%d' % port,
+                                        cache=cache) as client:
+                return [await client.lookup('a') for i in range(3)]
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(['a'] * 3, loop.run_until_complete(run()))
+        finally:
+            loop.close()
+        self.assertEqual(['a'], self.calls)
+
+
+class ServerMemoizationTests(unittest.TestCase):
+    """ Checks the server side cache of serialized responses. """
+
+    def setUp(self):
+        self.dispatcher = SimpleJSONRPCDispatcher()
+        self.calls = []
+
+        @self.dispatcher.register_function(cache=CachePolicy())
+        def lookup(name, default=None):
+            self.calls.append(name)
+            if name == 'fail':
+                raise KeyError(name)
+            return {'name': name, 'value': default}
+
+    def dispatch(self, method, params, rpcid=1, **kwargs):
+        request = jsonrpc.dumps(params, method, rpcid=rpcid, **kwargs)
+        response = self.dispatcher._marshaled_dispatch(request)
+        if response is not None:
+            return jsonrpc.loads(response)
+
+    def test_cached_responses(self):
+        for rpcid in (1, 'a', 'with "quotes"', 2.5, [1, 2]):
+            response = self.dispatch('lookup', ['a'], rpcid)
+            self.assertEqual(rpcid, response['id'])
+            self.assertEqual({'name': 'a', 'value': None},
+                             response['result'])
+            response = self.dispatch('lookup', {'default': 1, 'name': 'a'})
+            self.assertEqual({'name': 'a', 'value': 1}, response['result'])
+        self.assertEqual(['a', 'a'], self.calls)
+        stats = self.dispatcher.response_caches['lookup'].stats()
+        self.assertEqual((8, 2), (stats['hits'], stats['misses']))
+
+    def test_uncached_calls(self):
+        # Notifications, faults and other versions of the protocol all
+        # reach the function.
+        self.dispatch('lookup', ['a'])
+        self.assertEqual(None, self.dispatch('lookup', ['a'], notify=True))
+        self.assertEqual(['a', 'a'], self.calls)
+        for _ in range(2):
+            response = self.dispatch('lookup', ['fail'])
+            self.assertEqual(-32603, response['error']['code'])
+        response = self.dispatch('lookup', ['a'], version=1.0)
+        self.assertNotIn('jsonrpc', response)
+        self.assertEqual('a', response['result']['name'])
+        self.assertEqual(['a', 'a', 'fail', 'fail', 'a'], self.calls)
+        response = self.dispatch('lookup', ['a'])
+        self.assertEqual('2.0', response['jsonrpc'])
+        self.assertEqual(6, len(self.calls))
+        # A result holding the placeholder id is answered, not cached.
+        for _ in range(2):
+            response = self.dispatch('lookup', [CACHED_ID])
+            self.assertEqual(CACHED_ID, response['result']['name'])
+            self.assertEqual(1, response['id'])
+        self.assertEqual(8, len(self.calls))
+
+    def test_batches(self):
+        self.dispatch('lookup', ['a'])
+        request = '[%s, %s]' % (
+            jsonrpc.dumps(['a'], 'lookup', rpcid='x'),
+            jsonrpc.dumps(['b'], 'lookup', rpcid='y'))
+        for _ in range(2):
+            response = jsonrpc.loads(
+                self.dispatcher._marshaled_dispatch(request))
+            self.assertEqual(
+                {('x', 'a'), ('y', 'b')},
+                set((r['id'], r['result']['name']) for r in response))
+        self.assertEqual(['a', 'b'], self.calls)
+
+    def test_invalidation_and_limits(self):
+        for name in ('a', 'b', 'a', 'b'):
+            self.dispatch('lookup', [name])
+        self.dispatcher.invalidate_cache('lookup', ['a'])
+        self.dispatch('lookup', ['a'])
+        self.dispatch('lookup', ['b'])
+        self.assertEqual(['a', 'b', 'a'], self.calls)
+        self.dispatcher.invalidate_cache()
+        self.dispatch('lookup', ['b'])
+        self.assertEqual(['a', 'b', 'a', 'b'], self.calls)
+
+        def echo(value):
+            self.calls.append(value)
+            return value
+
+        self.dispatcher.register_function(
+            echo, cache=CachePolicy(max_entries=2))
+        for value in (1, 2, 1, 3, 2):
+            self.dispatch('echo', [value])
+        self.assertEqual([1, 2, 3, 2], self.calls[4:])
+        self.dispatcher.register_function(
+            echo, cache=CachePolicy(max_bytes=100))
+        self.dispatch('echo', ['x' * 100])
+        self.dispatch('echo', ['x' * 100])
+        self.assertEqual(0, len(self.dispatcher.response_caches['echo']))
+        self.dispatcher.register_function(echo, cache=CachePolicy(ttl=0))
+        self.dispatch('echo', [1])
+        self.dispatch('echo', [1])
+        self.dispatcher.register_function(echo)
+        self.assertNotIn('echo', self.dispatcher.response_caches)
+        self.dispatch('echo', [1])
+        self.assertEqual(3, self.calls[8:].count(1))
+
+    def test_metrics(self):
+        metrics = self.dispatcher.enable_metrics()
+        for _ in range(3):
+            self.dispatch('lookup', ['a'])
+        self.assertEqual(
+            3, metrics.snapshot()['methods']['lookup']['calls'])
+        self.assertEqual(1, len(self.calls))
+
+
+class JSONBackendTests(unittest.TestCase):
+    """ Checks every installed JSON backend behaves like the stdlib. """
+
+    def setUp(self):
+        config = Config.instance()
+        self.addCleanup(setattr, config, 'json_backend', config.json_backend)
+        self.config = config
+
+    def test_default_backend(self):
+        self.assertEqual('json', self.config.get_json_backend().name)
+
+    def test_backends_round_trip(self):
+        params = [1, 2.5, u'\u2603', None, True, {'a': [1, 2]}, 2 ** 70]
+        for name in JSON_BACKENDS:
+            self.config.json_backend = name
+            request = jsonrpc.dumps(params, 'add', rpcid='1')
+            self.assertTrue(isinstance(request, str))
+            self.assertEqual(
+                json.loads(request), json.loads(jsonrpc.dumps(
+                    params, 'add', rpcid='1')))
+            self.assertEqual(params, jsonrpc.loads(request)['params'])
+            self.assertEqual(
+                params, jsonrpc.loads(request.encode())['params'])
+            with self.assertRaises(ValueError):
+                jsonrpc.loads('{"jsonrpc": ')
+
+    def test_auto_backend(self):
+        self.config.json_backend = 'auto'
+        name = [n for n in AUTO_JSON_BACKENDS if n in JSON_BACKENDS][0]
+        self.assertEqual(name, self.config.get_json_backend().name)
+
+    def test_missing_backend_falls_back(self):
+        self.config.json_backend = 'no-such-json'
+        with self.assertWarns(RuntimeWarning):
+            backend = self.config.get_json_backend()
+        self.assertEqual('json', backend.name)
+
+    def test_register_backend(self):
+        calls = []
+
+        def dumps(obj):
+            calls.append(obj)
+            return json.dumps(obj)
+        register_json_backend('custom', dumps, json.loads)
+        self.addCleanup(JSON_BACKENDS.pop, 'custom')
+        self.config.json_backend = 'custom'
+        jsonrpc.dumps([1], 'ping', rpcid='1')
+        self.assertEqual(1, len(calls))
+
+
+class JSONClassTests(unittest.TestCase):
+    """ Checks jsonclass translation and its per-class caches. """
+
+    def setUp(self):
+        jsonclass.clear_cache()
+        self.addCleanup(jsonclass.clear_cache)
+
+    def test_dump_attributes(self):
+        obj = ExampleObject(1, 'two')
+        obj.skipped = None
+        expected = {
+            '__jsonclass__': ['tests.ExampleObject', []],
+            'x': 1, 'y': 'two'}
+        self.assertEqual(expected, jsonclass.dump(obj))
+        self.assertEqual([expected, expected], jsonclass.dump([obj, obj]))
+        self.assertEqual(1, len(jsonclass._plans))
+
+    def test_dump_ignores(self):
+        obj = ExampleObject(1, 'two')
+        ExampleObject._ignore = ['y']
+        self.addCleanup(delattr, ExampleObject, '_ignore')
+        self.assertEqual(
+            {'__jsonclass__': ['tests.ExampleObject', []], 'x': 1},
+            jsonclass.dump(obj))
+        obj._ignore = ['x', '_ignore']
+        self.assertEqual(
+            {'__jsonclass__': ['tests.ExampleObject', []], 'y': 'two'},
+            jsonclass.dump(obj))
+        self.assertEqual(
+            {'__jsonclass__': ['tests.ExampleObject', []]},
+            jsonclass.dump(obj, ignore=['y']))
+
+    def test_dump_serialize_method(self):
+        obj = ExampleSerializedObject(1, 2)
+        self.assertEqual(
+            {'__jsonclass__': ['tests.ExampleSerializedObject', [1, 2]],
+             'z': 3}, jsonclass.dump(obj))
+        self.assertEqual(
+            {'__jsonclass__': ['tests.ExampleSerializedObject', []],
+             'x': 1, 'y': 2}, jsonclass.dump(obj, serialize_method='_other'))
+
+    def test_config_change_is_picked_up(self):
+        obj = ExampleSerializedObject(1, 2)
+        jsonclass.dump(obj)
+        original = jsonrpclib_config.serialize_method
+        self.addCleanup(
+            setattr, jsonrpclib_config, 'serialize_method', original)
+        jsonrpclib_config.serialize_method = '_other'
+        self.assertEqual(
+            {'__jsonclass__': ['tests.ExampleSerializedObject', []],
+             'x': 1, 'y': 2}, jsonclass.dump(obj))
+
+    def test_plain_data_is_not_copied(self):
+        data = {'a': [1, {'b': u'c', 'd': None}], 't': (1, 2.5, True)}
+        self.assertTrue(jsonclass.dump(data) is data)
+        self.assertTrue(jsonclass.load(data) is data)
+
+    def test_only_changed_containers_are_copied(self):
+        obj = ExampleObject(1, [ExampleObject(2)])
+        data = {'plain': [1, 2], 'objects': (obj, 3)}
+        result = jsonclass.dump(data)
+        self.assertTrue(result['plain'] is data['plain'])
+        self.assertEqual((3, ), result['objects'][1:])
+        self.assertEqual(
+            {'__jsonclass__': ['tests.ExampleObject', []], 'x': 1,
+             'y': [{'__jsonclass__': ['tests.ExampleObject', []], 'x': 2}]},
+            result['objects'][0])
+        self.assertTrue(data['objects'][0] is obj)
+        loaded = jsonclass.load(json.loads(json.dumps(result)))
+        self.assertEqual(1, loaded['objects'][0].x)
+        # Attribute values are set as they are, like they always were.
+        self.assertEqual(2, loaded['objects'][0].y[0]['x'])
+
+    def test_deep_nesting(self):
+        data = leaf = []
+        for i in range(sys.getrecursionlimit() * 2):
+            leaf.append([])
+            leaf = leaf[0]
+        leaf.append(ExampleObject(1))
+        result = jsonclass.dump(data)
+        self.assertFalse(result is data)
+        self.assertTrue(jsonclass.load(data) is data)
+
+    def test_circular_reference(self):
+        data = [ExampleObject(1)]
+        data.append({'loop': data})
+        with self.assertRaises(ValueError):
+            jsonclass.dump(data)
+        # Plain data is passed on untouched; the encoder rejects it.
+        data = [1]
+        data.append({'loop': data})
+        self.assertTrue(jsonclass.dump(data) is data)
+        shared = [1]
+        self.assertEqual(
+            [[1], [1]], jsonclass.dump([shared, shared]))
+
+    def test_load_round_trip(self):
+        obj = jsonclass.load(jsonclass.dump(ExampleObject(1, [2, 3])))
+        self.assertTrue(isinstance(obj, ExampleObject))
+        self.assertEqual((1, [2, 3]), (obj.x, obj.y))
+        obj = jsonclass.load(jsonclass.dump(ExampleSerializedObject(1, 2)))
+        self.assertEqual((1, 2, 3), (obj.x, obj.y, obj.z))
+        self.assertEqual(
+            ExampleObject, jsonclass._resolved['tests.ExampleObject'])
+
+    def test_load_does_not_import_modules(self):
+        self.assertFalse('this' in sys.modules)
+        with self.assertRaises(jsonclass.TranslationError):
+            jsonclass.load({'__jsonclass__': ['this.Zen', []]})
+        self.assertFalse('this' in sys.modules)
+        with self.assertRaises(jsonclass.TranslationError):
+            jsonclass.load({'__jsonclass__': ['os.getcwd', []]})
+        with self.assertRaises(jsonclass.TranslationError):
+            jsonclass.load({'__jsonclass__': ['os.path;', []]})
+
+    def test_registered_classes_only(self):
+        hint = {'__jsonclass__': ['tests.ExampleObject', [1, 2]]}
+        self.assertEqual(1, jsonclass.load(hint).x)
+        self.addCleanup(
+            setattr, jsonrpclib_config, 'registered_classes_only', False)
+        jsonrpclib_config.registered_classes_only = True
+        with self.assertRaises(jsonclass.TranslationError):
+            jsonclass.load(hint)
+        jsonrpclib_config.classes.add(ExampleObject)
+        self.addCleanup(jsonrpclib_config.classes.pop, 'ExampleObject')
+        self.addCleanup(jsonrpclib_config.classes.pop, 'tests.ExampleObject')
+        self.assertEqual(1, jsonclass.load(hint).x)
+        self.assertEqual(1, jsonclass.load(
+            {'__jsonclass__': ['ExampleObject', [1, 2]]}).x)
+
+
+class HistoryTests(unittest.TestCase):
+    """ Checks the History ring buffer on its own. """
+
+    def test_resize_keeps_latest(self):
+        recorded = History(size=-1)
+        for i in range(10):
+            recorded.add_request(i)
+        recorded.size = 3
+        self.assertEqual([7, 8, 9], recorded.requests)
+        recorded.add_request(10)
+        self.assertEqual([8, 9, 10], recorded.requests)
+        recorded.size = 0
+        recorded.add_request(11)
+        self.assertEqual([], recorded.requests)
+        self.assertEqual(None, recorded.request)
+        self.assertFalse(recorded.sample())
+
+    def test_concurrent_adds(self):
+        recorded = History(size=-1)
+
+        def add(n):
+            for i in range(1000):
+                recorded.add_request(i)
+                recorded.add_response(b'x')
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(add, range(8)))
+        self.assertEqual(8000, len(recorded.requests))
+        self.assertEqual('x', recorded.response)
+
+
+class RequestTemplateTests(unittest.TestCase):
+    """ Checks templated requests are identical to dumps() output. """
+
+    def assert_same(self, templates, method, params, rpcid, notify=False):
+        expected = jsonrpc.dumps(
+            params, method, rpcid=rpcid, version=templates.version,
+            notify=notify)
+        self.assertEqual(
+            expected, templates.encode(method, params, rpcid, notify))
+
+    def test_matches_dumps(self):
+        config = Config.instance()
+        self.addCleanup(setattr, config, 'json_backend', config.json_backend)
+        for backend in JSON_BACKENDS:
+            config.json_backend = backend
+            for version in (2.0, 1.0):
+                templates = RequestTemplates(version)
+                for params in ([1, 2], (u'\u2603', None), {'x': [{}]}, [],
+                               [ExampleObject(1)]):
+                    for method in ('add', 'name.space', '{0} {1}%s'):
+                        self.assert_same(templates, method, params, 'a1')
+                        self.assert_same(templates, method, params, 7)
+                        self.assert_same(
+                            templates, method, params, None, notify=True)
+
+    def test_random_ids(self):
+        templates = RequestTemplates(2.0)
+        first = json.loads(templates.encode('ping', []))
+        second = json.loads(templates.encode('ping', []))
+        self.assertEqual('ping', first['method'])
+        self.assertNotEqual(first['id'], second['id'])
+
+    def test_fallbacks(self):
+        templates = RequestTemplates(2.0)
+        self.assert_same(templates, '\x00params', [1], 'a')
+        with self.assertRaises(TypeError):
+            templates.encode('add', 5)
+
+
+class IdGeneratorTests(unittest.TestCase):
+    """ Checks the request id strategies. """
+
+    def test_random_ids(self):
+        new_id = jsonrpc.make_id_generator('random')
+        ids = set(new_id() for i in range(1000))
+        self.assertEqual(1000, len(ids))
+        for rpcid in ids:
+            self.assertEqual(8, len(rpcid))
+            self.assertTrue(set(rpcid) <= set(jsonrpc.IDCHARS))
+
+    def test_counter_per_generator(self):
+        first = jsonrpc.make_id_generator('counter')
+        second = jsonrpc.make_id_generator('counter')
+        self.assertEqual([1, 2, 3], [first(), first(), first()])
+        self.assertEqual(1, second())
+
+    def test_prefixed_ids_are_unique(self):
+        new_id = jsonrpc.make_id_generator('prefixed')
+        with ThreadPoolExecutor(8) as executor:
+            ids = list(executor.map(lambda i: new_id(), range(4000)))
+        self.assertEqual(4000, len(set(ids)))
+        prefix = ids[0].rsplit('-', 1)[0]
+        self.assertTrue(prefix.startswith('%x' % os.getpid()))
+        other = jsonrpc.make_id_generator('prefixed')()
+        self.assertNotEqual(prefix, other.rsplit('-', 1)[0])
+        self.assertEqual(
+            'node1-1', jsonrpc.PrefixedIdGenerator('node1')())
+
+    def test_config_and_callables(self):
+        config = Config.instance()
+        self.addCleanup(setattr, config, 'id_generator', config.id_generator)
+        config.id_generator = 'counter'
+        self.assertEqual(1, jsonrpc.make_id_generator()())
+        self.assertEqual('x', jsonrpc.make_id_generator(lambda: 'x')())
+        with self.assertRaises(ValueError):
+            jsonrpc.make_id_generator('no-such-ids')
+
+
+class DispatchTableTests(unittest.TestCase):
+    """ Checks method lookup and params checking in the dispatcher. """
+
+    def setUp(self):
+        self.dispatcher = SimpleJSONRPCDispatcher()
+        self.dispatcher.register_instance(
+            ExampleAggregateService(), allow_dotted_names=True)
+
+    def dispatch(self, method, params):
+        request = jsonrpc.dumps(params, method, rpcid=1)
+        return jsonrpc.loads(self.dispatcher._marshaled_dispatch(request))
+
+    def test_instance_methods(self):
+        self.assertEqual(3, self.dispatch('add', [1, 2])['result'])
+        self.assertEqual(
+            3, self.dispatch('sub_service.add', {'x': 1, 'y': 2})['result'])
+        self.assertNotIn('sub_service.add', self.dispatcher._dispatch_table)
+
+    def test_resolved_names_are_not_kept(self):
+        class CatchAll(object):
+            def __getattr__(self, name):
+                if name.startswith('_'):
+                    raise AttributeError(name)
+                return lambda: name
+
+        service = ExampleAggregateService()
+        self.dispatcher.register_instance(service, allow_dotted_names=True)
+        self.assertEqual(3, self.dispatch('sub_service.add', [1, 2])['result'])
+        service.sub_service.add = lambda x, y: x * y
+        self.assertEqual(2, self.dispatch('sub_service.add', [1, 2])['result'])
+        self.dispatcher.register_instance(CatchAll())
+        size = len(self.dispatcher._dispatch_table)
+        for i in range(100):
+            name = 'name%d' % i
+            self.assertEqual(name, self.dispatch(name, [])['result'])
+        self.assertEqual(size, len(self.dispatcher._dispatch_table))
+
+    def test_invalid_params_are_not_called(self):
+        calls = []
+
+        @self.dispatcher.register_function(name='record')
+        def record(value, scale=1):
+            calls.append(value)
+            return value * scale
+
+        for params in ([], [1, 2, 3], {'scale': 2}, {'value': 1, 'x': 2}):
+            response = self.dispatch('record', params)
+            self.assertEqual(-32602, response['error']['code'])
+        self.assertEqual([], calls)
+        self.assertEqual(6, self.dispatch('record', [3, 2])['result'])
+        self.assertEqual(
+            2, self.dispatch('record', {'value': 2})['result'])
+        self.assertEqual(
+            -32602, self.dispatch('add', [1])['error']['code'])
+        self.assertEqual(6, self.dispatch('summation', [1, 2, 3])['result'])
+
+    def test_errors_and_missing_methods(self):
+        self.dispatcher.register_function(lambda: 1 / 0, 'fail')
+        self.assertEqual(-32603, self.dispatch('fail', [])['error']['code'])
+        for method in ('missing', 'sub_service.missing', '_private'):
+            self.assertEqual(
+                -32601, self.dispatch(method, [])['error']['code'])
+
+    def test_late_registration_wins(self):
+        self.dispatcher.register_function(lambda x, y: x * y, 'add')
+        self.assertEqual(6, self.dispatch('add', [2, 3])['result'])
+        self.dispatcher.register_introspection_functions()
+        self.assertIn(
+            'add', self.dispatch('system.listMethods', [])['result'])
+
+    def test_instance_dispatch_is_used(self):
+        class Service(object):
+            def _dispatch(self, method, params):
+                return [method, params]
+
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_instance(Service())
+        request = jsonrpc.dumps([1], 'anything', rpcid=1)
+        response = jsonrpc.loads(dispatcher._marshaled_dispatch(request))
+        self.assertEqual(['anything', [1]], response['result'])
+
+
+class FaultPolicyTests(unittest.TestCase):
+    """ Checks how exceptions raised by methods become faults. """
+
+    def setUp(self):
+        self.dispatcher = SimpleJSONRPCDispatcher()
+
+        def fail(message):
+            raise KeyError(message)
+
+        self.dispatcher.register_function(fail)
+
+    def error(self):
+        request = jsonrpc.dumps(['missing'], 'fail', rpcid=1)
+        response = self.dispatcher._marshaled_dispatch(request)
+        return jsonrpc.loads(response)['error']
+
+    def test_fast_mode(self):
+        self.assertEqual(
+            {'code': -32603, 'message': "Server error: KeyError: 'missing'"},
+            self.error())
+
+    def test_detailed_mode_samples_tracebacks(self):
+        self.dispatcher.fault_policy = FaultPolicy(
+            'detailed', traceback_every=2)
+        messages = [self.error()['message'] for i in range(4)]
+        self.assertIn('in fail | KeyError', messages[0])
+        self.assertEqual(messages[0], messages[2])
+        self.assertEqual("Server error: KeyError: 'missing'", messages[1])
+        with self.assertRaises(ValueError):
+            FaultPolicy('verbose')
+
+    def test_registered_codes(self):
+        policy = self.dispatcher.fault_policy
+        policy.register(LookupError, -32004)
+        self.assertEqual(
+            {'code': -32004, 'message': "'missing'"}, self.error())
+        policy.register(KeyError, -32005)
+        self.assertEqual(-32005, self.error()['code'])
+        policy = FaultPolicy(codes={ValueError: -32010})
+        self.assertEqual(-32010, policy.fault(ValueError('x')).faultCode)
+        self.assertEqual(-32603, policy.fault(TypeError('x')).faultCode)
+
+
+class JSONArrayDecoderTests(unittest.TestCase):
+
+    def decode_pieces(self, pieces):
+        decoder = jsonrpc.JSONArrayDecoder()
+        elements = []
+        for piece in pieces:
+            elements.extend(decoder.feed(piece))
+        elements.extend(decoder.close())
+        return elements
+
+    def test_byte_at_a_time(self):
+        document = [
+            {"jsonrpc": "2.0", "result": u"h\xe9llo \u2603", "id": "1"},
+            12345, -1.5e10, True, None, "a,b]", [1, [2, 3]], {}]
+        data = json.dumps(document).encode('utf-8')
+        pieces = [data[i:i + 1] for i in range(len(data))]
+        self.assertEqual(document, self.decode_pieces(pieces))
+
+    def test_elements_are_returned_early(self):
+        decoder = jsonrpc.JSONArrayDecoder()
+        self.assertEqual([], decoder.feed(b' [ {"a": 1'))
+        self.assertEqual([{"a": 1}], decoder.feed(b'}, {"b"'))
+        self.assertEqual([{"b": 2}], decoder.feed(b': 2}, 1'))
+        self.assertEqual([], decoder.feed(b'2'))
+        self.assertEqual([12], decoder.feed(b']'))
+        self.assertEqual([], decoder.close())
+
+    def test_empty_and_non_array(self):
+        self.assertEqual([], self.decode_pieces([b'[', b' ]']))
+        self.assertEqual([], self.decode_pieces([b'']))
+        self.assertEqual(
+            [{"error": {"code": 1}}],
+            self.decode_pieces([b'{"error": ', b'{"code": 1}}']))
+
+    def test_escapes_split_between_pieces(self):
+        document = ['a\\', 'b\\"]', {'c': 'd\\\\"}]'}, ['\\'], 'e']
+        data = json.dumps(document).encode('utf-8')
+        for size in (1, 2, 3, 5):
+            pieces = [data[i:i + size] for i in range(0, len(data), size)]
+            self.assertEqual(document, self.decode_pieces(pieces))
+
+    def test_large_elements_are_linear(self):
+        # Every piece must not restart the decoding of the element.
+        document = [{'data': 'x' * (8 * 1024 * 1024)}, 'y' * 100]
+        data = json.dumps(document).encode('utf-8')
+        pieces = [data[i:i + 64 * 1024]
+                  for i in range(0, len(data), 64 * 1024)]
+        start = time.time()
+        self.assertEqual(document, self.decode_pieces(pieces))
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self.decode_pieces([b'[{"a": 1} {"b": 2}]'])
+        with self.assertRaises(ValueError):
+            self.decode_pieces([b'[{"a": 1}, {"b"'])
+        with self.assertRaises(ValueError):
+            self.decode_pieces([b'[1, 2] 3'])
+
+
+class StreamingBatchTests(unittest.TestCase):
+    """
+    Checks batch responses are streamed with chunked encoding, and
+    that a streaming MultiCall hands results out as they arrive.
+    """
+
+    def setUp(self):
+        self.port = get_port()
+        self.server = server_set_up(addr=('', self.port))
+        self.addCleanup(self.server.join)
+        self.addCleanup(self.server.stop)
+
+    def post(self, body, http_version=11):
+        connection = HTTPConnection('localhost', self.port)
+        if http_version == 10:
+            connection._http_vsn = 10
+            connection._http_vsn_str = 'HTTP/1.0'
+        connection.request('POST', '/', body)
+        response = connection.getresponse()
+        return response, response.read()
+
+    def test_batch_is_chunked(self):
+        body = '[%s]' % ','.join(
+            jsonrpc.dumps([i, i], 'add', rpcid=str(i)) for i in range(5))
+        response, data = self.post(body)
+        self.assertEqual('chunked', response.getheader('Transfer-Encoding'))
+        self.assertEqual(
+            [i * 2 for i in range(5)],
+            [entry['result'] for entry in json.loads(data.decode())])
+
+    def test_single_and_http10_are_not_chunked(self):
+        response, data = self.post(jsonrpc.dumps([1, 2], 'add', rpcid='1'))
+        self.assertEqual(None, response.getheader('Transfer-Encoding'))
+        self.assertEqual(3, json.loads(data.decode())['result'])
+        body = '[%s]' % jsonrpc.dumps([1, 2], 'add', rpcid='1')
+        response, data = self.post(body, http_version=10)
+        self.assertEqual(None, response.getheader('Transfer-Encoding'))
+        self.assertEqual(3, json.loads(data.decode())[0]['result'])
+
+    def test_parse_error_quotes_request_text(self):
+        response, data = self.post(
+            u'{"method": "\u2603'.encode('utf-8'), http_version=10)
+        error = json.loads(data.decode())['error']
+        self.assertEqual(-32700, error['code'])
+        self.assertTrue(u'Request {"method": "\u2603' in error['message'])
+
+    def test_notification_batch_is_empty(self):
+        body = '[%s]' % jsonrpc.dumps([1, 2], 'add', notify=True)
+        response, data = self.post(body)
+        self.assertEqual(b'', data)
+
+    def test_streaming_multicall(self):
+        client = Server('http://localhost:%d' % self.port)
+        multicall = MultiCall(client, stream=True)
+        multicall.add(1, 2)
+        multicall._notify.add(1, 2)
+        multicall.foobar()
+        multicall.namespace.sum(1, 2, 3)
+        results = multicall()
+        self.assertEqual(3, results[0])
+        with self.assertRaises(ProtocolError):
+            results[1]
+        self.assertEqual(6, results[2])
+        self.assertEqual(3, len(results))
+
+    def test_elements_are_gathered_into_chunks(self):
+        chunks = []
+        write_chunk = SimpleJSONRPCRequestHandler.write_chunk
+
+        def counting_write_chunk(handler, data):
+            chunks.append(len(data))
+            write_chunk(handler, data)
+
+        SimpleJSONRPCRequestHandler.write_chunk = counting_write_chunk
+        self.addCleanup(setattr, SimpleJSONRPCRequestHandler,
+                        'write_chunk', write_chunk)
+        body = '[%s]' % ','.join(
+            jsonrpc.dumps(['x' * 100, 'y'], 'add', rpcid=str(i))
+            for i in range(2000))
+        response, data = self.post(body)
+        self.assertEqual(2000, len(json.loads(data.decode())))
+        self.assertTrue(2 < len(chunks) < 10)
+        self.assertTrue(max(chunks) < 70 * 1024)
+
+    def test_results_arrive_before_the_batch_ends(self):
+        # Finished elements are only sent early when the dispatcher
+        # knows the next one is not done, i.e. with a batch executor.
+        executor = ThreadPoolExecutor(2)
+        self.addCleanup(executor.shutdown)
+        self.server.rpc_server.batch_executor = executor
+        client = Server('http://localhost:%d' % self.port)
+        multicall = MultiCall(client, stream=True)
+        multicall.ping()
+        multicall.sleep(1)
+        start = time.time()
+        results = iter(multicall())
+        self.assertEqual(True, next(results))
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(1, next(results))
+        self.assertEqual([], list(results))
+
+    def test_abandoned_stream_does_not_break_the_proxy(self):
+        self.server.rpc_server.keepalive_timeout = 5
+        client = Server('http://localhost:%d' % self.port)
+        self.addCleanup(client('close'))
+        for consumed in (1, 0):
+            multicall = MultiCall(client, stream=True)
+            for i in range(200):
+                multicall.add(str(i), 'x' * 1000)
+            results = iter(multicall())
+            for _ in range(consumed):
+                self.assertEqual('0' + 'x' * 1000, next(results))
+            del results
+            self.assertEqual(3, client.add(1, 2))
+            self.assertEqual(7, client.add(3, 4))
+
+    def test_streaming_with_pooled_transport(self):
+        transport = jsonrpc.PooledTransport(max_size=1)
+        self.addCleanup(transport.close)
+        client = Server(
+            'http://localhost:%d' % self.port, transport=transport)
+        for i in range(3):
+            multicall = MultiCall(client, stream=True)
+            multicall.add(i, i)
+            multicall.add(i, 1)
+            self.assertEqual([i * 2, i + 1], list(multicall()))
+        self.assertEqual(1, transport.pool._size)
+
+
+class IncrementalParseTests(StreamingBatchTests):
+    """
+    Runs the streaming tests again with every request body decoded
+    as it is read, and checks the malformed input cases.
+    """
+
+    def setUp(self):
+        StreamingBatchTests.setUp(self)
+        self.server.rpc_server.incremental_parse_threshold = 0
+
+    def test_non_batch_request(self):
+        response, data = self.post(jsonrpc.dumps([2, 3], 'add', rpcid='1'))
+        self.assertEqual(5, json.loads(data.decode())['result'])
+
+    def test_invalid_json_before_any_entry(self):
+        response, data = self.post('[{"jsonrpc": "2.0", "method": ')
+        result = json.loads(data.decode())
+        self.assertEqual(-32700, result['error']['code'])
+        response, data = self.post('{"jsonrpc": "2.0"')
+        self.assertEqual(-32700, json.loads(data.decode())['error']['code'])
+
+    def test_invalid_json_after_an_entry(self):
+        body = '[%s, {"jsonrpc": ' % jsonrpc.dumps([1, 2], 'add', rpcid='1')
+        response, data = self.post(body)
+        result = json.loads(data.decode())
+        self.assertEqual(3, result[0]['result'])
+        self.assertEqual(-32700, result[1]['error']['code'])
+
+    def test_empty_batch(self):
+        response, data = self.post('[]')
+        self.assertEqual(-32600, json.loads(data.decode())['error']['code'])
+
+    def test_response_larger_than_request(self):
+        # Clients send the whole body before they read; answering
+        # while it is still arriving would deadlock once both sides'
+        # socket buffers are full.
+        self.server.rpc_server.register_function(
+            lambda size, pad='': 'x' * size, 'blob')
+        body = '[%s]' % ','.join(
+            jsonrpc.dumps([20000, 'p' * 4000], 'blob', rpcid=str(i))
+            for i in range(1000))
+        connection = HTTPConnection('localhost', self.port, timeout=20)
+        self.addCleanup(connection.close)
+        connection.request('POST', '/', body)
+        result = json.loads(connection.getresponse().read().decode())
+        self.assertEqual(1000, len(result))
+        self.assertEqual('x' * 20000, result[-1]['result'])
+
+    def test_large_batch(self):
+        body = '[%s]' % ','.join(
+            jsonrpc.dumps(['x' * 1000, 'y'], 'add', rpcid=str(i))
+            for i in range(2000))
+        response, data = self.post(body)
+        result = json.loads(data.decode())
+        self.assertEqual(2000, len(result))
+        self.assertEqual('x' * 1000 + 'y', result[-1]['result'])
+
+
+class ConcurrentBatchTests(unittest.TestCase):
+    """
+    Runs batch entries on an executor and checks responses keep
+    their order while the per-batch limit is honoured.
+    """
+
+    def setUp(self):
+        self.port = get_port()
+        self.server = server_set_up(addr=('', self.port))
+        self.rpc_server = self.server.rpc_server
+        self.executor = ThreadPoolExecutor(10)
+        self.rpc_server.batch_executor = self.executor
+        self.addCleanup(self.executor.shutdown)
+        self.addCleanup(self.server.join)
+        self.addCleanup(self.server.stop)
+
+    def run_batch(self, size):
+        multicall = MultiCall(Server('http://localhost:%d' % self.port))
+        for i in range(size):
+            multicall.sleep(0.2)
+            multicall._notify.sleep(0)
+        multicall.add(1, 2)
+        multicall.foobar()
+        start = time.time()
+        results = multicall()
+        return results, time.time() - start
+
+    def test_entries_run_concurrently(self):
+        results, elapsed = self.run_batch(10)
+        self.assertEqual(12, len(results))
+        self.assertEqual([0.2] * 10 + [3], [results[i] for i in range(11)])
+        with self.assertRaises(ProtocolError):
+            results[11]
+        self.assertTrue(elapsed < 1.0)
+
+    def test_per_batch_limit(self):
+        self.rpc_server.max_batch_concurrency = 2
+        results, elapsed = self.run_batch(6)
+        self.assertEqual([0.2] * 6 + [3], [results[i] for i in range(7)])
+        # Twelve entries (six of them instant) two at a time.
+        self.assertTrue(elapsed >= 0.6)
+
+    def test_response_ids_match_requests(self):
+        client = Server('http://localhost:%d' % self.port)
+        request = '[%s]' % ','.join([
+            jsonrpc.dumps([i, i], 'add', rpcid='id-%d' % i)
+            for i in range(20)])
+        responses = client._run_request(request)
+        self.assertEqual(
+            ['id-%d' % i for i in range(20)],
+            [response['id'] for response in responses])
+        self.assertEqual(
+            [i * 2 for i in range(20)],
+            [response['result'] for response in responses])
+
+
+class PooledTransportTests(unittest.TestCase):
+    """
+    Shares a single proxy between threads through the pooled
+    transport, against a threaded keep-alive server.
+    """
+
+    def setUp(self):
+        self.port = get_port()
+        self.server = server_set_up(
+            addr=('', self.port), server_class=PooledJSONRPCServer,
+            workers=8)
+        self.rpc_server = self.server.rpc_server
+        self.rpc_server.keepalive_timeout = 5
+        self.connections = []
+        original_process_request = self.rpc_server.process_request
+
+        def process_request(request, client_address):
+            self.connections.append(client_address)
+            original_process_request(request, client_address)
+
+        self.rpc_server.process_request = process_request
+        self.addCleanup(self.server.join)
+        self.addCleanup(self.server.stop)
+
+    def get_client(self, **kwargs):
+        self.transport = jsonrpc.PooledTransport(**kwargs)
+        # Idle pooled connections would hold server workers until
+        # their keep-alive timeout, so close them before stopping.
+        self.addCleanup(self.transport.close)
+        return Server(
+            'http://localhost:%d' % self.port, transport=self.transport)
+
+    def test_shared_between_threads(self):
+        client = self.get_client(max_size=3)
+        errors = []
+
+        def worker(offset):
+            try:
+                for i in range(20):
+                    self.assertEqual(offset + i, client.add(offset, i))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [Thread(target=worker, args=(i,)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertTrue(len(self.connections) <= 3)
+        self.assertTrue(self.transport.pool._size <= 3)
+
+    def test_stale_connection_is_replaced(self):
+        self.rpc_server.keepalive_timeout = 0.2
+        client = self.get_client()
+        self.assertEqual(3, client.add(1, 2))
+        time.sleep(0.5)
+        self.assertEqual(7, client.add(3, 4))
+        self.assertEqual(2, len(self.connections))
+
+    def test_idle_eviction(self):
+        client = self.get_client(idle_timeout=0.1)
+        self.assertEqual(3, client.add(1, 2))
+        self.assertEqual(3, client.add(1, 2))
+        self.assertEqual(1, len(self.connections))
+        time.sleep(0.3)
+        self.assertEqual(7, client.add(3, 4))
+        self.assertEqual(2, len(self.connections))
+
+    def test_acquire_timeout(self):
+        pool = jsonrpc.ConnectionPool(max_size=1, acquire_timeout=0.1)
+        connection, reused = pool.acquire('localhost', HTTPConnection)
+        self.assertFalse(reused)
+        with self.assertRaises(jsonrpc.PoolTimeout):
+            pool.acquire('localhost', HTTPConnection)
+        pool.release('localhost', connection)
+        self.assertTrue(
+            pool.acquire('localhost', HTTPConnection)[0] is connection)
+
+
+class PooledServerTests(unittest.TestCase):
+    """
+    Checks the worker pool server answers concurrently and sheds
+    load with an overload fault once its queue is full.
+    """
+
+    def setUp(self):
+        self.port = get_port()
+        self.server = server_set_up(
+            addr=('', self.port), server_class=PooledJSONRPCServer,
+            workers=1, queue_size=1)
+        self.addCleanup(self.server.join)
+        self.addCleanup(self.server.stop)
+
+    def get_client(self):
+        return Server('http://localhost:%d' % self.port)
+
+    def test_calls(self):
+        client = self.get_client()
+        self.assertEqual(15, client.add(5, 10))
+        multicall = MultiCall(client)
+        multicall.add(1, 2)
+        multicall.sum(1, 2, 3)
+        self.assertEqual([3, 6], list(multicall()))
+
+    def test_overload_fault(self):
+        rpc_server = self.server.rpc_server
+        results = []
+
+        def call(method, *args):
+            results.append(getattr(self.get_client(), method)(*args))
+
+        # One call keeps the only worker busy, the next fills the queue.
+        slow = Thread(target=call, args=('sleep', 0.5))
+        slow.start()
+        time.sleep(0.1)
+        queued = Thread(target=call, args=('add', 1, 2))
+        queued.start()
+        time.sleep(0.1)
+        self.assertEqual(1, rpc_server.busy_workers)
+        self.assertEqual(1, rpc_server.queue_depth)
+
+        with self.assertRaises(ProtocolError) as error:
+            self.get_client().add(3, 4)
+        self.assertEqual(OVERLOAD_FAULT_CODE, error.exception.args[0][0])
+
+        slow.join()
+        queued.join()
+        self.assertEqual([0.5, 3], results)
+        stats = rpc_server.stats()
+        self.assertEqual(1, stats['rejected_requests'])
+        self.assertEqual(0, stats['queue_depth'])
+        self.assertEqual(1, stats['workers'])
+
+
+@unittest.skipIf(not hasattr(os, 'fork'), "Pre-fork server needs os.fork.")
+class PreForkServerTests(unittest.TestCase):
+    """
+    Runs the pre-fork server with two worker processes and checks
+    dead workers are replaced and shutdown drains them all.
+    """
+
+    reuse_port = False
+
+    def setUp(self):
+        self.port = get_port()
+        self.server = server_set_up(
+            addr=('', self.port), server_class=PreForkJSONRPCServer,
+            processes=2, reuse_port=self.reuse_port)
+        self.rpc_server = self.server.rpc_server
+        self.rpc_server.poll_interval = 0.1
+        self.addCleanup(self.server.join)
+        self.addCleanup(self.server.stop)
+        self.wait_for_workers()
+
+    def wait_for_workers(self):
+        # With SO_REUSEPORT nothing listens until a worker has bound
+        # its own socket, so wait for an actual answer as well.
+        client = Server('http://localhost:%d' % self.port)
+        for i in range(50):
+            if len(self.rpc_server.worker_pids) == 2:
+                try:
+                    client.ping()
+                    return set(self.rpc_server.worker_pids)
+                except ConnectionRefusedError:
+                    pass
+            time.sleep(0.1)
+        self.fail('Workers did not start.')
+
+    def test_calls(self):
+        for i in range(10):
+            self.assertEqual(i * 2, Server(
+                'http://localhost:%d' % self.port).add(i, i))
+
+    def test_dead_worker_is_replaced(self):
+        pids = self.wait_for_workers()
+        dead_pid = pids.pop()
+        os.kill(dead_pid, signal.SIGKILL)
+        for i in range(50):
+            if dead_pid not in self.rpc_server.worker_pids and \
+                    len(self.rpc_server.worker_pids) == 2:
+                break
+            time.sleep(0.1)
+        self.assertNotIn(dead_pid, self.rpc_server.worker_pids)
+        self.assertEqual(2, len(self.rpc_server.worker_pids))
+        client = Server('http://localhost:%d' % self.port)
+        self.assertEqual(15, client.add(5, 10))
+
+    def test_shutdown_drains_workers(self):
+        pids = self.wait_for_workers()
+        results = []
+
+        def slow_call():
+            client = Server('http://localhost:%d' % self.port)
+            results.append(client.sleep(0.5))
+
+        caller = Thread(target=slow_call)
+        caller.start()
+        time.sleep(0.2)
+        self.rpc_server.shutdown()
+        caller.join()
+        self.assertEqual([0.5], results)
+        self.assertEqual(set(), self.rpc_server.worker_pids)
+        for pid in pids:
+            with self.assertRaises(ChildProcessError):
+                os.waitpid(pid, os.WNOHANG)
+
+
+@unittest.skipIf(
+    not hasattr(os, 'fork') or not hasattr(socket, 'SO_REUSEPORT'),
+    "SO_REUSEPORT pre-fork server unsupported in this environment.")
+class ReusePortPreForkServerTests(PreForkServerTests):
+
+    reuse_port = True
+
+
+class ExampleObject(object):
+    def __init__(self, x=None, y=None):
+        self.x = x
+        self.y = y
+
+
+class ExampleSerializedObject(ExampleObject):
+    def _serialize(self):
+        return [self.x, self.y], {'z': self.x + self.y}
+
+
 class ExampleService(object):
     @staticmethod
     def subtract(minuend, subtrahend):
@@ -525,6 +2457,11 @@ class ExampleService(object):
     def ping():
         return True
 
+    @staticmethod
+    def sleep(seconds):
+        time.sleep(seconds)
+        return seconds
+
 
 class ExampleAggregateService(ExampleService):
     """
@@ -534,14 +2471,16 @@ class ExampleAggregateService(ExampleService):
         self.sub_service = ExampleService()
 
 
-def server_set_up(addr, address_family=socket.AF_INET):
+def server_set_up(addr, address_family=socket.AF_INET,
+                  server_class=SimpleJSONRPCServer, **server_kwargs):
     # Not sure this is a good idea to spin up a new server thread
     # for each test... but it seems to work fine.
     def log_request(self, *args, **kwargs):
         """ Making the server output 'quiet' """
         pass
     SimpleJSONRPCRequestHandler.log_request = log_request
-    server = SimpleJSONRPCServer(addr, address_family=address_family)
+    server = server_class(
+        addr, address_family=address_family, **server_kwargs)
     service = ExampleAggregateService()
     # Expose an instance of the service
     server.register_instance(service, allow_dotted_names=True)
@@ -552,9 +2491,11 @@ def server_set_up(addr, address_family=socket.AF_INET):
 
     def stop():
         server.shutdown()
+        server.server_close()
 
     server_proc = Thread(target=server.serve_forever)
     server_proc.daemon = True
     server_proc.stop = stop
+    server_proc.rpc_server = server
     server_proc.start()
     return server_proc